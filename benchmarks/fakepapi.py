@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the instrumented mbedTLS client and server binaries.
+
+It speaks the same protocols as the real binaries (see papiprof.papihelper
+and papiprof.persistent): the server listens on PAPI_SERVER_PORT, prints its
+ready marker and waits for the client, the payload is sent over the
+connection, and both print the <funcname>_<metric> lines of the run. The
+values are drawn from the distributions of the configuration, so that the
+profiler can be benchmarked and checked without PAPI or mbedTLS.
+
+The role is taken from the name it's run as: benchmarks/fake_client and
+benchmarks/fake_server are links to this file.
+
+    fake_client <ciphersuite_id> [<num_bytes_to_send>]
+    fake_server <ciphersuite_id> [<num_bytes_to_send>]
+    fake_client --persistent
+
+The configuration is read from the JSON file in FAKE_PAPI_CONFIG_ENV_VAR,
+on top of DEFAULT_CONFIG:
+
+    {
+        "seed": null,                 # e.g. 0 for reproducible values
+        "ready_marker": "READY",      # printed by the server once listening
+        "startup_delay": 0.0,         # seconds before the server listens, in
+                                      # each run in the persistent mode
+        "run_delay": 0.0,             # seconds of "handshake" in each run
+        "noise_lines": 0,             # unrelated lines printed in each run
+        "functions": {
+            "<funcname>": {"<metric>": <distribution>, ...}
+        },
+        "per_byte": {"<metric>": 12.0},  # cost of the transfer function
+        "per_byte_noise": 0.1,        # relative stdev of the cost of a record
+        "ciphersuite_spread": 0.2,    # the ciphersuites cost up to 20% more
+        "events": <distribution>,     # of the PAPI_EVENTS asked for
+        "regions": {                  # nested regions (see papiprof.regions)
+            "<name>": {"calls": 1, "metrics": {"<metric>": <distribution>},
+                       "children": {"<name>": {...}}}
+        }
+    }
+
+where a distribution is {"distribution": "constant" | "normal" | "lognormal"
+| "uniform", "mean": 123, "stdev": 12} ("min" and "max" for uniform). The
+values are rounded and never negative, like the counters. The transfer
+function (TRANSFER_FUNCTION) is reported when there is a payload, with the
+snapshots of papiprof.records when PAPI_SNAPSHOT_BYTES is set. The metrics
+of a region are its own cost per call, the region_exit lines also count
+those of its children.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import threading
+import zlib
+
+FAKE_PAPI_CONFIG_ENV_VAR = 'FAKE_PAPI_CONFIG'
+# the same names as in papiprof, which this script doesn't import so that it
+# can be copied to a benchmark host on its own
+SERVER_PORT_ENV_VAR = 'PAPI_SERVER_PORT'
+EVENTS_ENV_VAR = 'PAPI_EVENTS'
+SNAPSHOT_BYTES_ENV_VAR = 'PAPI_SNAPSHOT_BYTES'
+PERSISTENT_MODE_ARG = '--persistent'
+DEFAULT_SERVER_PORT = 4433
+
+TRANSFER_FUNCTION = 'ssl_write'
+# bytes of a TLS record, the default snapshot interval
+RECORD_SIZE = 16384
+CONNECT_TIMEOUT = 10
+
+DEFAULT_CONFIG = {
+    'seed': None,
+    'ready_marker': 'READY',
+    'startup_delay': 0.0,
+    'run_delay': 0.0,
+    'noise_lines': 0,
+    'functions': {
+        'handshake': {
+            'virtcyc': {'distribution': 'normal', 'mean': 5620880, 'stdev': 879095},
+            'realcyc': {'distribution': 'normal', 'mean': 5720880, 'stdev': 899095},
+            'virttime': {'distribution': 'normal', 'mean': 1870, 'stdev': 290},
+            'realtime': {'distribution': 'normal', 'mean': 1905, 'stdev': 300},
+        },
+        'baseauth': {
+            'virtcyc': {'distribution': 'lognormal', 'mean': 120000, 'stdev': 15000},
+            'virttime': {'distribution': 'lognormal', 'mean': 40, 'stdev': 5},
+        },
+    },
+    'per_byte': {'virtcyc': 12.0, 'realtime': 0.004},
+    'per_byte_noise': 0.1,
+    'ciphersuite_spread': 0.2,
+    'events': {'distribution': 'normal', 'mean': 100000, 'stdev': 5000},
+    'regions': {},
+}
+
+def load_config():
+    config = dict(DEFAULT_CONFIG)
+    path = os.environ.get(FAKE_PAPI_CONFIG_ENV_VAR)
+    if path:
+        with open(path, 'r') as f:
+            config.update(json.load(f))
+    return config
+
+def draw(rng, spec, scale=1.0):
+    distribution = spec.get('distribution', 'constant')
+    mean = spec.get('mean', 0) * scale
+    stdev = spec.get('stdev', 0) * scale
+    if distribution == 'constant':
+        value = mean
+    elif distribution == 'normal':
+        value = rng.gauss(mean, stdev)
+    elif distribution == 'lognormal':
+        # the parameters of the normal distribution with that mean and stdev
+        sigma2 = math.log(1 + (stdev / mean) ** 2) if mean else 0
+        value = rng.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2)) if mean else 0
+    elif distribution == 'uniform':
+        value = rng.uniform(spec['min'] * scale, spec['max'] * scale)
+    else:
+        raise ValueError(f'Unknown distribution "{distribution}"')
+    return max(0, round(value))
+
+def ciphersuite_scale(config, ciphersuite_id):
+    """A stable cost factor per ciphersuite, so that they don't all cost the
+    same."""
+    return 1 + config['ciphersuite_spread'] * (zlib.crc32(str(ciphersuite_id).encode())
+                                               % 1000) / 1000
+
+def region_lines(regions, rng, scale, lines, parent_id=0):
+    """Appends the region lines of `regions` and their children to `lines`.
+    Returns the total cost of the regions, {metric: value}."""
+    totals = {}
+    # the ids only have to be unique among the open regions
+    region_id = parent_id + 1
+    for name, region in regions.items():
+        for _ in range(region.get('calls', 1)):
+            lines.append(f'region_enter {region_id} {parent_id} {name}')
+            values = {metric_name: draw(rng, spec, scale)
+                      for metric_name, spec in region['metrics'].items()}
+            children = region_lines(region.get('children', {}), rng, scale, lines,
+                                    region_id)
+            for metric_name, value in children.items():
+                values[metric_name] = values.get(metric_name, 0) + value
+            lines.append(f'region_exit {region_id} '
+                         + ' '.join(f'{m} {v}' for m, v in values.items()))
+            for metric_name, value in values.items():
+                totals[metric_name] = totals.get(metric_name, 0) + value
+    return totals
+
+def metric_lines(config, rng, ciphersuite_id, num_bytes):
+    scale = ciphersuite_scale(config, ciphersuite_id)
+    events = [event for event in os.environ.get(EVENTS_ENV_VAR, '').split(',') if event]
+    lines = []
+    for funcname, metrics in config['functions'].items():
+        for metric_name, spec in metrics.items():
+            lines.append(f'{funcname}_{metric_name} {draw(rng, spec, scale)}')
+        for event in events:
+            lines.append(f'{funcname}_{event} {draw(rng, config["events"], scale)}')
+    region_lines(config['regions'], rng, scale, lines)
+
+    if num_bytes:
+        snapshot_bytes = os.environ.get(SNAPSHOT_BYTES_ENV_VAR)
+        step = (int(snapshot_bytes) or RECORD_SIZE) if snapshot_bytes is not None else num_bytes
+        totals = dict.fromkeys(config['per_byte'], 0)
+        sent = 0
+        while sent < num_bytes:
+            record = min(step, num_bytes - sent)
+            sent += record
+            for metric_name, cost in config['per_byte'].items():
+                spec = {'distribution': 'normal', 'mean': cost * record,
+                        'stdev': cost * record * config['per_byte_noise']}
+                totals[metric_name] += draw(rng, spec, scale)
+            if snapshot_bytes is not None:
+                lines.append(f'snapshot {TRANSFER_FUNCTION} {sent} '
+                             + ' '.join(f'{m} {v}' for m, v in totals.items()))
+        lines.extend(f'{TRANSFER_FUNCTION}_{m} {v}' for m, v in totals.items())
+
+    for i in range(config['noise_lines']):
+        lines.append(f'  . Performing the SSL/TLS handshake... ok [{i}]')
+    return lines
+
+def transfer(sock, num_bytes):
+    """Sends `num_bytes` while receiving until the peer is done sending (both
+    peers can have a payload)."""
+    def send():
+        if num_bytes:
+            sock.sendall(b'\0' * num_bytes)
+        sock.shutdown(socket.SHUT_WR)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    while sock.recv(65536):
+        pass
+    sender.join()
+
+def listen(port):
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen(1)
+    return server
+
+def connect(port):
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while True:
+        try:
+            return socket.create_connection(('127.0.0.1', port))
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.001)
+
+def run_once(config, rng, is_server, ciphersuite_id, num_bytes, port,
+             on_listening=None):
+    """Runs a single handshake and transfer, returns the metric lines."""
+    if is_server:
+        with listen(port) as server:
+            on_listening()
+            conn, _ = server.accept()
+            with conn:
+                transfer(conn, num_bytes)
+    else:
+        with connect(port) as conn:
+            transfer(conn, num_bytes)
+    if config['run_delay']:
+        time.sleep(config['run_delay'])
+    return metric_lines(config, rng, ciphersuite_id, num_bytes)
+
+def main(argv):
+    config = load_config()
+    rng = random.Random(config['seed'])
+    is_server = 'server' in os.path.basename(argv[0])
+    port = int(os.environ.get(SERVER_PORT_ENV_VAR, DEFAULT_SERVER_PORT))
+
+    if len(argv) > 1 and argv[1] == PERSISTENT_MODE_ARG:
+        print('ready', flush=True)
+        for line in sys.stdin:
+            command = line.split()
+            if not command or command[0] == 'quit':
+                break
+            run_id, ciphersuite_id = command[1], command[2]
+            num_bytes = int(command[3]) if len(command) > 3 else 0
+            if len(command) > 4:
+                os.environ[EVENTS_ENV_VAR] = command[4]
+            if is_server and config['startup_delay']:
+                time.sleep(config['startup_delay'])
+            try:
+                lines = run_once(config, rng, is_server, ciphersuite_id, num_bytes, port,
+                                 lambda: print(f'ready {run_id}', flush=True))
+                return_code = 0
+            except OSError:
+                lines, return_code = [], 1
+            print('\n'.join(lines + [f'done {run_id} {return_code}']), flush=True)
+        return 0
+
+    ciphersuite_id = argv[1]
+    num_bytes = int(argv[2]) if len(argv) > 2 else 0
+    if is_server and config['startup_delay']:
+        time.sleep(config['startup_delay'])
+    lines = run_once(config, rng, is_server, ciphersuite_id, num_bytes, port,
+                     lambda: print(config['ready_marker'], flush=True))
+    print('\n'.join(lines))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
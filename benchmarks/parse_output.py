@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of the parsing of the client/server PAPI output.
+
+Compares parse_output_into_metrics() with the previous parser (one regex
+scan of the whole output per metric) and reports the time per MB of output.
+
+Usage: python -m benchmarks.parse_output [-s SIZE_MB] [-f FUNCTIONS] [-r REPEAT]
+"""
+import re
+import argparse
+import random
+import timeit
+from collections import defaultdict
+
+from papiprof.papihelper import ALL_METRICS, parse_output_into_metrics
+
+def legacy_parse_output_into_metrics(output, metrics_to_parse=ALL_METRICS):
+    metrics = defaultdict(dict)
+
+    for metric_name in metrics_to_parse:
+        REGEX = fr'(?P<funcname>.+?)_{metric_name} (?P<value>\d+\n\r?)'
+        matches = re.finditer(REGEX, output, flags=re.MULTILINE)
+
+        for match in matches:
+            match = match.groupdict()
+            metrics[match['funcname']][metric_name] = float(match['value'])
+
+    return metrics
+
+def generate_output(size_mb, num_functions):
+    """Generates PAPI output of about `size_mb` MB for `num_functions`
+    instrumented functions, with some unrelated lines mixed in."""
+    lines = []
+    size = 0
+    i = 0
+    while size < size_mb * 1024 * 1024:
+        funcname = f'mbedtls_func_{i % num_functions}'
+        for metric_name in ALL_METRICS:
+            line = f'{funcname}_{metric_name} {random.randint(1, 10**9)}\n'
+            lines.append(line)
+            size += len(line)
+        if i % 10 == 0:
+            line = f'  . Performing the SSL/TLS handshake... ok [{i}]\n'
+            lines.append(line)
+            size += len(line)
+        i += 1
+    return ''.join(lines)
+
+def bench(func, output, repeat):
+    return min(timeit.repeat(lambda: func(output), number=1, repeat=repeat))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the PAPI output '
+                                                 'parser')
+    parser.add_argument('-s', '--size', type=float, default=4,
+                        help='size of the generated output in MB (default: 4)')
+    parser.add_argument('-f', '--functions', type=int, default=500,
+                        help='number of instrumented functions (default: 500)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of repetitions, the best is reported '
+                        '(default: 5)')
+    args = parser.parse_args()
+
+    output = generate_output(args.size, args.functions)
+    size_mb = len(output) / (1024 * 1024)
+    print(f'Output: {size_mb:.2f} MB, {args.functions} functions, '
+          f'{len(ALL_METRICS)} metrics')
+
+    assert legacy_parse_output_into_metrics(output) == parse_output_into_metrics(output)
+
+    for name, func in (('legacy (one pass per metric)', legacy_parse_output_into_metrics),
+                       ('single pass', parse_output_into_metrics)):
+        elapsed = bench(func, output, args.repeat)
+        print(f'\t{name}: {elapsed * 1000 / size_mb:.1f} ms/MB')
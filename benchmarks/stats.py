@@ -0,0 +1,83 @@
+"""
+Benchmark of the statistics of the profiling results.
+
+Compares the mean/stdev of the statistics module (the previous way of
+summarizing the runs) with RunningStats and with summarize(), which also
+computes the median, percentiles, MAD and the confidence interval, with and
+without numpy, and with the same statistics from the statistics module.
+
+With numpy, summarize() takes about 30ms at 1M samples, where the mean/stdev
+of the statistics module take about a second. In plain Python, it takes
+about as long as them, but computes all of the statistics. The bootstrap
+resamples all of the samples with numpy, about 15ms per resample at 1M
+samples, and the sums of batches in plain Python above 10k samples (see
+papiprof.stats.bootstrap_mean_ci()).
+
+Usage: python -m benchmarks.stats [-n NUM_SAMPLES ...] [-r REPEAT]
+"""
+import argparse
+import random
+import statistics
+import timeit
+from array import array
+
+from papiprof import stats
+from papiprof.stats import RunningStats, summarize, DEFAULT_PERCENTILES
+
+def statistics_module(values):
+    return statistics.mean(values), statistics.stdev(values)
+
+def statistics_module_all(values):
+    """The statistics of summarize(), without the confidence interval."""
+    mean, stdev = statistics_module(values)
+    median = statistics.median(values)
+    mad = statistics.median(abs(value - median) for value in values)
+    # statistics.quantiles() is Python 3.8+
+    sorted_values = sorted(values)
+    percentiles = [sorted_values[round(p / 100 * (len(values) - 1))]
+                   for p in (90, 99)]
+    return mean, stdev, min(values), max(values), median, mad, percentiles
+
+def running_stats(values):
+    acc = RunningStats()
+    for value in values:
+        acc.add(value)
+    return acc.mean, acc.stdev
+
+def summarize_python(values):
+    """summarize() without numpy."""
+    summary = stats._summary_python(values, DEFAULT_PERCENTILES, 0)
+    summary['ci'] = stats.normal_mean_ci(summary['avg'], summary['stdev'], len(values))
+    return summary
+
+def bench(func, values, repeat):
+    return min(timeit.repeat(lambda: func(values), number=1, repeat=repeat))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the statistics of '
+                                                 'the profiling results')
+    parser.add_argument('-n', '--num-samples', type=int, nargs='+',
+                        default=[10000, 1000000],
+                        help='series sizes (default: 10000 1000000)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of repetitions, the best is reported '
+                        '(default: 3)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for num_samples in args.num_samples:
+        # virtual cycles of a handshake, as integers like PAPI reports them
+        values = array('d', (float(round(rng.gauss(5620880, 879095)))
+                             for _ in range(num_samples)))
+        print(f'{num_samples} samples:')
+
+        for name, func in (
+                ('statistics mean/stdev', statistics_module),
+                ('statistics (all statistics)', statistics_module_all),
+                ('RunningStats mean/stdev', running_stats),
+                ('summarize (all statistics)', summarize),
+                ('summarize without numpy', summarize_python),
+                ('summarize, 200 bootstrap resamples',
+                 lambda v: summarize(v, num_resamples=200))):
+            elapsed = bench(func, values, args.repeat)
+            print(f'\t{name}: {elapsed * 1000:.1f} ms')
@@ -0,0 +1,499 @@
+"""
+Benchmark and self-test suite of the profiler.
+
+The campaigns are run on the fake binaries of benchmarks/fakepapi.py, so the
+suite runs on any Linux box, without PAPI or mbedTLS:
+
+    selftest   small campaigns with constant metrics, with each runner (and
+               the distributed one, with local workers), whose saved
+               summaries and records are checked against the
+               configuration of the fake binaries, then printm.py compare
+               and export, and the call trees of nested regions
+    overhead   wall time of profile.py per run, with each runner (the fixed
+               cost of a campaign is taken out)
+    parse      throughput of the output parsers
+    aggregate  time to store and summarize the runs of a campaign, as it grows
+    printm     load time of printm.py, without and with the summary cache, as
+               the number of ciphersuites grows
+
+With --json, the results are saved, and with --baseline, compared with the
+results of an earlier run (e.g. of the main branch on the same box). A result
+more than --tolerance percent worse than the baseline is a regression, and
+the suite then exits with 1, as it does when the self-test fails.
+
+Usage: python -m benchmarks.suite [--only selftest overhead ...] [--quick]
+                                  [--json results.json] [--baseline baseline.json]
+"""
+import io
+import os
+import sys
+import csv
+import copy
+import json
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from pathlib import Path
+
+from utils.colors import print_green, print_red, print_yellow
+from papiprof.papihelper import parse_output_into_metrics, StreamingMetricsParser
+from papiprof.stats import summarize_series
+from papiprof.store import ResultsStore
+from papiprof.summarycache import CACHE_FILE
+from papiprof.resultsindex import MANIFEST_FILE
+from papiprof.timeseries import RECORDS_DIR, RECORD_BYTES_METRIC
+from papiprof.distributed import HOSTS_FILE
+from papiprof.calltree import load_call_trees
+from papiprof.compare import VERDICT_REGRESSION, VERDICT_UNCHANGED
+from benchmarks.fakepapi import (FAKE_PAPI_CONFIG_ENV_VAR, TRANSFER_FUNCTION,
+                                 RECORD_SIZE)
+from benchmarks.parse_output import generate_output
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+FAKE_CLIENT = REPO_DIR / 'benchmarks' / 'fake_client'
+FAKE_SERVER = REPO_DIR / 'benchmarks' / 'fake_server'
+
+BENCHMARKS = ('selftest', 'overhead', 'parse', 'aggregate', 'printm')
+RUNNERS = ('threads', 'asyncio', 'persistent')
+RUNNER_DISTRIBUTED = 'distributed'
+SELFTEST_RUNNERS = RUNNERS + (RUNNER_DISTRIBUTED,)
+# local workers of the distributed campaigns
+DISTRIBUTED_WORKERS = 2
+DEFAULT_TOLERANCE = 25
+# the best of this many repetitions of the in-process benchmarks is reported
+REPEAT = 3
+# ports of the campaigns, one range per campaign so they don't collide
+BASE_PORT = 20000 + os.getpid() % 1000 * 20
+
+SELFTEST_CONFIG = {
+    'seed': 0,
+    'functions': {'handshake': {'virtcyc': {'distribution': 'constant', 'mean': 5000000},
+                                'virttime': {'distribution': 'constant', 'mean': 1500}}},
+    'per_byte': {'virtcyc': 12.0},
+    'per_byte_noise': 0,
+    'ciphersuite_spread': 0,
+}
+SELFTEST_CIPHERSUITES = ('60', '174')
+SELFTEST_RUNS = 3
+SELFTEST_BYTES = 40000
+# enough runs for the Mann-Whitney test of printm.py compare to be significant
+COMPARE_RUNS = 8
+COMPARE_SLOWDOWN = 1.1
+# the cost of each region per call, and the expected call tree
+CALLTREE_REGIONS = {
+    'handshake': {'metrics': {'virtcyc': {'mean': 1000}}, 'children': {
+        'ecdh': {'calls': 2, 'metrics': {'virtcyc': {'mean': 300}}, 'children': {
+            'mpi_exp_mod': {'metrics': {'virtcyc': {'mean': 200}}}}}}},
+}
+CALLTREE_NODES = {
+    'handshake': {'virtcyc': 2000, 'self_virtcyc': 1000, 'calls': 1},
+    'handshake;ecdh': {'virtcyc': 1000, 'self_virtcyc': 600, 'calls': 2},
+    'handshake;ecdh;mpi_exp_mod': {'virtcyc': 400, 'self_virtcyc': 400, 'calls': 2},
+}
+
+OVERHEAD_CONFIG = {'seed': 0}
+
+class Results:
+    """{name: {'value': 1.2, 'unit': 'ms', 'higher_is_better': False}}"""
+
+    def __init__(self):
+        self.results = {}
+        self.failures = []
+
+    def add(self, name, value, unit, higher_is_better=False):
+        self.results[name] = {'value': value, 'unit': unit,
+                              'higher_is_better': higher_is_better}
+        print(f'\t{name}: {value:.3f} {unit}')
+
+    def check(self, name, condition, details=''):
+        if condition:
+            print(f'\t{name}: ok')
+        else:
+            print_red(f'\t{name}: FAILED {details}')
+            self.failures.append(name)
+
+def _write_json(path, content):
+    with open(path, 'w') as f:
+        json.dump(content, f)
+
+def _write_ciphers(path, ids):
+    names = {}
+    with open(REPO_DIR / 'ciphers_mbedtls.txt', 'r') as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                names[fields[0]] = fields[1]
+    with open(path, 'w') as f:
+        f.writelines(f'{cs_id} {names.get(cs_id, f"CS-{cs_id}")} NONE\n' for cs_id in ids)
+
+def _start_workers(coordinator_port, port, env):
+    """Starts the local workers of a distributed campaign, each with its own
+    ports, allowed to run the fake binaries only."""
+    return [subprocess.Popen([sys.executable, '-m', 'papiprof.distributed', 'worker',
+                              f'127.0.0.1:{coordinator_port}',
+                              '--host-id', f'selftest-{i}',
+                              '--port', str(port + 2 * i), '--ready-marker', 'READY',
+                              '--client', str(FAKE_CLIENT), '--server', str(FAKE_SERVER),
+                              '--connect-timeout', '30'],
+                             cwd=str(REPO_DIR), env=env, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+            for i in range(DISTRIBUTED_WORKERS)]
+
+def _stop_workers(workers):
+    """Waits for the workers to be done with the coordinator, returns their
+    output."""
+    outputs = []
+    for worker in workers:
+        try:
+            output, _ = worker.communicate(timeout=10)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+            output, _ = worker.communicate()
+        outputs.append(output.decode(errors='replace'))
+    return outputs
+
+def run_campaign(work_dir, name, config, runner, num_runs, port, ciphersuites=('60',),
+                 srv_bytes=0, extra_args=()):
+    """Runs profile.py on the fake binaries, returns (wall time, output dir).
+    With the distributed runner, the runs are made by DISTRIBUTED_WORKERS
+    local workers, on the ports after `port`."""
+    out_dir = Path(work_dir) / name
+    config_path = Path(work_dir) / f'{name}.config.json'
+    ciphers_path = Path(work_dir) / f'{name}.ciphers.txt'
+    _write_json(config_path, config)
+    _write_ciphers(ciphers_path, ciphersuites)
+
+    args = [sys.executable, 'profile.py', str(FAKE_CLIENT), str(FAKE_SERVER),
+            str(num_runs), str(ciphers_path), '0', '0', '0',
+            str(srv_bytes), str(srv_bytes + 1), '1', str(out_dir),
+            '--port', str(port), '--ready-marker', 'READY']
+    coordinator_port = port + 2 * DISTRIBUTED_WORKERS
+    if runner == 'persistent':
+        args.append('--persistent')
+    else:
+        args.extend(['--runner', runner])
+    if runner == RUNNER_DISTRIBUTED:
+        args.extend(['--listen', f'127.0.0.1:{coordinator_port}'])
+    args.extend(extra_args)
+
+    env = dict(os.environ, **{FAKE_PAPI_CONFIG_ENV_VAR: str(config_path)})
+    # the workers keep trying to connect until the coordinator listens
+    workers = (_start_workers(coordinator_port, port, env)
+               if runner == RUNNER_DISTRIBUTED else [])
+    start = time.perf_counter()
+    try:
+        p = subprocess.run(args, cwd=str(REPO_DIR), env=env, stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT)
+        elapsed = time.perf_counter() - start
+    finally:
+        worker_outputs = _stop_workers(workers)
+    if p.returncode != 0:
+        raise RuntimeError(f'profile.py failed:\n{p.stdout.decode(errors="replace")[-2000:]}'
+                           + ''.join(f'\nworker:\n{output[-1000:]}'
+                                     for output in worker_outputs))
+    return elapsed, out_dir
+
+def bench_selftest(results, work_dir, quick):
+    handshake = SELFTEST_CONFIG['functions']['handshake']
+    expected_transfer = SELFTEST_CONFIG['per_byte']['virtcyc'] * SELFTEST_BYTES
+    num_records = math.ceil(SELFTEST_BYTES / RECORD_SIZE) * SELFTEST_RUNS
+
+    for i, runner in enumerate(SELFTEST_RUNNERS):
+        _, out_dir = run_campaign(work_dir, f'selftest-{runner}', SELFTEST_CONFIG, runner,
+                                  SELFTEST_RUNS, BASE_PORT + 20 * i,
+                                  SELFTEST_CIPHERSUITES, SELFTEST_BYTES,
+                                  ['--snapshot-every', '0'])
+        for cs_id in SELFTEST_CIPHERSUITES:
+            path = out_dir / f'server.papi.out.{cs_id}.{SELFTEST_BYTES}.0'
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            summaries = saved['handshake'][cs_id]
+            for metric_name, spec in handshake.items():
+                summary = summaries[metric_name]
+                results.check(f'selftest.{runner}.{cs_id}.handshake_{metric_name}',
+                              (summary['avg'], summary['stdev'], summary['num_runs'])
+                              == (spec['mean'], 0, SELFTEST_RUNS),
+                              f'got {summary["avg"]}±{summary["stdev"]} over '
+                              f'{summary["num_runs"]} runs')
+            transfer = saved[TRANSFER_FUNCTION][cs_id]['virtcyc']['avg']
+            results.check(f'selftest.{runner}.{cs_id}.{TRANSFER_FUNCTION}_virtcyc',
+                          transfer == expected_transfer,
+                          f'got {transfer}, expected {expected_transfer}')
+
+        records = ResultsStore(out_dir / RECORDS_DIR).load(entity='server',
+                                                          metric=RECORD_BYTES_METRIC)
+        results.check(f'selftest.{runner}.records',
+                      sorted(len(values) for values in records.values())
+                      == [num_records] * len(SELFTEST_CIPHERSUITES)
+                      and all(sum(values) == SELFTEST_BYTES * SELFTEST_RUNS
+                              for values in records.values()),
+                      f'got {[len(values) for values in records.values()]} records')
+
+        if runner == RUNNER_DISTRIBUTED:
+            with open(out_dir / HOSTS_FILE, 'r') as f:
+                hosts = json.load(f)
+            num_runs = sum(host['num_runs'] for host in hosts.values())
+            results.check(f'selftest.{runner}.hosts',
+                          num_runs == SELFTEST_RUNS * len(SELFTEST_CIPHERSUITES),
+                          f'got {num_runs} runs on {sorted(hosts)}')
+
+    port = BASE_PORT + 20 * len(SELFTEST_RUNNERS)
+    selftest_compare(results, work_dir, port)
+    selftest_export(results, work_dir)
+    selftest_calltree(results, work_dir, port + 10)
+
+def _printm(*args):
+    return subprocess.run([sys.executable, 'printm.py', *map(str, args)],
+                          cwd=str(REPO_DIR), stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT)
+
+def selftest_compare(results, work_dir, port):
+    """printm.py compare of a campaign with a copy of itself, and with one
+    whose handshake costs COMPARE_SLOWDOWN times more."""
+    slow_config = copy.deepcopy(SELFTEST_CONFIG)
+    slow_config['functions']['handshake']['virtcyc']['mean'] *= COMPARE_SLOWDOWN
+    out_dirs = {}
+    for name, config in (('base', SELFTEST_CONFIG), ('same', SELFTEST_CONFIG),
+                         ('slow', slow_config)):
+        _, out_dirs[name] = run_campaign(work_dir, f'selftest-compare-{name}', config,
+                                         'threads', COMPARE_RUNS, port)
+
+    for candidate, expected_code in (('same', 0), ('slow', 1)):
+        json_path = Path(work_dir) / f'selftest-compare-{candidate}.json'
+        p = _printm('compare', out_dirs['base'], out_dirs[candidate], '--json', json_path)
+        with open(json_path, 'r') as f:
+            verdicts = {(c['entity'], c['function'], c['metric']): c['verdict']
+                        for c in json.load(f)}
+        expected = {key: VERDICT_UNCHANGED for key in verdicts}
+        if candidate == 'slow':
+            expected['server', 'handshake', 'virtcyc'] = VERDICT_REGRESSION
+            expected['client', 'handshake', 'virtcyc'] = VERDICT_REGRESSION
+        results.check(f'selftest.compare.{candidate}',
+                      p.returncode == expected_code and verdicts == expected,
+                      f'exit code {p.returncode}, verdicts '
+                      f'{ {k: v for k, v in verdicts.items() if v != VERDICT_UNCHANGED} }')
+
+def selftest_export(results, work_dir):
+    """printm.py export of the campaign of the threads runner, whose rows
+    are checked against its summaries and samples."""
+    out_path = Path(work_dir) / 'selftest-export.csv'
+    p = _printm('export', Path(work_dir) / 'selftest-threads', out_path, '-s',
+                '-m', 'handshake')
+    with open(out_path, 'r', newline='') as f:
+        rows = [row for row in csv.DictReader(f) if row['metric'] == 'virtcyc']
+    expected = SELFTEST_CONFIG['functions']['handshake']['virtcyc']['mean']
+    samples = [row for row in rows if row['kind'] == 'sample']
+    averages = [row for row in rows if row['kind'] == 'summary'
+                and row['statistic'] == 'avg']
+    results.check('selftest.export.samples',
+                  p.returncode == 0
+                  and len(samples) == SELFTEST_RUNS * len(SELFTEST_CIPHERSUITES)
+                  and all(float(row['value']) == expected for row in samples),
+                  f'exit code {p.returncode}, {len(samples)} sample rows')
+    results.check('selftest.export.summaries',
+                  sorted(row['ciphersuite'] for row in averages)
+                  == sorted(SELFTEST_CIPHERSUITES)
+                  and all(float(row['value']) == expected for row in averages),
+                  f'{len(averages)} average rows')
+
+def selftest_calltree(results, work_dir, port):
+    """The call trees of a campaign whose binaries report nested regions."""
+    config = dict(SELFTEST_CONFIG, functions={}, regions=CALLTREE_REGIONS)
+    _, out_dir = run_campaign(work_dir, 'selftest-calltree', config, 'threads',
+                              SELFTEST_RUNS, port, SELFTEST_CIPHERSUITES)
+    trees = load_call_trees(str(out_dir), 'server')
+    for cs_id in SELFTEST_CIPHERSUITES:
+        nodes = {path: {name: values[name] for name in CALLTREE_NODES.get(path, values)}
+                 for path, values in trees.get(cs_id, {}).items()}
+        results.check(f'selftest.calltree.{cs_id}', nodes == CALLTREE_NODES,
+                      f'got {nodes}')
+    p = subprocess.run([sys.executable, '-m', 'papiprof.calltree', 'folded',
+                        str(out_dir), '-s'], cwd=str(REPO_DIR),
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    results.check('selftest.calltree.folded',
+                  p.returncode == 0 and b'handshake;ecdh;mpi_exp_mod 400' in p.stdout,
+                  p.stdout.decode(errors='replace')[-500:])
+
+def bench_overhead(results, work_dir, quick):
+    num_runs = 20 if quick else 100
+    base_runs = 2
+    for i, runner in enumerate(RUNNERS):
+        port = BASE_PORT + 100 + 20 * i
+        base_time, _ = run_campaign(work_dir, f'overhead-{runner}-base', OVERHEAD_CONFIG,
+                                    runner, base_runs, port)
+        total_time, _ = run_campaign(work_dir, f'overhead-{runner}', OVERHEAD_CONFIG,
+                                     runner, num_runs, port)
+        results.add(f'overhead.{runner}.ms_per_run',
+                    1000 * (total_time - base_time) / (num_runs - base_runs), 'ms')
+
+def bench_parse(results, work_dir, quick):
+    output = generate_output(1 if quick else 4, 500)
+    output += ''.join(f'snapshot {TRANSFER_FUNCTION} {16384 * i} virtcyc {200000 * i}\n'
+                      for i in range(1, 1000))
+    size_mb = len(output) / (1024 * 1024)
+    data = output.encode()
+
+    def streaming():
+        parser = StreamingMetricsParser()
+        for start in range(0, len(data), 65536):
+            parser.feed(data[start:start + 65536])
+        return parser.close()
+
+    assert streaming() == parse_output_into_metrics(output)
+    for name, func in (('single_pass', lambda: parse_output_into_metrics(output)),
+                       ('streaming', streaming)):
+        elapsed = _best_of(func)
+        results.add(f'parse.{name}.mb_per_s', size_mb / elapsed, 'MB/s',
+                    higher_is_better=True)
+
+def _best_of(func, setup=None, repeat=REPEAT):
+    """The best wall time of `repeat` calls of `func`, each after `setup`."""
+    best = math.inf
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_aggregate(results, work_dir, quick):
+    functions = [f'mbedtls_func_{i}' for i in range(10)]
+    metrics = ('virttime', 'realtime', 'virtcyc', 'realcyc')
+    for num_runs in ((100, 1000) if quick else (100, 1000, 10000)):
+        store_path = Path(work_dir) / f'aggregate-{num_runs}'
+        runs = [{funcname: {metric_name: float(1000 + (i * 7919 + j) % 997)
+                            for j, metric_name in enumerate(metrics)}
+                 for funcname in functions} for i in range(num_runs)]
+
+        def remove_store():
+            shutil.rmtree(store_path, ignore_errors=True)
+
+        def append():
+            store = ResultsStore(store_path, block_size=None)
+            for profs in runs:
+                store.append_run('bench', 'client', '60', 0, 0, profs)
+            store.flush()
+
+        def summarize():
+            store = ResultsStore(store_path)
+            return summarize_series(store.load(campaign='bench', entity='client'))
+
+        results.add(f'aggregate.append.{num_runs}_runs.ms',
+                    1000 * _best_of(append, remove_store), 'ms')
+        results.add(f'aggregate.summarize.{num_runs}_runs.ms',
+                    1000 * _best_of(summarize), 'ms')
+
+def _write_results_dir(path, num_ciphersuites, num_functions=10):
+    """Writes *.papi.out.* files like those of a campaign of
+    `num_ciphersuites` ciphersuites and 3 payload sizes."""
+    path.mkdir(parents=True, exist_ok=True)
+    summary = {'avg': 5620880.0, 'stdev': 879095.0, 'min': 4000000.0,
+               'max': 7000000.0, 'median': 5600000.0, 'p50': 5600000.0,
+               'p90': 6800000.0, 'p99': 6990000.0, 'mad': 500000.0,
+               'ci': [5400000.0, 5800000.0], 'num_runs': 100}
+    cs_ids = [str(cs_id) for cs_id in range(1, num_ciphersuites + 1)]
+    for entity in ('client', 'server'):
+        for num_bytes in (0, 1024, 16384):
+            for cs_id in cs_ids:
+                content = {f'mbedtls_func_{i}': {cs_id: dict(
+                    {metric_name: summary for metric_name in
+                     ('virttime', 'realtime', 'virtcyc', 'realcyc')}, num_runs=100)}
+                    for i in range(num_functions)}
+                _write_json(path / f'{entity}.papi.out.{cs_id}.{num_bytes}.0', content)
+
+def bench_printm(results, work_dir, quick):
+    import printm
+
+    for num_ciphersuites in ((10, 100) if quick else (10, 100, 500)):
+        results_dir = Path(work_dir) / f'printm-{num_ciphersuites}'
+        _write_results_dir(results_dir, num_ciphersuites)
+
+        def load(use_cache):
+            with contextlib.redirect_stdout(io.StringIO()):
+                printm.run(None, str(results_dir), True, False, None, False, False,
+                           use_cache)
+
+        def remove_cache():
+            for file_name in (CACHE_FILE, MANIFEST_FILE):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(results_dir / file_name)
+
+        results.add(f'printm.no_cache.{num_ciphersuites}_cs.ms',
+                    1000 * _best_of(lambda: load(False)), 'ms')
+        results.add(f'printm.cache_build.{num_ciphersuites}_cs.ms',
+                    1000 * _best_of(lambda: load(True), remove_cache), 'ms')
+        results.add(f'printm.cache_hit.{num_ciphersuites}_cs.ms',
+                    1000 * _best_of(lambda: load(True)), 'ms')
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Prints the changes from the baseline results, returns the names of the
+    regressions."""
+    regressions = []
+    print_green(f'--- BASELINE (tolerance {tolerance}%) ---')
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]['value']
+        value = result['value']
+        change = (value - base) / base * 100 if base else 0
+        worse = -change if result['higher_is_better'] else change
+        line = f'\t{name}: {base:.3f} -> {value:.3f} {result["unit"]} ({change:+.1f}%)'
+        if worse > tolerance:
+            print_red(f'{line} REGRESSION')
+            regressions.append(name)
+        elif worse < -tolerance:
+            print_green(f'{line} IMPROVEMENT')
+        else:
+            print(line)
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark and self-test the '
+                                     'profiler on fake client/server binaries')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS,
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--quick', action='store_true',
+                        help='smaller campaigns, e.g. for a quick check')
+    parser.add_argument('--json', type=str, default=None,
+                        help='save the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='percent by which a result can be worse than the '
+                        f'baseline (default: {DEFAULT_TOLERANCE})')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the campaigns and results directories')
+    args = parser.parse_args()
+
+    results = Results()
+    work_dir = tempfile.mkdtemp(prefix='papiprof-bench-')
+    try:
+        for name, bench in (('selftest', bench_selftest), ('overhead', bench_overhead),
+                            ('parse', bench_parse), ('aggregate', bench_aggregate),
+                            ('printm', bench_printm)):
+            if name in args.only:
+                print_green(f'--- {name.upper()} ---')
+                bench(results, work_dir, args.quick)
+    finally:
+        if args.keep:
+            print(f'Campaigns kept in {work_dir}')
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        _write_json(args.json, results.results)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare_with_baseline(results.results, json.load(f),
+                                                args.tolerance)
+    if results.failures:
+        print_red(f'[!] Self-test failures: {", ".join(results.failures)}')
+    if regressions:
+        print_yellow(f'[!] Regressions: {", ".join(regressions)}')
+    sys.exit(1 if results.failures or regressions else 0)
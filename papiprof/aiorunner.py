@@ -0,0 +1,255 @@
+"""Runs the client/server pairs as asyncio subprocesses.
+
+A single event loop, running in a background thread, drives the processes of
+all of the pairs. Their output is parsed as it arrives with a
+StreamingMetricsParser instead of being buffered until they exit, and a
+process that runs for longer than its timeout is killed.
+"""
+import sys
+import time
+import asyncio
+import threading
+from collections import deque
+
+from papiprof import timing
+from papiprof.papihelper import (StreamingMetricsParser, is_port_listening,
+                                 _popen_kwargs, pin_process)
+
+DEFAULT_PROCESS_TIMEOUT = 60
+# return code reported for a process that was killed after its timeout
+TIMEOUT_RETURN_CODE = -1001
+
+READ_CHUNK_SIZE = 65536
+
+# asyncio.Task.all_tasks() was removed in Python 3.9, asyncio.all_tasks()
+# was added in 3.7
+_all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+_current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+
+async def _read_stream(stream, on_data):
+    while True:
+        data = await stream.read(READ_CHUNK_SIZE)
+        if not data:
+            return
+        on_data(data)
+
+async def run_process(args, port=None, cpus=None, timeout=None,
+                      show_output=False, name='Process', ready_event=None,
+                      ready_marker=None, events=None):
+    """
+    Runs a client or server and returns (return_code, metrics), like
+    papihelper.run_client().
+
+    If `ready_event` (an asyncio.Event) is given, it's set once `ready_marker`
+    shows up in the output or, if there is no marker, right after the process
+    is spawned. It's always set before returning.
+
+    The process is killed if it's still running after `timeout` seconds, in
+    which case the return code is TIMEOUT_RETURN_CODE.
+    """
+    parser = StreamingMetricsParser()
+    marker = ready_marker.encode() if ready_marker else None
+    # the end of the output so far, to find a marker split between two reads
+    tail = [b'']
+    # seconds spent parsing the output, added up over the reads
+    parse_time = [0]
+
+    def on_stdout(data):
+        parse_start = time.perf_counter()
+        parser.feed(data)
+        parse_time[0] += time.perf_counter() - parse_start
+        if show_output:
+            print(f'{name} OUT: {data.decode(errors="replace")}', end='')
+        if marker and not ready_event.is_set():
+            window = tail[0] + data
+            if marker in window:
+                ready_event.set()
+            tail[0] = window[-len(marker):]
+
+    def on_stderr(data):
+        print(f'{name} ERR: {data.decode(errors="replace")}', end='')
+
+    try:
+        spawn_start = time.perf_counter()
+        p = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE if show_output else asyncio.subprocess.DEVNULL,
+            **_popen_kwargs(port, events))
+        pin_process(p.pid, cpus)
+        communicate_start = time.perf_counter()
+        timing.add(timing.PHASE_SPAWN, communicate_start - spawn_start)
+        if ready_event is not None and not marker:
+            ready_event.set()
+
+        tasks = [asyncio.ensure_future(_read_stream(p.stdout, on_stdout)),
+                 asyncio.ensure_future(p.wait())]
+        if show_output:
+            tasks.append(asyncio.ensure_future(_read_stream(p.stderr, on_stderr)))
+        try:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                # the readers are done once the process' pipes are closed
+                p.kill()
+                await asyncio.wait(pending)
+                return_code = TIMEOUT_RETURN_CODE
+            else:
+                return_code = p.returncode
+            timing.add(timing.PHASE_COMMUNICATE, time.perf_counter() - communicate_start)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            if p.returncode is None:
+                p.kill()
+            raise
+    finally:
+        if ready_event is not None:
+            ready_event.set()
+
+    parse_start = time.perf_counter()
+    metrics = parser.close()
+    timing.add(timing.PHASE_PARSE, parse_time[0] + time.perf_counter() - parse_start)
+    return return_code, metrics
+
+async def wait_for_server_ready(ready_event, port=None, max_wait=1,
+                                poll_interval=0.001, has_ready_marker=False):
+    """The asyncio counterpart of papihelper.wait_for_server_ready()."""
+    deadline = time.monotonic() + max_wait
+
+    try:
+        await asyncio.wait_for(ready_event.wait(), max_wait)
+    except asyncio.TimeoutError:
+        return False
+
+    if port is None:
+        if not has_ready_marker:
+            await asyncio.sleep(max(deadline - time.monotonic(), 0))
+        return True
+
+    while True:
+        listening = is_port_listening(port)
+        remaining = deadline - time.monotonic()
+
+        if listening is None:
+            await asyncio.sleep(max(remaining, 0))
+            return True
+        if listening:
+            return True
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(poll_interval)
+
+def _process_args(path, ciphersuite_id, num_bytes_to_send):
+    args = [path, str(ciphersuite_id)]
+    if num_bytes_to_send:
+        args.append(str(num_bytes_to_send))
+    return args
+
+async def profile_pair(job, slot, client_path, server_path, is_verbose=False,
+                       ready_marker=None, probe_port=True, max_wait=1,
+                       timeout=DEFAULT_PROCESS_TIMEOUT):
+    """Runs a client/server pair for `job` on `slot`. Returns the same dict as
+    profile.profile_pair()."""
+    ready_event = asyncio.Event()
+
+    wait_start = time.monotonic()
+    server = asyncio.ensure_future(run_process(
+        _process_args(server_path, job.sc_id, job.srv_bytes_to_send),
+        slot.port, slot.server_cpus, timeout, is_verbose, 'Server',
+        ready_event, ready_marker, job.events))
+
+    ready_port = slot.port if probe_port else None
+    is_ready = await wait_for_server_ready(ready_event, ready_port, max_wait,
+                                           has_ready_marker=ready_marker is not None)
+    measure_start = time.monotonic()
+
+    cli_ret, cli_prof = await run_process(
+        _process_args(client_path, job.sc_id, job.cli_bytes_to_send),
+        slot.port, slot.client_cpus, timeout, is_verbose, 'Client',
+        events=job.events)
+    srv_ret, srv_prof = await server
+    measure_end = time.monotonic()
+
+    return {
+        'slot': slot,
+        'srv_ret': srv_ret,
+        'cli_ret': cli_ret,
+        'srv_prof': srv_prof,
+        'cli_prof': cli_prof,
+        'is_ready': is_ready,
+        'wait_time': measure_start - wait_start,
+        'measure_time': measure_end - measure_start,
+    }
+
+class AsyncPairRunner:
+    """Runs profiling jobs on the pair slots from a single event loop."""
+
+    def __init__(self, pair_slots, **pair_options):
+        """`pair_options` are passed on to profile_pair()."""
+        self.pair_slots = pair_slots
+        self.pair_options = pair_options
+        self._loop = asyncio.new_event_loop()
+        if sys.version_info < (3, 8) and sys.platform != 'win32':
+            # the default child watcher of older versions has to be attached
+            # from the main thread to get the exit status of the processes
+            asyncio.get_child_watcher().attach_loop(self._loop)
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                         daemon=True)
+        self._thread.start()
+        self._slots = self._call(self._create_slots_queue)
+
+    def _call(self, func):
+        """Runs `func` in the event loop's thread and returns its result."""
+        async def call():
+            return func()
+        return asyncio.run_coroutine_threadsafe(call(), self._loop).result()
+
+    def _create_slots_queue(self):
+        slots = asyncio.Queue()
+        for slot in self.pair_slots:
+            slots.put_nowait(slot)
+        return slots
+
+    async def _run_job(self, job, should_skip):
+        slot = await self._slots.get()
+        try:
+            if should_skip and should_skip(job):
+                return None
+            return await profile_pair(job, slot, **self.pair_options)
+        finally:
+            self._slots.put_nowait(slot)
+
+    def imap(self, jobs, should_skip=None):
+        """
+        Yields the results of the jobs in the same order as the jobs, like
+        ThreadPool.imap(). Up to twice as many jobs as there are pairs are
+        queued at once, so that no pair waits for the next job. Jobs for which
+        `should_skip(job)` is true when their turn comes yield None.
+        """
+        queued = deque()
+        jobs = iter(jobs)
+        max_queued = 2 * len(self.pair_slots)
+
+        while True:
+            for job in jobs:
+                queued.append(asyncio.run_coroutine_threadsafe(
+                    self._run_job(job, should_skip), self._loop))
+                if len(queued) >= max_queued:
+                    break
+            if not queued:
+                return
+            yield queued.popleft().result()
+
+    def close(self):
+        """Cancels the queued jobs and stops the event loop."""
+        async def cancel_all():
+            tasks = [task for task in _all_tasks()
+                     if task is not _current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(cancel_all(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+        self._loop.close()
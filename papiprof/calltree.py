@@ -0,0 +1,160 @@
+"""Call trees of the nested regions of a results directory.
+
+The nodes of the call trees (see papiprof.regions) are saved as functions
+named after their path, e.g. "handshake;ecdh_compute_shared". This module
+puts the summaries of these functions back into a tree, for each ciphersuite,
+with the average inclusive and exclusive (self) cost of each node over the
+runs, and the share of the total cost of the tree:
+
+    handshake                   1200000 100.0%   self   420000  35.0%  calls 1
+        ecdh_compute_shared      610000  50.8%   self   100000   8.3%  calls 1
+            mpi_exp_mod          510000  42.5%   self   510000  42.5%  calls 2
+
+or writes them as folded stacks, one line per node with its self cost, the
+input of flamegraph.pl and speedscope:
+
+    TLS-ECDHE-RSA-WITH-AES-128-GCM-SHA256;handshake;ecdh_compute_shared 100000
+
+The ciphersuite is the root frame of each stack when there are several
+ciphersuites.
+
+Usage:
+    python -m papiprof.calltree tree <results_dir> [-c|-s] [--metric virtcyc]
+    python -m papiprof.calltree folded <results_dir> [-c|-s] [-o out.folded]
+"""
+import sys
+import argparse
+from collections import defaultdict
+from os import listdir
+from os.path import isfile, join
+
+from utils.colors import print_green, print_yellow
+from papiprof.ciphersuites import CipherSuiteRegistry
+from papiprof.metrics import METRIC_VIRTCYC, format_metric_value
+from papiprof.regions import PATH_SEPARATOR, SELF_METRIC_PREFIX, CALLS_METRIC
+from papiprof.store import PAPI_OUT_FILE_PREFIX
+from papiprof.summarycache import SummaryCache
+
+DEFAULT_CALLTREE_METRIC = METRIC_VIRTCYC
+
+def load_call_trees(results_dir, entity, use_cache=True):
+    """
+    Reads the call trees of `entity` from the summaries of `results_dir`:
+    {cipherid: {path: {measurment: avg}}}
+    """
+    all_files = sorted(f for f in listdir(results_dir)
+                       if isfile(join(results_dir, f)) and PAPI_OUT_FILE_PREFIX in f)
+    summary_cache = SummaryCache(results_dir, use_cache)
+    summary_cache.update(all_files)
+    merged = summary_cache.merged_metrics(entity, [f for f in all_files
+                                                   if f.startswith(entity)])
+    summary_cache.save()
+
+    trees = defaultdict(dict)
+    for funcname, cs_ids in merged.items():
+        for cs_id, measurments in cs_ids.items():
+            # only the nodes of a call tree count their calls
+            if CALLS_METRIC not in measurments:
+                continue
+            trees[cs_id][funcname] = {name: values['avg']
+                                      for name, values in measurments.items()}
+    return trees
+
+def _children(nodes):
+    """{parent path: [child path, ...]}, the root being ''"""
+    children = defaultdict(list)
+    for path in nodes:
+        children[path.rpartition(PATH_SEPARATOR)[0]].append(path)
+    return children
+
+def _total_cost(nodes, children, metric):
+    return sum(nodes[path].get(metric, 0) for path in children[''])
+
+def print_call_tree(nodes, metric=DEFAULT_CALLTREE_METRIC, indent='\t'):
+    """Prints the nodes of a call tree, the costliest children first."""
+    children = _children(nodes)
+    total = _total_cost(nodes, children, metric)
+    self_metric = f'{SELF_METRIC_PREFIX}{metric}'
+
+    def share(value):
+        return f'{100 * value / total:5.1f}%' if total else '    -'
+
+    def print_node(path, depth):
+        values = nodes[path]
+        inclusive = values.get(metric, 0)
+        exclusive = values.get(self_metric, 0)
+        name = path.rpartition(PATH_SEPARATOR)[2]
+        print(f'{indent}{"    " * depth}{name:<{max(1, 24 - 4 * depth)}} '
+              f'{format_metric_value(inclusive, 0):>10} {share(inclusive)}   '
+              f'self {format_metric_value(exclusive, 0):>10} {share(exclusive)}  '
+              f'calls {values[CALLS_METRIC]:g}')
+        for child in sorted(children[path], key=lambda p: -nodes[p].get(metric, 0)):
+            print_node(child, depth + 1)
+
+    for path in sorted(children[''], key=lambda p: -nodes[p].get(metric, 0)):
+        print_node(path, 0)
+
+def folded_stacks(nodes, metric=DEFAULT_CALLTREE_METRIC, root=None):
+    """
+    Yields the folded stack of each node of a call tree, with its self cost
+    (rounded, as flame graphs expect integers). Negative self costs, from the
+    noise of the measurements, are written as 0.
+    """
+    self_metric = f'{SELF_METRIC_PREFIX}{metric}'
+    for path in sorted(nodes):
+        stack = f'{root}{PATH_SEPARATOR}{path}' if root else path
+        yield f'{stack} {max(0, round(nodes[path].get(self_metric, 0)))}'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Call trees of the nested '
+                                     'regions of a results directory')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    tree_parser = subparsers.add_parser('tree', help='print the call trees')
+    folded_parser = subparsers.add_parser('folded', help='write the call trees '
+                                          'as folded stacks')
+    folded_parser.add_argument('-o', '--output', type=str, default=None,
+                               help='file to write the folded stacks to '
+                               '(default: stdout)')
+    for subparser in (tree_parser, folded_parser):
+        subparser.add_argument('results_dir', type=str, help='results directory')
+        group = subparser.add_mutually_exclusive_group()
+        group.add_argument('-c', '--client', action='store_true',
+                           help='client call trees (default)')
+        group.add_argument('-s', '--server', action='store_true',
+                           help='server call trees')
+        subparser.add_argument('--metric', type=str, default=DEFAULT_CALLTREE_METRIC,
+                               help=f'cost metric (default: {DEFAULT_CALLTREE_METRIC})')
+        subparser.add_argument('--ciphersuites', nargs='+', default=None,
+                               help='ids of the ciphersuites (default: all)')
+        subparser.add_argument('--ciphers', type=str, default=None,
+                               help='ciphersuite list, to name the ciphersuites '
+                               '(default: ciphers_mbedtls.txt)')
+        subparser.add_argument('--no-cache', action='store_true',
+                               help='don\'t use the summary cache')
+
+    args = parser.parse_args()
+    entity = 'server' if args.server else 'client'
+    trees = load_call_trees(args.results_dir, entity, not args.no_cache)
+    registry = CipherSuiteRegistry.from_file(args.ciphers)
+    cs_ids = [cs_id for cs_id in registry.sorted_ids(trees)
+              if not args.ciphersuites or cs_id in args.ciphersuites]
+    if not cs_ids:
+        print_yellow(f'[!] No {entity} regions in {args.results_dir}')
+        sys.exit(1)
+
+    if args.command == 'tree':
+        for cs_id in cs_ids:
+            print_green(f'{registry.name(cs_id)} ({entity}, {args.metric})')
+            print_call_tree(trees[cs_id], args.metric)
+    else:
+        out = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            for cs_id in cs_ids:
+                root = registry.name(cs_id) if len(cs_ids) > 1 else None
+                for line in folded_stacks(trees[cs_id], args.metric, root):
+                    print(line, file=out)
+        finally:
+            if args.output:
+                out.close()
@@ -0,0 +1,164 @@
+"""Metadata of the TLS ciphersuites, looked up by their IANA id.
+
+The registry is built from a ciphersuite list in the format of profile.py
+(see papihelper.parse_ciphersuite_list_from_file()), on top of the full list
+of the ciphersuites of mbedTLS in MBEDTLS_CIPHERSUITES_FILE. The attributes
+of each ciphersuite are parsed from its mbedTLS name:
+
+    TLS-ECDHE-RSA-WITH-AES-128-GCM-SHA256
+        key_exchange  ECDHE-RSA     (the mbedTLS key exchange)
+        kx            ECDHE         (how the premaster secret is agreed on)
+        auth          RSA
+        cipher        AES-128-GCM
+        mac           AEAD          (SHA256 is the PRF hash)
+
+    TLS-PSK-WITH-AES-128-CBC-SHA256
+        key_exchange PSK, kx PSK, auth PSK, cipher AES-128-CBC, mac SHA256
+
+The attributes of a name that isn't in this format are None. Reports sort
+the ciphersuites by key exchange (see KEY_EXCHANGE_ORDER), cipher and MAC,
+and can group them by any of the attributes.
+"""
+from collections import namedtuple
+from pathlib import Path
+
+from papiprof.papihelper import parse_ciphersuite_list_from_file
+
+MBEDTLS_CIPHERSUITES_FILE = Path(__file__).resolve().parent.parent / 'ciphers_mbedtls.txt'
+
+CipherSuite = namedtuple('CipherSuite', ['id', 'name', 'tag', 'key_exchange',
+                                         'kx', 'auth', 'cipher', 'mac'])
+
+ATTRIBUTES = ('key_exchange', 'kx', 'auth', 'cipher', 'mac')
+
+# {mbedTLS key exchange: (kx, auth)}
+KEY_EXCHANGES = {
+    'RSA': ('RSA', 'RSA'),
+    'DHE-RSA': ('DHE', 'RSA'),
+    'ECDHE-RSA': ('ECDHE', 'RSA'),
+    'ECDHE-ECDSA': ('ECDHE', 'ECDSA'),
+    'ECDH-RSA': ('ECDH', 'RSA'),
+    'ECDH-ECDSA': ('ECDH', 'ECDSA'),
+    'PSK': ('PSK', 'PSK'),
+    'DHE-PSK': ('DHE', 'PSK'),
+    'ECDHE-PSK': ('ECDHE', 'PSK'),
+    # the server is authenticated with its certificate, the client with the PSK
+    'RSA-PSK': ('RSA', 'RSA-PSK'),
+    'ECJPAKE': ('ECJPAKE', 'ECJPAKE'),
+}
+
+# order of the key exchanges in the reports of printm.py
+KEY_EXCHANGE_ORDER = ('PSK', 'ECDHE-PSK', 'DHE-PSK', 'ECDH-RSA', 'ECDHE-RSA',
+                      'DHE-RSA', 'RSA', 'RSA-PSK', 'ECDH-ECDSA', 'ECDHE-ECDSA',
+                      'ECJPAKE')
+
+AEAD_MODES = ('GCM', 'CCM', 'CCM-8', 'POLY1305')
+MAC_HASHES = ('MD5', 'SHA', 'SHA256', 'SHA384')
+
+def parse_ciphersuite_name(name):
+    """Returns (key_exchange, kx, auth, cipher, mac) of an mbedTLS
+    ciphersuite name, with None for what can't be parsed."""
+    prefix, sep, bulk = name.partition('-WITH-')
+    if not prefix.startswith('TLS-'):
+        return (None,) * 5
+    key_exchange = prefix[len('TLS-'):]
+    if key_exchange in KEY_EXCHANGES:
+        kx, auth = KEY_EXCHANGES[key_exchange]
+    else:
+        kx, _, auth = key_exchange.partition('-')
+        auth = auth or kx
+
+    if not sep:
+        return key_exchange, kx, auth, None, None
+    cipher, _, mac = bulk.rpartition('-')
+    if mac not in MAC_HASHES:
+        # e.g. AES-128-CCM-8, which has no PRF hash in its name
+        cipher, mac = bulk, None
+    if any(cipher.endswith(mode) for mode in AEAD_MODES):
+        mac = 'AEAD'
+    return key_exchange, kx, auth, cipher, mac
+
+def _sort_position(value, order):
+    return (order.index(value), '') if value in order else (len(order), value or '')
+
+class CipherSuiteRegistry:
+    """The ciphersuites by id, e.g. registry['60'].key_exchange."""
+
+    def __init__(self, ciphersuites=()):
+        self._ciphersuites = {}
+        for ciphersuite in ciphersuites:
+            self.add(*ciphersuite)
+
+    @classmethod
+    def from_file(cls, ciphers_path=None, include_mbedtls=True):
+        """
+        The ciphersuites of `ciphers_path`, on top of those of mbedTLS (unless
+        not `include_mbedtls`), so that the list of a campaign can rename them.
+        """
+        registry = cls()
+        paths = [MBEDTLS_CIPHERSUITES_FILE] if include_mbedtls else []
+        if ciphers_path:
+            paths.append(ciphers_path)
+        for path in paths:
+            for sc_id, name, tag in parse_ciphersuite_list_from_file(path):
+                registry.add(sc_id, name, tag)
+        return registry
+
+    def add(self, sc_id, name, tag=''):
+        attributes = parse_ciphersuite_name(name)
+        known = self._ciphersuites.get(str(sc_id))
+        if known is not None:
+            # a name of its own, e.g. "PSK", keeps the attributes of mbedTLS
+            attributes = [value if value is not None else known_value
+                          for value, known_value in zip(attributes, known[3:])]
+        self._ciphersuites[str(sc_id)] = CipherSuite(str(sc_id), name, tag, *attributes)
+
+    def __getitem__(self, sc_id):
+        """The ciphersuite with the id `sc_id`, one named after its id if it's
+        unknown."""
+        sc_id = str(sc_id)
+        ciphersuite = self._ciphersuites.get(sc_id)
+        if ciphersuite is None:
+            return CipherSuite(sc_id, sc_id, '', None, None, None, None, None)
+        return ciphersuite
+
+    def __contains__(self, sc_id):
+        return str(sc_id) in self._ciphersuites
+
+    def __len__(self):
+        return len(self._ciphersuites)
+
+    def name(self, sc_id):
+        return self[sc_id].name
+
+    def names(self):
+        return {sc_id: ciphersuite.name
+                for sc_id, ciphersuite in self._ciphersuites.items()}
+
+    def sort_key(self, sc_id, attributes=('key_exchange', 'cipher', 'mac')):
+        """Sort key of a ciphersuite id, by its `attributes`, then by id. Key
+        exchanges are in KEY_EXCHANGE_ORDER, other attributes in alphabetical
+        order, unknown values last."""
+        ciphersuite = self[sc_id]
+        key = []
+        for attribute in attributes:
+            value = getattr(ciphersuite, attribute)
+            order = KEY_EXCHANGE_ORDER if attribute == 'key_exchange' else ()
+            key.append(_sort_position(value, order))
+        sc_id = str(sc_id)
+        key.append((0, int(sc_id), '') if sc_id.isdigit() else (1, 0, sc_id))
+        return key
+
+    def sorted_ids(self, sc_ids, attributes=('key_exchange', 'cipher', 'mac')):
+        return sorted(sc_ids, key=lambda sc_id: self.sort_key(sc_id, attributes))
+
+    def group_ids(self, sc_ids, attribute):
+        """Groups ciphersuite ids by one of the ATTRIBUTES: {value: [id, ...]},
+        in the sort order of the values."""
+        if attribute not in ATTRIBUTES:
+            raise ValueError(f'Unknown ciphersuite attribute "{attribute}", '
+                             f'expected one of {", ".join(ATTRIBUTES)}')
+        groups = {}
+        for sc_id in self.sorted_ids(sc_ids, (attribute,)):
+            groups.setdefault(getattr(self[sc_id], attribute), []).append(sc_id)
+        return groups
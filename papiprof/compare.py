@@ -0,0 +1,244 @@
+"""A/B comparison of two results directories, e.g. of two key sizes or of two
+builds of mbedTLS.
+
+Each series, i.e. (entity, function, ciphersuite, bytes sent, bytes
+received, metric), found in both directories is compared:
+
+    relative difference   candidate mean / baseline mean - 1, with its CI
+    Hedges' g             standardized difference of the means, with its CI
+    Welch's t-test        from the means, standard deviations and run counts
+    Mann-Whitney U        on the raw samples, with Cliff's delta
+
+The raw samples are read from the papi.store of each directory, if it has
+them for the series, otherwise only the JSON summaries are used. The
+p-value of a series is the Mann-Whitney one when there are raw samples
+(cycle counts often have a long tail) and the Welch one otherwise. The
+p-values are Holm-Bonferroni adjusted for the number of compared series.
+
+A series is a regression if it got significantly worse (adjusted p-value
+below alpha) by more than the threshold, e.g. 5% more virtcyc or 5% less
+IPC (see HIGHER_IS_BETTER_METRICS). Improvements are flagged the same way.
+"""
+import json
+from collections import namedtuple
+from os import listdir
+from os.path import isfile, join
+from statistics import mean, stdev
+
+from utils.colors import print_green, print_red, print_yellow
+from papiprof.papihelper import NON_METRIC_KEYS, NUM_RUNS_KEY, verbose_print
+from papiprof.resultsindex import ResultsIndex
+from papiprof.store import (PAPI_OUT_FILE_PREFIX, parse_papi_out_file_name,
+                            open_results_store)
+from papiprof.metrics import HIGHER_IS_BETTER_METRICS, format_metric_value
+from papiprof.environment import ENVIRONMENT_FILE, environment_drift
+from papiprof.stats import (DEFAULT_CONFIDENCE, welch_t_test, mann_whitney_u_test,
+                            hedges_g, relative_difference, holm_adjust)
+
+DEFAULT_THRESHOLD = 0.05
+DEFAULT_ALPHA = 0.05
+
+VERDICT_REGRESSION = 'regression'
+VERDICT_IMPROVEMENT = 'improvement'
+VERDICT_UNCHANGED = 'unchanged'
+
+SeriesKey = namedtuple('SeriesKey', ['entity', 'function', 'ciphersuite',
+                                     'bytes_sent', 'bytes_received', 'metric'])
+
+def load_results_dir(results_dir, entities=('client', 'server'), functions=None,
+                     metrics=None, is_verbose=False):
+    """
+    Loads the series of a results directory:
+        {
+            SeriesKey(...): {
+                'num_runs': 10, 'avg': 123, 'stdev': 12,
+                'samples': array('d', [...]) or None
+            }
+        }
+
+    The summaries come from the JSON files. When the same series is in
+    several files (older files also contain the ciphersuites profiled before
+    theirs), the one with the most runs is kept. If the directory has a
+    store with the raw samples of a series, the summary is computed from them.
+    """
+    file_names = [f for f in listdir(results_dir) if isfile(join(results_dir, f))
+                  and PAPI_OUT_FILE_PREFIX in f]
+    results_index = ResultsIndex(results_dir)
+    results_index.update(file_names)
+    results_index.save()
+
+    series = {}
+    entity_files = [f for f in file_names
+                    if (parse_papi_out_file_name(f) or [None])[0] in entities]
+    for file_name, funcname, cs_ids in results_index.iter_function_values(
+            functions, entity_files):
+        entity, _, bytes_sent, bytes_received = parse_papi_out_file_name(file_name)
+        for cs_id, measurments in cs_ids.items():
+            for metric_name, values in measurments.items():
+                if metric_name in NON_METRIC_KEYS:
+                    continue
+                if metrics and metric_name not in metrics:
+                    continue
+                num_runs = values.get(NUM_RUNS_KEY, measurments.get(NUM_RUNS_KEY, 0))
+                key = SeriesKey(entity, funcname, cs_id, bytes_sent,
+                                bytes_received, metric_name)
+                if key in series and series[key]['num_runs'] >= num_runs:
+                    continue
+                series[key] = {'num_runs': num_runs, 'avg': values['avg'],
+                               'stdev': values['stdev'], 'samples': None}
+
+    store, campaign = open_results_store(results_dir)
+    if store is not None:
+        store_path = store.path
+        if campaign is None:
+            print_yellow(f'\t[!] {store_path} has several campaigns, none named '
+                         'after the directory, using the JSON summaries only')
+        else:
+            filters = {'campaign': campaign, 'entity': list(entities)}
+            if functions:
+                filters['function'] = list(functions)
+            if metrics:
+                filters['metric'] = list(metrics)
+            num_loaded = 0
+            for store_key, samples in store.load(**filters).items():
+                if len(samples) < 2:
+                    continue
+                key = SeriesKey(*(str(getattr(store_key, field))
+                                  for field in SeriesKey._fields))
+                series[key] = {'num_runs': len(samples), 'avg': mean(samples),
+                               'stdev': stdev(samples), 'samples': samples}
+                num_loaded += 1
+            verbose_print(f'Loaded the raw samples of {num_loaded} series from '
+                          f'{store_path} (campaign: {campaign})', is_verbose)
+
+    return series
+
+def load_environment(results_dir):
+    """The environment a results directory was measured in (see
+    papiprof.environment), None if it wasn't saved."""
+    try:
+        with open(join(results_dir, ENVIRONMENT_FILE), 'r') as f:
+            return json.load(f)['start']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def environment_differences(baseline_dir, candidate_dir):
+    """The differences between the environments of two results
+    directories, other than their binaries, which are expected to differ."""
+    baseline = load_environment(baseline_dir)
+    candidate = load_environment(candidate_dir)
+    if baseline is None or candidate is None:
+        return []
+    return environment_drift(dict(baseline, binaries={}),
+                             dict(candidate, binaries={}))
+
+def _verdict(rel_diff, p_value, metric, threshold, alpha):
+    if rel_diff is None or p_value >= alpha or abs(rel_diff) <= threshold:
+        return VERDICT_UNCHANGED
+    is_worse = (rel_diff < 0) if metric in HIGHER_IS_BETTER_METRICS else (rel_diff > 0)
+    return VERDICT_REGRESSION if is_worse else VERDICT_IMPROVEMENT
+
+def compare_series(baseline, candidate, confidence=DEFAULT_CONFIDENCE):
+    """
+    Compares a series of two results directories (see load_results_dir()).
+    Returns:
+        {
+            'baseline': {'num_runs': 10, 'avg': 123, 'stdev': 12},
+            'candidate': {...},
+            'rel_diff': 0.05, 'rel_diff_ci': [0.01, 0.09],
+            'hedges_g': 0.8, 'hedges_g_ci': [0.1, 1.5],
+            'welch_p': 0.01,
+            'mann_whitney_p': 0.02, 'cliffs_delta': 0.4,  # None without samples
+            'p_value': 0.02,
+        }
+    """
+    summaries = [(s['avg'], s['stdev'], s['num_runs']) for s in (baseline, candidate)]
+    (avg_a, stdev_a, count_a), (avg_b, stdev_b, count_b) = summaries
+
+    result = {
+        'baseline': {'num_runs': count_a, 'avg': avg_a, 'stdev': stdev_a},
+        'candidate': {'num_runs': count_b, 'avg': avg_b, 'stdev': stdev_b},
+        'rel_diff': None, 'rel_diff_ci': None,
+        'hedges_g': None, 'hedges_g_ci': None,
+        'welch_p': 1.0, 'mann_whitney_p': None, 'cliffs_delta': None,
+    }
+
+    if count_a > 1 and count_b > 1:
+        _, _, result['welch_p'] = welch_t_test(*summaries[0], *summaries[1])
+        result['hedges_g'], result['hedges_g_ci'] = hedges_g(
+            *summaries[0], *summaries[1], confidence=confidence)
+    result['rel_diff'], result['rel_diff_ci'] = relative_difference(
+        *summaries[0], *summaries[1], confidence=confidence)
+
+    if baseline['samples'] is not None and candidate['samples'] is not None:
+        _, _, result['mann_whitney_p'], result['cliffs_delta'] = \
+            mann_whitney_u_test(baseline['samples'], candidate['samples'])
+        result['p_value'] = result['mann_whitney_p']
+    else:
+        result['p_value'] = result['welch_p']
+    return result
+
+def compare_results(baseline_series, candidate_series, threshold=DEFAULT_THRESHOLD,
+                    alpha=DEFAULT_ALPHA, confidence=DEFAULT_CONFIDENCE):
+    """
+    Compares the series found in both directories. Returns {SeriesKey(...):
+    comparison}, where each comparison (see compare_series()) also has the
+    Holm adjusted 'adjusted_p' and the 'verdict'.
+    """
+    keys = sorted(baseline_series.keys() & candidate_series.keys())
+    comparisons = {key: compare_series(baseline_series[key], candidate_series[key],
+                                       confidence)
+                   for key in keys}
+
+    adjusted = holm_adjust([comparisons[key]['p_value'] for key in keys])
+    for key, adjusted_p in zip(keys, adjusted):
+        comparison = comparisons[key]
+        comparison['adjusted_p'] = adjusted_p
+        comparison['verdict'] = _verdict(comparison['rel_diff'], adjusted_p,
+                                         key.metric, threshold, alpha)
+    return comparisons
+
+def _format_percent(value):
+    return f'{100 * value:+.2f}%' if value is not None else 'n/a'
+
+def _format_p(value):
+    return f'{value:.2g}' if value is not None else 'n/a'
+
+def print_comparison(comparisons, names=None, is_verbose=False):
+    """Prints the comparisons, the unchanged series only if `is_verbose`.
+    `names` optionally maps ciphersuite ids to names."""
+    names = names or {}
+    print_green('--- COMPARISON (candidate vs. baseline) ---')
+
+    for key, c in comparisons.items():
+        if c['verdict'] == VERDICT_UNCHANGED and not is_verbose:
+            continue
+        name = names.get(key.ciphersuite, key.ciphersuite)
+        rel_ci = c['rel_diff_ci']
+        ci = (f' [{_format_percent(rel_ci[0])}, {_format_percent(rel_ci[1])}]'
+              if rel_ci else '')
+        g = f'{c["hedges_g"]:+.2f}' if c['hedges_g'] is not None else 'n/a'
+        line = (f'\t{key.entity} {key.function} {name} '
+                f'({key.bytes_sent}/{key.bytes_received} B) {key.metric}: '
+                f'{format_metric_value(c["baseline"]["avg"])} -> '
+                f'{format_metric_value(c["candidate"]["avg"])} '
+                f'{_format_percent(c["rel_diff"])}{ci}, g {g}, '
+                f'p {_format_p(c["adjusted_p"])}')
+        if c['verdict'] == VERDICT_REGRESSION:
+            print_red(f'{line} REGRESSION')
+        elif c['verdict'] == VERDICT_IMPROVEMENT:
+            print_green(f'{line} IMPROVEMENT')
+        else:
+            print(line)
+
+    verdicts = [c['verdict'] for c in comparisons.values()]
+    print(f'\n\tCompared series: {len(verdicts)}')
+    print(f'\tRegressions: {verdicts.count(VERDICT_REGRESSION)}')
+    print(f'\tImprovements: {verdicts.count(VERDICT_IMPROVEMENT)}')
+    print(f'\tUnchanged: {verdicts.count(VERDICT_UNCHANGED)}')
+
+def save_comparison(comparisons, file_path):
+    report = [dict(key._asdict(), **comparison)
+              for key, comparison in comparisons.items()]
+    with open(file_path, 'w') as f:
+        json.dump(report, f, indent=4)
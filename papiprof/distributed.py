@@ -0,0 +1,528 @@
+"""Distributed campaigns: a coordinator shards the runs of a campaign across
+worker hosts.
+
+The coordinator is profile.py with `--runner distributed`. The workers
+connect to it, each with its own client/server pairs:
+
+    python profile.py <client> <server> ... <out> --runner distributed --listen <this host>:4500
+    python -m papiprof.distributed worker <coordinator>:4500 --client <client> --server <server>
+                                          [-j 2] [--host-id bench1]
+
+The coordinator listens on 127.0.0.1 unless told otherwise, and there is no
+authentication, so only listen on the benchmark network. A worker only runs
+the client and server binaries given with its own --client and --server
+options: a task for any other binary is refused, since a coordinator could
+otherwise have the workers run anything.
+
+A task is a cell of the campaign grid: all of the pending runs of a
+ciphersuite and payload sizes. Each worker gets a task, runs it on its pairs
+and sends back the raw metrics of each run. A worker can serve several
+coordinators, e.g. one per key size, one after the other.
+
+The results are handed back to the campaign in the order of its runs,
+whichever host ran them, so the journal, the store and the summaries are
+merged the same way as in a single host campaign. The id of the host of each
+run is saved in the journal, and the hosts with their environment (see
+papiprof.environment) in HOSTS_FILE, so host effects can be separated out.
+The client and server paths must be valid on the workers, and are compared
+with their --client and --server once made absolute (os.path.abspath(), the
+symlinks are not resolved, a binary may behave by the name it's run with).
+
+The protocol is made of JSON lines over TCP:
+
+    worker -> coordinator:  {"type": "hello", "host_id": "bench1", "host": {...}}
+    coordinator -> worker:  {"type": "task", "task_id": 1, "client": <path>,
+                             "server": <path>, "snapshot_bytes": null,
+                             "jobs": [<job>, ...]}
+                            {"type": "done"}
+    worker -> coordinator:  {"type": "result", "task_id": 1, "runs": [<run>, ...]}
+                            {"type": "refused", "task_id": 1, "reason": "..."}
+
+    job:  {"sc_id": "60", "cli_bytes_to_send": 0, "srv_bytes_to_send": 100,
+           "run_index": 0, "events": ["PAPI_TOT_INS", ...] or null}
+    run:  {"run_index": 0, "pair": 0, "cli_ret": 0, "srv_ret": 0,
+           "cli_prof": {<funcname>: {<metric>: 123}}, "srv_prof": {...},
+           "cli_records": {<funcname>: {"bytes": [...], <metric>: [...]}},
+           "srv_records": {...},
+           "is_ready": true, "wait_time": 0.01, "measure_time": 0.2}
+
+"snapshot_bytes" is the SNAPSHOT_BYTES_ENV_VAR of the coordinator (see
+papiprof.records), passed on to the binaries of the workers.
+
+A worker asks for its next task by sending the result of the previous one.
+The task of a worker that disconnects, or refuses it and disconnects, is
+given to another one.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import threading
+import socketserver
+from collections import deque
+
+from utils.colors import print_green, print_red, print_yellow
+from papiprof.papihelper import verbose_print, RunMetrics
+from papiprof.records import (SNAPSHOT_BYTES_ENV_VAR, records_to_dict,
+                              records_from_dict)
+from papiprof.scheduler import (build_pair_slots, get_available_cpus, PairSlot,
+                                ProfilingJob)
+from papiprof.aiorunner import AsyncPairRunner, DEFAULT_PROCESS_TIMEOUT
+from papiprof.environment import capture_environment
+
+DEFAULT_COORDINATOR_PORT = 4500
+HOSTS_FILE = 'papi.hosts.json'
+
+TYPE_HELLO = 'hello'
+TYPE_TASK = 'task'
+TYPE_RESULT = 'result'
+TYPE_DONE = 'done'
+TYPE_REFUSED = 'refused'
+
+def parse_address(address):
+    """Parses '<host>:<port>' (or only '<port>', on 127.0.0.1) into
+    (host, port)."""
+    host, sep, port = address.rpartition(':')
+    try:
+        return (host if sep else '127.0.0.1'), int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid address "{address}", '
+                                         'expected <host>:<port>') from None
+
+def _send(wfile, message):
+    wfile.write(json.dumps(message).encode() + b'\n')
+    wfile.flush()
+
+def _receive(rfile):
+    """Returns the next message, or None if the connection was closed."""
+    line = rfile.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+def _job_key(job):
+    return (job.sc_id, job.cli_bytes_to_send, job.srv_bytes_to_send)
+
+class _WorkerHandler(socketserver.StreamRequestHandler):
+    """Serves the tasks of the coordinator to a connected worker."""
+
+    def handle(self):
+        runner = self.server.runner
+        try:
+            hello = _receive(self.rfile)
+        except (OSError, ValueError):
+            return
+        if not hello or hello.get('type') != TYPE_HELLO:
+            return
+
+        worker = runner._register(hello)
+        task = None
+        try:
+            while True:
+                task = runner._next_task()
+                if task is None:
+                    _send(self.wfile, {'type': TYPE_DONE})
+                    return
+                task_id, indexed_jobs = task
+                _send(self.wfile, {
+                    'type': TYPE_TASK, 'task_id': task_id,
+                    'client': str(runner.client_path),
+                    'server': str(runner.server_path),
+                    'snapshot_bytes': os.environ.get(SNAPSHOT_BYTES_ENV_VAR),
+                    'jobs': [job._asdict() for _, job in indexed_jobs],
+                })
+                result = _receive(self.rfile)
+                if result and result.get('type') == TYPE_REFUSED:
+                    print_red(f'\t[!] Worker {worker} refused task {task_id}: '
+                              f'{result.get("reason")}')
+                    return
+                if (not result or result.get('type') != TYPE_RESULT
+                        or result.get('task_id') != task_id):
+                    return
+                runner._complete(task, worker, result['runs'])
+                task = None
+        except (OSError, ValueError, KeyError):
+            pass
+        finally:
+            if task is not None:
+                runner._requeue(task)
+            runner._unregister(worker)
+
+class _CoordinatorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class DistributedRunner:
+    """
+    Runs the profiling jobs of a campaign on the connected workers. Offers
+    the same imap() as papiprof.aiorunner.AsyncPairRunner.
+    """
+
+    def __init__(self, address, client_path, server_path, hosts_path=None,
+                 is_verbose=False):
+        self.client_path = client_path
+        self.server_path = server_path
+        self.hosts_path = hosts_path
+        self.is_verbose = is_verbose
+        # {host_id: {'info': ..., 'num_workers': 1, 'num_tasks': 0, 'num_runs': 0}}
+        self.hosts = {}
+
+        self._condition = threading.Condition()
+        self._tasks = deque()
+        # {job index: result}, until they are consumed by imap()
+        self._results = {}
+        self._num_workers = 0
+        self._next_task_id = 0
+        self._should_skip = None
+        self._is_closed = False
+
+        self._server = _CoordinatorServer(address, _WorkerHandler)
+        self._server.runner = self
+        self.address = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def _register(self, hello):
+        with self._condition:
+            host_id = hello['host_id']
+            host = self.hosts.setdefault(host_id, {'info': hello.get('host'),
+                                                   'num_workers': 0,
+                                                   'num_tasks': 0,
+                                                   'num_runs': 0})
+            host['num_workers'] += 1
+            self._num_workers += 1
+            worker = f'{host_id}#{host["num_workers"]}'
+            self._save_hosts()
+            self._condition.notify_all()
+        print_green(f'\t[+] Worker {worker} connected')
+        return worker
+
+    def _unregister(self, worker):
+        with self._condition:
+            self._num_workers -= 1
+        if not self._is_closed:
+            print_yellow(f'\t[!] Worker {worker} disconnected')
+
+    def _next_task(self):
+        """Waits for the next task for a worker. Returns None once closed."""
+        with self._condition:
+            while True:
+                if self._is_closed:
+                    return None
+                while self._tasks:
+                    task_id, indexed_jobs = self._tasks.popleft()
+                    # runs skipped since they were queued (see imap()) aren't sent
+                    pending = []
+                    for index, job in indexed_jobs:
+                        if self._should_skip and self._should_skip(job):
+                            self._results[index] = None
+                        else:
+                            pending.append((index, job))
+                    self._condition.notify_all()
+                    if pending:
+                        return task_id, pending
+                self._condition.wait()
+
+    def _requeue(self, task):
+        with self._condition:
+            self._tasks.appendleft(task)
+            self._condition.notify_all()
+
+    def _complete(self, task, worker, runs):
+        host_id = worker.rpartition('#')[0]
+        runs = {run['run_index']: run for run in runs}
+        results = {}
+        for index, job in task[1]:
+            run = runs[job.run_index]
+            results[index] = {
+                'slot': PairSlot(f'{worker}/{run["pair"]}', None, None, None),
+                'host': host_id,
+                'srv_ret': run['srv_ret'],
+                'cli_ret': run['cli_ret'],
+                'srv_prof': RunMetrics(run['srv_prof'],
+                                       records_from_dict(run.get('srv_records', {}))),
+                'cli_prof': RunMetrics(run['cli_prof'],
+                                       records_from_dict(run.get('cli_records', {}))),
+                'is_ready': run['is_ready'],
+                'wait_time': run['wait_time'],
+                'measure_time': run['measure_time'],
+            }
+        with self._condition:
+            self._results.update(results)
+            host = self.hosts[host_id]
+            host['num_tasks'] += 1
+            host['num_runs'] += len(results)
+            self._condition.notify_all()
+        verbose_print(f'Worker {worker} finished task {task[0]} '
+                      f'({len(results)} runs)', self.is_verbose)
+
+    def _queue_tasks(self, jobs, lookahead, max_queued):
+        """Groups the next jobs into tasks, one per cell, until `max_queued`
+        tasks are waiting. Returns the number of jobs queued."""
+        num_jobs = 0
+        while len(self._tasks) < max_queued:
+            if not lookahead:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                lookahead.append(job)
+            index, job = lookahead.popleft()
+            indexed_jobs = [(index, job)]
+            while True:
+                next_job = next(jobs, None)
+                if next_job is None:
+                    break
+                if _job_key(next_job[1]) != _job_key(job):
+                    lookahead.append(next_job)
+                    break
+                indexed_jobs.append(next_job)
+            self._next_task_id += 1
+            self._tasks.append((self._next_task_id, indexed_jobs))
+            num_jobs += len(indexed_jobs)
+        if num_jobs:
+            self._condition.notify_all()
+        return num_jobs
+
+    def imap(self, jobs, should_skip=None):
+        """
+        Yields the results of the jobs in the same order as the jobs, like
+        ThreadPool.imap(). A result is the dict returned by
+        profile.profile_pair(), with the 'host' that ran it. Jobs for which
+        `should_skip(job)` is true when their task is sent to a worker yield
+        None.
+        """
+        self._should_skip = should_skip
+        jobs = enumerate(jobs)
+        lookahead = deque()
+        num_jobs = 0
+        next_index = 0
+
+        while True:
+            with self._condition:
+                while True:
+                    # a queued task for each worker, so that none waits
+                    num_jobs += self._queue_tasks(jobs, lookahead,
+                                                  max(self._num_workers, 1))
+                    if next_index == num_jobs:
+                        return
+                    if next_index in self._results:
+                        result = self._results.pop(next_index)
+                        break
+                    # wake up regularly, for KeyboardInterrupt
+                    self._condition.wait(1)
+            next_index += 1
+            yield result
+
+    def _save_hosts(self):
+        if self.hosts_path is None:
+            return
+        tmp_path = f'{self.hosts_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.hosts, f, indent=4)
+        os.replace(tmp_path, self.hosts_path)
+
+    def print_hosts(self):
+        for host_id, host in sorted(self.hosts.items()):
+            print(f'\t{host_id}: {host["num_runs"]} runs in {host["num_tasks"]} '
+                  f'tasks, {host["num_workers"]} workers')
+
+    def close(self):
+        """Tells the workers that there is nothing left to do and stops."""
+        with self._condition:
+            self._is_closed = True
+            self._save_hosts()
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+def _host_info(host_id, pair_slots):
+    pinned_cpus = set()
+    for slot in pair_slots:
+        pinned_cpus |= (slot.server_cpus or set()) | (slot.client_cpus or set())
+    return {
+        'hostname': platform.node(),
+        'host_id': host_id,
+        'pid': os.getpid(),
+        'num_pairs': len(pair_slots),
+        'environment': capture_environment({}, pinned_cpus or get_available_cpus()),
+    }
+
+def _connect(address, connect_timeout):
+    """Connects to the coordinator, retrying until `connect_timeout` seconds
+    passed, since workers may be started before it."""
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            return socket.create_connection(address)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1)
+
+def resolve_allowed_paths(paths):
+    return {os.path.abspath(path) for path in paths}
+
+def check_task_paths(message, allowed_clients, allowed_servers):
+    """Returns why the client and server of a task can't be run, or None if
+    they are in the resolved `allowed_clients` and `allowed_servers`."""
+    for kind, path, allowed in (('client', message['client'], allowed_clients),
+                                ('server', message['server'], allowed_servers)):
+        if os.path.abspath(path) not in allowed:
+            return f'{kind} {path} is not one of the --{kind} of the worker'
+    return None
+
+def serve_coordinator(address, host_id, pair_slots, pair_options,
+                      allowed_clients, allowed_servers, connect_timeout=60):
+    """Runs the tasks of the coordinator at `address` until it's done, as
+    long as their binaries are in the resolved `allowed_clients` and
+    `allowed_servers` (see resolve_allowed_paths()). Returns the number of
+    runs."""
+    print_green(f'Connecting to the coordinator at {address[0]}:{address[1]}...')
+    runners = {}
+    num_runs = 0
+
+    with _connect(address, connect_timeout) as sock, \
+         sock.makefile('rb') as rfile, sock.makefile('wb') as wfile:
+        _send(wfile, {'type': TYPE_HELLO, 'host_id': host_id,
+                      'host': _host_info(host_id, pair_slots)})
+        try:
+            while True:
+                message = _receive(rfile)
+                if message is None:
+                    print_red('[!] The coordinator closed the connection')
+                    break
+                if message['type'] == TYPE_DONE:
+                    break
+
+                reason = check_task_paths(message, allowed_clients, allowed_servers)
+                if reason is not None:
+                    print_red(f'[!] Refused task {message["task_id"]}: {reason}')
+                    _send(wfile, {'type': TYPE_REFUSED, 'task_id': message['task_id'],
+                                  'reason': reason})
+                    break
+
+                paths = (message['client'], message['server'])
+                if paths not in runners:
+                    runners[paths] = AsyncPairRunner(pair_slots, client_path=paths[0],
+                                                     server_path=paths[1],
+                                                     **pair_options)
+                if message.get('snapshot_bytes') is None:
+                    os.environ.pop(SNAPSHOT_BYTES_ENV_VAR, None)
+                else:
+                    os.environ[SNAPSHOT_BYTES_ENV_VAR] = message['snapshot_bytes']
+                jobs = [ProfilingJob(**job) for job in message['jobs']]
+                job = jobs[0]
+                print(f'\tTask {message["task_id"]}: {len(jobs)} runs of '
+                      f'{job.sc_id}, {job.cli_bytes_to_send}/'
+                      f'{job.srv_bytes_to_send} bytes')
+
+                runs = []
+                for job, res in zip(jobs, runners[paths].imap(jobs)):
+                    runs.append({
+                        'run_index': job.run_index,
+                        'pair': res['slot'].index,
+                        'cli_ret': res['cli_ret'],
+                        'srv_ret': res['srv_ret'],
+                        'cli_prof': res['cli_prof'],
+                        'srv_prof': res['srv_prof'],
+                        'cli_records': records_to_dict(getattr(res['cli_prof'],
+                                                               'records', {})),
+                        'srv_records': records_to_dict(getattr(res['srv_prof'],
+                                                               'records', {})),
+                        'is_ready': res['is_ready'],
+                        'wait_time': res['wait_time'],
+                        'measure_time': res['measure_time'],
+                    })
+                _send(wfile, {'type': TYPE_RESULT, 'task_id': message['task_id'],
+                              'runs': runs})
+                num_runs += len(runs)
+        finally:
+            for runner in runners.values():
+                runner.close()
+    return num_runs
+
+def run_worker(coordinators, host_id, num_pairs, port, cpus_per_pair, pin_cpus,
+               connect_timeout, clients, servers, **pair_options):
+    allowed_clients = resolve_allowed_paths(clients)
+    allowed_servers = resolve_allowed_paths(servers)
+    pair_slots = build_pair_slots(num_pairs, port, cpus_per_pair, pin_cpus)
+    print(f'Worker {host_id}: {num_pairs} pairs')
+    print(f'\tClients: {", ".join(sorted(allowed_clients))}')
+    print(f'\tServers: {", ".join(sorted(allowed_servers))}')
+    for slot in pair_slots:
+        print(f'\tPair {slot.index}: port {slot.port}, '
+              f'server CPUs {slot.server_cpus}, client CPUs {slot.client_cpus}')
+
+    for address in coordinators:
+        try:
+            num_runs = serve_coordinator(address, host_id, pair_slots,
+                                         pair_options, allowed_clients,
+                                         allowed_servers, connect_timeout)
+        except OSError as e:
+            print_red(f'[!] Lost the coordinator at {address[0]}:{address[1]}: {e}')
+            continue
+        print_green(f'Done with {address[0]}:{address[1]}: {num_runs} runs\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the profiling jobs of '
+                                     'distributed campaigns')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    worker_parser = subparsers.add_parser('worker', help='run the jobs of '
+                                          'coordinators, one after the other')
+    worker_parser.add_argument('coordinators', type=parse_address, nargs='+',
+                               help='<host>:<port> of the coordinators')
+    worker_parser.add_argument('--client', type=str, action='append',
+                               required=True, dest='clients',
+                               help='path of a client binary this worker may '
+                               'run, can be given several times')
+    worker_parser.add_argument('--server', type=str, action='append',
+                               required=True, dest='servers',
+                               help='path of a server binary this worker may '
+                               'run, can be given several times')
+    worker_parser.add_argument('--host-id', type=str, default=platform.node(),
+                               help='id of this host in the results (default: '
+                               'the hostname)')
+    worker_parser.add_argument('-j', '--pairs', type=int, default=1,
+                               help='number of client/server pairs to run at '
+                               'the same time (default: 1)')
+    worker_parser.add_argument('--port', type=int, default=4433,
+                               help='port of the first pair, 0 to disable '
+                               'port probing (default: 4433)')
+    worker_parser.add_argument('--cpus-per-pair', type=int, default=2,
+                               help='number of CPUs each pair is pinned to '
+                               '(default: 2)')
+    worker_parser.add_argument('--no-pin', action='store_true', default=False,
+                               help='do not pin the pairs to CPUs')
+    worker_parser.add_argument('--ready-marker', type=str, default=None,
+                               help='start the client as soon as the server '
+                               'prints this string to its stdout')
+    worker_parser.add_argument('--max-wait', type=float, default=1,
+                               help='maximum number of seconds to wait for the '
+                               'server to be ready (default: 1)')
+    worker_parser.add_argument('--timeout', type=float,
+                               default=DEFAULT_PROCESS_TIMEOUT,
+                               help='seconds after which a client or server is '
+                               f'killed (default: {DEFAULT_PROCESS_TIMEOUT})')
+    worker_parser.add_argument('--connect-timeout', type=float, default=60,
+                               help='seconds to keep trying to connect to a '
+                               'coordinator (default: 60)')
+    worker_parser.add_argument('-v', '--verbose', action='store_true',
+                               default=False, help='enable verbose output')
+
+    args = parser.parse_args()
+    try:
+        run_worker(args.coordinators, args.host_id, args.pairs, args.port,
+                   args.cpus_per_pair, not args.no_pin, args.connect_timeout,
+                   args.clients, args.servers,
+                   is_verbose=args.verbose, ready_marker=args.ready_marker,
+                   probe_port=bool(args.port), max_wait=args.max_wait,
+                   timeout=args.timeout)
+    except KeyboardInterrupt:
+        print_red('\n[!] Interrupted')
+        sys.exit(1)
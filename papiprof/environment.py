@@ -0,0 +1,279 @@
+"""Capture of the environment a campaign is measured in.
+
+Cycle counts are only comparable between campaigns that ran in the same
+conditions: same frequency scaling setup, same kernel and same binaries. The
+environment is captured when a campaign starts and checked again after each
+iteration; any change (drift) is reported. Everything ends up in
+ENVIRONMENT_FILE, next to the results:
+
+    {
+        'start': <environment>,
+        'warnings': ['Turbo boost is enabled', ...],
+        'drift': [{'captured_at': ..., 'iteration': [...], 'changes': [...]}],
+        'end': <environment>
+    }
+
+An environment:
+
+    {
+        'captured_at': '2020-01-01T00:00:00', 'hostname': 'bench1',
+        'kernel': '5.4.0-42-generic', 'kernel_version': '#46-Ubuntu SMP ...',
+        'kernel_cmdline': 'BOOT_IMAGE=... intel_pstate=disable',
+        'isolated_cpus': '2-7',
+        'turbo': False,   # None if unknown
+        'load_average': [0.1, 0.2, 0.1],
+        'cpus': {
+            '0': {'driver': 'acpi-cpufreq', 'governor': 'userspace',
+                  'cur_khz': 800000, 'min_khz': 800000, 'max_khz': 800000}
+        },
+        'binaries': {
+            'client': {'path': ..., 'sha256': ..., 'size': 123, 'mtime_ns': 123}
+        }
+    }
+
+Values that can't be read (e.g. without cpufreq, or not on Linux) are None.
+The load average and the current frequency change all the time, so they
+are recorded but only the frequency of CPUs with the userspace governor,
+i.e. fixed with fix_cpu_speed.sh, counts as drift.
+"""
+import os
+import json
+import time
+import hashlib
+import platform
+
+ENVIRONMENT_FILE = 'papi.environment.json'
+
+SYSFS_CPU_DIR = '/sys/devices/system/cpu'
+# governors that keep the frequency from following the load
+FIXED_FREQUENCY_GOVERNORS = ('userspace', 'performance')
+# relative change of the frequency of a CPU fixed at a frequency that counts
+# as drift
+FREQUENCY_TOLERANCE = 0.05
+# 1 minute load average above which the machine is considered busy
+MAX_LOAD_AVERAGE = 1.0
+
+HASH_CHUNK_SIZE = 1 << 20
+
+class EnvironmentDriftError(Exception):
+    pass
+
+def _read_sysfs(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _read_khz(path):
+    value = _read_sysfs(path)
+    return int(value) if value and value.isdigit() else None
+
+def _read_turbo():
+    no_turbo = _read_sysfs(f'{SYSFS_CPU_DIR}/intel_pstate/no_turbo')
+    if no_turbo is not None:
+        return no_turbo == '0'
+    boost = _read_sysfs(f'{SYSFS_CPU_DIR}/cpufreq/boost')
+    if boost is not None:
+        return boost == '1'
+    return None
+
+def _cpu_frequency(cpu):
+    cpufreq = f'{SYSFS_CPU_DIR}/cpu{cpu}/cpufreq'
+    return {
+        'driver': _read_sysfs(f'{cpufreq}/scaling_driver'),
+        'governor': _read_sysfs(f'{cpufreq}/scaling_governor'),
+        'cur_khz': _read_khz(f'{cpufreq}/scaling_cur_freq'),
+        'min_khz': _read_khz(f'{cpufreq}/scaling_min_freq'),
+        'max_khz': _read_khz(f'{cpufreq}/scaling_max_freq'),
+    }
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def _binary_info(path, hash_cache):
+    """Hashes the binary at `path`, unless it's in `hash_cache` ({path:
+    info}) with the same size and modification time."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return {'path': str(path), 'sha256': None, 'size': None, 'mtime_ns': None}
+    cached = hash_cache.get(path)
+    if cached and (cached['size'], cached['mtime_ns']) == (st.st_size, st.st_mtime_ns):
+        return cached
+    info = {'path': str(path), 'sha256': file_sha256(path), 'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns}
+    hash_cache[path] = info
+    return info
+
+def capture_environment(binaries, cpus, hash_cache=None):
+    """
+    Captures the environment (see the module docstring). `binaries` is
+    {name: path} and `cpus` are the CPUs the campaign runs on.
+    """
+    hash_cache = {} if hash_cache is None else hash_cache
+    try:
+        load_average = list(os.getloadavg())
+    except (AttributeError, OSError):
+        load_average = None
+
+    return {
+        'captured_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'hostname': platform.node(),
+        'kernel': platform.release(),
+        'kernel_version': platform.version(),
+        'kernel_cmdline': _read_sysfs('/proc/cmdline'),
+        'isolated_cpus': _read_sysfs(f'{SYSFS_CPU_DIR}/isolated'),
+        'turbo': _read_turbo(),
+        'load_average': load_average,
+        'cpus': {str(cpu): _cpu_frequency(cpu) for cpu in sorted(cpus)},
+        'binaries': {name: _binary_info(path, hash_cache)
+                     for name, path in binaries.items()},
+    }
+
+def parse_cpu_list(cpu_list):
+    """Parses a kernel CPU list, e.g. '0-3,8', into a set of CPUs."""
+    cpus = set()
+    for part in (cpu_list or '').split(','):
+        if not part.strip():
+            continue
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+def check_environment(env, pinned_cpus=None):
+    """Returns warnings about what, in `env`, makes the measurements noisy."""
+    warnings = []
+    governors = {}
+    for cpu, freq in env['cpus'].items():
+        if freq['governor'] is not None:
+            governors.setdefault(freq['governor'], []).append(cpu)
+    if not governors:
+        warnings.append('CPU frequency scaling info is not available, '
+                        'cannot check that the frequency is fixed')
+    for governor, cpus in sorted(governors.items()):
+        if governor not in FIXED_FREQUENCY_GOVERNORS:
+            warnings.append(f'CPUs {",".join(cpus)} use the {governor} governor, '
+                            'their frequency is not fixed (see fix_cpu_speed.sh)')
+    if env['turbo']:
+        warnings.append('Turbo boost is enabled')
+    if pinned_cpus:
+        not_isolated = set(pinned_cpus) - parse_cpu_list(env['isolated_cpus'])
+        if not_isolated:
+            warnings.append('Pinned CPUs that are not isolated (isolcpus=): '
+                            f'{",".join(map(str, sorted(not_isolated)))}')
+    if env['load_average'] and env['load_average'][0] > MAX_LOAD_AVERAGE:
+        warnings.append(f'The machine is busy, load average: '
+                        f'{env["load_average"][0]:.2f}')
+    return warnings
+
+def _frequency_drifted(start_freq, freq):
+    if start_freq['governor'] != 'userspace' or not start_freq['cur_khz']:
+        return False
+    if freq['cur_khz'] is None:
+        return True
+    return (abs(freq['cur_khz'] - start_freq['cur_khz']) / start_freq['cur_khz']
+            > FREQUENCY_TOLERANCE)
+
+def environment_drift(start, env):
+    """Returns the changes from the `start` environment to `env`, as
+    human-readable strings."""
+    changes = []
+    for field in ('hostname', 'kernel', 'kernel_version', 'kernel_cmdline',
+                  'isolated_cpus', 'turbo'):
+        if start.get(field) != env.get(field):
+            changes.append(f'{field}: {start.get(field)} -> {env.get(field)}')
+
+    for cpu, start_freq in start['cpus'].items():
+        freq = env['cpus'].get(cpu)
+        if freq is None:
+            continue
+        for field in ('driver', 'governor', 'min_khz', 'max_khz'):
+            if start_freq[field] != freq[field]:
+                changes.append(f'cpu{cpu} {field}: {start_freq[field]} -> {freq[field]}')
+        if _frequency_drifted(start_freq, freq):
+            changes.append(f'cpu{cpu} frequency: {start_freq["cur_khz"]} kHz -> '
+                           f'{freq["cur_khz"]} kHz')
+
+    for name, start_binary in start['binaries'].items():
+        binary = env['binaries'].get(name)
+        if binary is not None and start_binary['sha256'] != binary['sha256']:
+            changes.append(f'{name} binary {binary["path"]} changed '
+                           f'(sha256 {start_binary["sha256"]} -> {binary["sha256"]})')
+    return changes
+
+class EnvironmentMonitor:
+    """Captures the environment of a campaign when it starts and checks it
+    for drift afterwards, saving everything to ENVIRONMENT_FILE."""
+
+    def __init__(self, path, binaries, cpus, pinned_cpus=None, resume=False):
+        """
+        `binaries` is {name: path} and `cpus` are the CPUs the campaign runs
+        on. With `resume`, the start environment is loaded from `path`, if it
+        was saved, and the current one is checked against it.
+        """
+        self.path = path
+        self.binaries = binaries
+        self.cpus = cpus
+        self.pinned_cpus = pinned_cpus
+        self._hash_cache = {}
+        self.report = None
+
+        if resume:
+            try:
+                with open(path, 'r') as f:
+                    self.report = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def capture(self):
+        return capture_environment(self.binaries, self.cpus, self._hash_cache)
+
+    def start(self):
+        """Captures the start environment, or checks the current one against
+        the saved one when resuming. Returns (warnings, changes)."""
+        env = self.capture()
+        if self.report is not None:
+            self._record_drift(env, None)
+            return self.report['warnings'], environment_drift(self.report['start'], env)
+
+        self.report = {'start': env,
+                       'warnings': check_environment(env, self.pinned_cpus),
+                       'drift': [], 'end': None}
+        self.save()
+        return self.report['warnings'], []
+
+    def check(self, iteration=None):
+        """Checks the environment for drift since the start. Returns the
+        changes, if they differ from the last check, which are also saved."""
+        return self._record_drift(self.capture(), iteration)
+
+    def _record_drift(self, env, iteration):
+        changes = environment_drift(self.report['start'], env)
+        drift = self.report['drift']
+        # a drift is only reported once, until it changes again
+        last_changes = drift[-1]['changes'] if drift else []
+        if changes == last_changes:
+            return []
+        if changes:
+            self.report['drift'].append({
+                'captured_at': env['captured_at'],
+                'iteration': list(iteration) if iteration else None,
+                'changes': changes,
+            })
+            self.save()
+        return changes
+
+    def finish(self):
+        self.report['end'] = self.capture()
+        self.save()
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.report, f, indent=4)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,255 @@
+"""Export of a results directory to CSV, Parquet or Arrow IPC files.
+
+The rows are in a tidy, long format, one value per row:
+
+    kind             'summary' or 'sample'
+    campaign         name of the campaign
+    entity           'client' or 'server'
+    ciphersuite      id, e.g. '60'
+    ciphersuite_name, key_exchange, kx, auth, cipher, mac
+                     see papiprof.ciphersuites
+    bytes_sent, bytes_received
+    function         e.g. 'handshake'
+    metric           e.g. 'virtcyc'
+    statistic        summaries: 'num_runs', 'avg', 'stdev', 'median', 'ci_low',
+                     'ci_high', ... samples: 'value'
+    run_index        index of the sample in its series, empty for summaries
+    value
+
+The summaries come from the *.papi.out.* JSON files, the samples from the
+papi.store of the directory (see papiprof.store), of the campaign of the
+directory only. The rows are streamed to
+the file: the summaries of one payload size and entity, or the samples of one
+series, are in memory at a time. Parquet and Arrow need pyarrow.
+"""
+import csv
+from collections import defaultdict
+from os import listdir
+from os.path import isfile, join
+from pathlib import Path
+
+from utils.colors import print_yellow
+from papiprof.papihelper import NON_METRIC_KEYS, NUM_RUNS_KEY
+from papiprof.resultsindex import ResultsIndex
+from papiprof.store import (PAPI_OUT_FILE_PREFIX, parse_papi_out_file_name,
+                            open_results_store)
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+FORMATS = (FORMAT_CSV, FORMAT_PARQUET, FORMAT_ARROW)
+# {file extension: format}
+FORMAT_EXTENSIONS = {'.csv': FORMAT_CSV, '.parquet': FORMAT_PARQUET,
+                     '.arrow': FORMAT_ARROW, '.feather': FORMAT_ARROW,
+                     '.ipc': FORMAT_ARROW}
+
+KIND_SUMMARY = 'summary'
+KIND_SAMPLE = 'sample'
+
+EXPORT_COLUMNS = ('kind', 'campaign', 'entity', 'ciphersuite', 'ciphersuite_name',
+                  'key_exchange', 'kx', 'auth', 'cipher', 'mac', 'bytes_sent',
+                  'bytes_received', 'function', 'metric', 'statistic',
+                  'run_index', 'value')
+# columns that aren't strings
+_INT_COLUMNS = ('bytes_sent', 'bytes_received', 'run_index')
+_FLOAT_COLUMNS = ('value',)
+
+# number of rows written to Parquet and Arrow files at once
+DEFAULT_BATCH_SIZE = 65536
+
+def format_from_path(path):
+    return FORMAT_EXTENSIONS.get(Path(path).suffix.lower(), FORMAT_CSV)
+
+def _summary_statistics(values):
+    """Yields (statistic, value) for each numeric statistic of a summary."""
+    for statistic, value in values.items():
+        if isinstance(value, (list, tuple)) and len(value) == 2:
+            # a confidence interval
+            yield f'{statistic}_low', value[0]
+            yield f'{statistic}_high', value[1]
+        elif isinstance(value, dict):
+            # e.g. the rejected samples, {'warmup': 2, 'outliers': 1}
+            for name, count in value.items():
+                yield f'{statistic}_{name}', count
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield statistic, value
+
+def _to_int(value):
+    return int(value) if str(value).isdigit() else None
+
+def iter_summary_rows(results_dir, registry, campaign, entities=('client', 'server'),
+                      functions=None, metrics=None):
+    """
+    Yields the summary rows of the JSON files of `results_dir`. As older files
+    also contain the ciphersuites profiled before theirs, the summary of a
+    series with the most runs is kept.
+    """
+    file_names = sorted(f for f in listdir(results_dir) if isfile(join(results_dir, f))
+                        and PAPI_OUT_FILE_PREFIX in f)
+    results_index = ResultsIndex(results_dir)
+    results_index.update(file_names)
+    results_index.save()
+
+    # the same series can only be in the files of the same entity and sizes
+    groups = defaultdict(list)
+    for file_name in file_names:
+        parsed = parse_papi_out_file_name(file_name)
+        if parsed is not None and parsed[0] in entities:
+            entity, _, bytes_sent, bytes_received = parsed
+            groups[(entity, bytes_sent, bytes_received)].append(file_name)
+
+    for (entity, bytes_sent, bytes_received), group_files in groups.items():
+        # {(funcname, cs_id, metric): (num_runs, values)}
+        series = {}
+        for _, funcname, cs_ids in results_index.iter_function_values(functions,
+                                                                      group_files):
+            for cs_id, measurments in cs_ids.items():
+                for metric_name, values in measurments.items():
+                    if metric_name in NON_METRIC_KEYS:
+                        continue
+                    if metrics and metric_name not in metrics:
+                        continue
+                    num_runs = values.get(NUM_RUNS_KEY, measurments.get(NUM_RUNS_KEY, 0))
+                    key = (funcname, cs_id, metric_name)
+                    if key in series and series[key][0] >= num_runs:
+                        continue
+                    series[key] = (num_runs, dict(values, num_runs=num_runs))
+
+        for (funcname, cs_id, metric_name), (_, values) in series.items():
+            cs = registry[cs_id]
+            prefix = (KIND_SUMMARY, campaign, entity, cs_id, cs.name, cs.key_exchange,
+                      cs.kx, cs.auth, cs.cipher, cs.mac, _to_int(bytes_sent),
+                      _to_int(bytes_received), funcname, metric_name)
+            for statistic, value in _summary_statistics(values):
+                yield prefix + (statistic, None, float(value))
+
+def iter_sample_rows(store, registry, campaign=None, entities=('client', 'server'),
+                     functions=None, metrics=None):
+    """Yields the raw sample rows of the series of `store` (of `campaign`, or
+    of all of its campaigns), one series at a time."""
+    filters = {'entity': list(entities)}
+    if campaign is not None:
+        filters['campaign'] = campaign
+    if functions:
+        filters['function'] = list(functions)
+    if metrics:
+        filters['metric'] = list(metrics)
+
+    for key, samples in store.iter_series(**filters):
+        cs = registry[key.ciphersuite]
+        prefix = (KIND_SAMPLE, key.campaign, key.entity, key.ciphersuite, cs.name,
+                  cs.key_exchange, cs.kx, cs.auth, cs.cipher, cs.mac,
+                  _to_int(key.bytes_sent), _to_int(key.bytes_received),
+                  key.function, key.metric, 'value')
+        for run_index, value in enumerate(samples):
+            yield prefix + (run_index, value)
+
+class CsvRowWriter:
+    def __init__(self, path):
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(EXPORT_COLUMNS)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+class ArrowRowWriter:
+    """Writes the rows to a Parquet or Arrow IPC file, in record batches."""
+
+    def __init__(self, path, export_format, batch_size=DEFAULT_BATCH_SIZE):
+        if pyarrow is None:
+            raise ValueError(f'The {export_format} format needs pyarrow '
+                             '(pip install pyarrow), use csv instead')
+        self.batch_size = batch_size
+        self.schema = pyarrow.schema([
+            (column, pyarrow.int64() if column in _INT_COLUMNS
+             else pyarrow.float64() if column in _FLOAT_COLUMNS
+             else pyarrow.string())
+            for column in EXPORT_COLUMNS])
+        if export_format == FORMAT_PARQUET:
+            self._writer = pyarrow.parquet.ParquetWriter(str(path), self.schema)
+        else:
+            self._writer = pyarrow.ipc.new_file(str(path), self.schema)
+        self._batch = []
+
+    def _write_batch(self):
+        columns = list(zip(*self._batch))
+        batch = pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(column, type=field.type)
+             for column, field in zip(columns, self.schema)],
+            schema=self.schema)
+        if isinstance(self._writer, pyarrow.parquet.ParquetWriter):
+            self._writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+        self._batch = []
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._batch.append(row)
+            if len(self._batch) >= self.batch_size:
+                self._write_batch()
+
+    def close(self):
+        if self._batch:
+            self._write_batch()
+        self._writer.close()
+
+def open_row_writer(path, export_format=None, batch_size=DEFAULT_BATCH_SIZE):
+    export_format = export_format or format_from_path(path)
+    if export_format == FORMAT_CSV:
+        return CsvRowWriter(path)
+    if export_format in (FORMAT_PARQUET, FORMAT_ARROW):
+        return ArrowRowWriter(path, export_format, batch_size)
+    raise ValueError(f'Unknown export format "{export_format}", expected one '
+                     f'of {", ".join(FORMATS)}')
+
+def export_results_dir(results_dir, out_path, registry, export_format=None,
+                       entities=('client', 'server'), functions=None, metrics=None,
+                       with_summaries=True, with_samples=True,
+                       batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Exports the summaries and the raw samples of `results_dir` to `out_path`.
+    Returns {'summary': <number of rows>, 'sample': <number of rows>}.
+    """
+    num_rows = {KIND_SUMMARY: 0, KIND_SAMPLE: 0}
+
+    def counted(rows, kind):
+        for row in rows:
+            num_rows[kind] += 1
+            yield row
+
+    # the summaries and the samples are of the campaign of the directory in
+    # its store (see results_dir_campaign()), e.g. one given with --campaign
+    campaign = Path(results_dir).resolve().name
+    store, store_campaign = open_results_store(results_dir) if with_samples else (None, None)
+    if store is not None and store_campaign is None:
+        print_yellow(f'\t[!] {store.path} has several campaigns, none named '
+                     'after the directory, exporting the summaries only')
+        store = None
+    elif store is not None:
+        campaign = store_campaign
+
+    writer = open_row_writer(out_path, export_format, batch_size)
+    try:
+        if with_summaries:
+            writer.write_rows(counted(iter_summary_rows(results_dir, registry, campaign,
+                                                        entities, functions, metrics),
+                                      KIND_SUMMARY))
+        if store is not None:
+            writer.write_rows(counted(iter_sample_rows(store, registry, campaign,
+                                                       entities, functions, metrics),
+                                      KIND_SAMPLE))
+    finally:
+        writer.close()
+    return num_rows
@@ -0,0 +1,135 @@
+"""Journal of a profiling campaign, used to resume it after an interruption.
+
+The journal is a JSON lines file. The first line describes the campaign,
+the others are appended while it runs:
+
+    {"type": "campaign", "campaign": <name>, "config": {...}}
+    {"type": "run", "iteration": [<sc_id>, <cli_bytes>, <srv_bytes>],
+     "run_index": 0, "cli": {<funcname>: {<metric>: 123}}, "srv": {...},
+     "host": <host id>}      (host: only in distributed campaigns)
+    {"type": "flush", "iteration": [...], "sampling": {...}}
+    {"type": "done", "iteration": [...]}
+
+A "run" line is written as soon as a run succeeds. "flush" is written right
+before the samples of an iteration are written to the results store and
+"done" once its JSON summaries are saved. So, after an interruption, an
+iteration is either:
+    - done: nothing left to do
+    - flushed, but not done: its samples may or may not be in the store
+    - neither: its journaled runs are not in the store yet
+"""
+import json
+from collections import defaultdict
+
+JOURNAL_FILE = 'papi.journal.jsonl'
+
+TYPE_CAMPAIGN = 'campaign'
+TYPE_RUN = 'run'
+TYPE_FLUSH = 'flush'
+TYPE_DONE = 'done'
+
+class JournalMismatchError(Exception):
+    pass
+
+def iteration_key(sc_id, cli_bytes_to_send, srv_bytes_to_send):
+    return (str(sc_id), int(cli_bytes_to_send), int(srv_bytes_to_send))
+
+class CampaignJournal:
+
+    def __init__(self, path, campaign, config, resume=False):
+        """
+        Opens the journal at `path`. Without `resume` any previous journal is
+        discarded. With `resume`, the previous journal is loaded and must be
+        of the same campaign and `config` (a JSON serializable dict).
+        """
+        self.path = path
+        self.campaign = campaign
+        self.config = config
+
+        # {iteration_key: {run_index: (cli_prof, srv_prof)}}
+        self.runs = defaultdict(dict)
+        self.flushed = set()
+        # {iteration_key: sampling info of the flushed iteration}
+        self.sampling = {}
+        self.done = set()
+
+        if resume:
+            self._load()
+            self._file = open(path, 'a')
+        else:
+            self._file = open(path, 'w')
+            self._write({'type': TYPE_CAMPAIGN, 'campaign': campaign,
+                         'config': config})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _load(self):
+        with open(self.path, 'r') as f:
+            lines = f.readlines()
+
+        # the last line may have been cut short by the interruption
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+
+        if not entries or entries[0].get('type') != TYPE_CAMPAIGN:
+            raise JournalMismatchError(f'{self.path} is not a campaign journal')
+
+        header = entries[0]
+        if header['campaign'] != self.campaign or header['config'] != self.config:
+            raise JournalMismatchError(f'{self.path} is the journal of a '
+                                       'different campaign or configuration')
+
+        for entry in entries[1:]:
+            key = tuple(entry['iteration'])
+            if entry['type'] == TYPE_RUN:
+                self.runs[key][entry['run_index']] = (entry['cli'], entry['srv'])
+            elif entry['type'] == TYPE_FLUSH:
+                self.flushed.add(key)
+                self.sampling[key] = entry.get('sampling')
+            elif entry['type'] == TYPE_DONE:
+                self.done.add(key)
+
+        # the raw metrics of finished iterations are in the store already
+        for key in self.done:
+            self.runs.pop(key, None)
+
+        # rewrite the journal without the cut short line, if there was one
+        if len(entries) != len(lines):
+            with open(self.path, 'w') as f:
+                f.writelines(json.dumps(entry) + '\n' for entry in entries)
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+    def record_run(self, key, run_index, cli_prof, srv_prof, host=None):
+        entry = {'type': TYPE_RUN, 'iteration': key, 'run_index': run_index,
+                 'cli': cli_prof, 'srv': srv_prof}
+        if host is not None:
+            entry['host'] = host
+        self._write(entry)
+
+    def record_flush(self, key, sampling=None):
+        self.flushed.add(key)
+        self.sampling[key] = sampling
+        self._write({'type': TYPE_FLUSH, 'iteration': key,
+                     'sampling': sampling})
+
+    def record_done(self, key):
+        self.done.add(key)
+        self._write({'type': TYPE_DONE, 'iteration': key})
+
+    def num_journaled_runs(self):
+        return sum(len(runs) for key, runs in self.runs.items()
+                   if key not in self.done)
@@ -0,0 +1,436 @@
+"""Matrix campaigns: the builds, key sizes, ciphersuite lists, payload grids
+and run policies of several campaigns in a single declarative spec.
+
+Instead of a results directory per key size, each started by hand with its
+own profile.py command line, the spec lists the values of each axis of the
+matrix. It's a JSON file, or a TOML file on Python 3.11+ (tomllib):
+
+    {
+        "output": "results/rsa_hs_auth",
+        "runs": 100,
+        "builds": {
+            "mbedtls": {
+                "client": "mbedtls/programs/ssl/ssl_client2",
+                "server": "mbedtls/programs/ssl/ssl_server2",
+                "setup": ["make -C mbedtls/programs"],
+                "env": {}
+            }
+        },
+        "key_sizes": [1024, 2048, 4096, 8192],
+        "setup": ["./gen_certs.sh {key_size}"],
+        "env": {"SERVER_CRT_FILE": "certs/rsa_{key_size}.crt"},
+        "ciphers": ["ciphers_mbedtls.txt"],
+        "sizes": [{"name": "hs"}, {"name": "bulk", "cli": "log:64:1048576:8"}],
+        "options": {"ready_marker": "READY", "pairs": 2, "strict_env": true},
+        "policies": {"quick": {"runs": 10}, "ci": {"target_rel_ci": 0.01}}
+    }
+
+Only "builds" and "ciphers" are required. The matrix has a cell for each
+build, key size, ciphersuite list, payload grid ("cli" and "srv" are size
+grids, see papiprof.sweep) and run policy. A policy is a set of options on
+top of "options", which are the long options of profile.py without the
+dashes (true for a flag). "{build}" and "{key_size}" are replaced in the
+paths, the setup commands and the environment of each cell. The paths are
+relative to the directory of the spec, where the commands are run.
+
+Before running the cells, the matrix is deduplicated and ordered:
+
+    - cells with the same binaries, environment, setup, ciphersuites, sizes
+      and options are only run once
+    - each setup command (e.g. a build or the certificates of a key size) is
+      only run once, before the first cell that needs it, and each binary is
+      only checked once
+    - the cells that share their setup and binaries run one after the other,
+      so the binaries aren't rebuilt back and forth and stay in the page
+      cache
+
+Each cell is a campaign of profile.py, named after the values of its axes
+(e.g. "mbedtls_2048_bulk_ci", the axes with a single value other than the
+build and key size are left out). All of the raw samples go to the results
+store of the output directory, under the name of their cell, and the rest of
+each campaign to a subdirectory of the same name. MATRIX_INDEX_FILE indexes
+the cells:
+
+    {
+        "spec": "/path/to/spec.json",
+        "store": "papi.store",
+        "cells": [
+            {"name": "mbedtls_2048_bulk_ci", "build": "mbedtls", "key_size": 2048,
+             "ciphers": "ciphers_mbedtls.txt", "sizes": "bulk", "policy": "ci",
+             "client": ..., "server": ..., "directory": "mbedtls_2048_bulk_ci",
+             "command": [...], "status": "done", "return_code": 0,
+             "wall_time": 123.4}
+        ]
+    }
+
+where the status is "pending", "done", "failed" or "interrupted". Each cell
+directory points to its campaign in the shared store with a STORE_REF_FILE
+(see papiprof.store), where printm.py compare and export find the raw
+samples.
+
+An output directory that already has results is only run into again with
+--resume, which skips the cells that are done with the same command and
+resumes the others (see papiprof.journal), or with --overwrite, which runs
+the cells again and replaces their samples.
+
+Usage:
+    python -m papiprof.matrix <spec> [--dry-run] [--resume|--overwrite]
+                              [--only <cell> ...]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import itertools
+import subprocess
+from collections import namedtuple
+from pathlib import Path
+
+from utils.colors import print_green, print_red, print_yellow
+from papiprof.store import STORE_DIR
+from papiprof.sweep import parse_size_grid
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+MATRIX_INDEX_FILE = 'papi.matrix.json'
+PROFILE_SCRIPT = Path(__file__).resolve().parent.parent / 'profile.py'
+
+DEFAULT_RUNS = 100
+DEFAULT_POLICY = 'default'
+
+STATUS_PENDING = 'pending'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_INTERRUPTED = 'interrupted'
+
+# options set by the matrix itself
+RESERVED_OPTIONS = {'campaign', 'store', 'resume', 'append', 'overwrite', 'cli_sizes',
+                    'srv_sizes'}
+
+MatrixCell = namedtuple('MatrixCell', ['name', 'build', 'key_size', 'ciphers',
+                                       'sizes', 'policy', 'client', 'server',
+                                       'env', 'setup', 'runs', 'cli_sizes',
+                                       'srv_sizes', 'options'])
+
+def load_spec(path):
+    """Reads a JSON or, with tomllib, TOML spec."""
+    path = Path(path)
+    if path.suffix == '.toml':
+        if tomllib is None:
+            raise ValueError(f'Reading {path} needs Python 3.11+ (tomllib), '
+                             'use a JSON spec instead')
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+def _expand(template, variables):
+    try:
+        return str(template).format_map(variables)
+    except (KeyError, IndexError) as e:
+        raise ValueError(f'Unknown variable {e} in "{template}", expected '
+                         f'{", ".join("{" + name + "}" for name in variables)}')
+
+def _check_options(options, where):
+    if not isinstance(options, dict):
+        raise ValueError(f'The {where} must be an object')
+    reserved = RESERVED_OPTIONS & options.keys()
+    if reserved:
+        raise ValueError(f'The {where} cannot set {", ".join(sorted(reserved))}, '
+                         'which are set by the matrix')
+
+def expand_matrix(spec):
+    """
+    Expands a spec (see the module docstring) into the list of its cells
+    (MatrixCell), deduplicated and in the order they should be run in.
+    Raises ValueError if the spec is invalid.
+    """
+    builds = spec.get('builds')
+    if not builds or not isinstance(builds, dict):
+        raise ValueError('The spec must list its "builds", e.g. '
+                         '{"mbedtls": {"client": ..., "server": ...}}')
+    for build_name, build in builds.items():
+        if not isinstance(build, dict) or 'client' not in build or 'server' not in build:
+            raise ValueError(f'The build "{build_name}" must have a "client" and '
+                             'a "server"')
+    key_sizes = _as_list(spec.get('key_sizes')) or [None]
+    ciphers_list = _as_list(spec.get('ciphers'))
+    if not ciphers_list:
+        raise ValueError('The spec must list its ciphersuite lists in "ciphers"')
+    sizes_list = _as_list(spec.get('sizes')) or [{}]
+    for i, sizes in enumerate(sizes_list):
+        if not isinstance(sizes, dict):
+            raise ValueError('Each of the "sizes" must be an object with a '
+                             '"cli" and/or "srv" size grid')
+        for grid in (sizes.get('cli'), sizes.get('srv')):
+            if grid is not None:
+                parse_size_grid(str(grid))
+    options = spec.get('options', {})
+    _check_options(options, '"options"')
+    policies = spec.get('policies') or {DEFAULT_POLICY: {}}
+    for policy_name, policy in policies.items():
+        _check_options(policy, f'policy "{policy_name}"')
+
+    def sizes_name(i):
+        return str(sizes_list[i].get('name', f'sizes{i}'))
+
+    # the axes that are part of the names of the cells
+    named_axes = (True, key_sizes != [None], len(ciphers_list) > 1,
+                  len(sizes_list) > 1, len(policies) > 1)
+
+    cells = []
+    seen = set()
+    for (build_name, key_size, ciphers, sizes_index,
+         policy_name) in itertools.product(builds, key_sizes, ciphers_list,
+                                           range(len(sizes_list)), policies):
+        build = builds[build_name]
+        variables = {'build': build_name}
+        if key_size is not None:
+            variables['key_size'] = key_size
+        cell_options = {**options, **policies[policy_name]}
+        runs = int(cell_options.pop('runs', spec.get('runs', DEFAULT_RUNS)))
+        env = {name: _expand(value, variables)
+               for name, value in {**spec.get('env', {}), **build.get('env', {})}.items()}
+        # the setup of the build first, e.g. it can build the certificate tools
+        setup = tuple(_expand(command, variables)
+                      for command in _as_list(build.get('setup')) + _as_list(spec.get('setup')))
+        sizes = sizes_list[sizes_index]
+
+        name = '_'.join(str(value) for value, is_named in zip(
+            (build_name, key_size, Path(str(ciphers)).stem, sizes_name(sizes_index),
+             policy_name), named_axes) if is_named)
+        cell = MatrixCell(name, build_name, key_size, str(ciphers),
+                          sizes_name(sizes_index), policy_name,
+                          _expand(build['client'], variables),
+                          _expand(build['server'], variables), env, setup, runs,
+                          sizes.get('cli'), sizes.get('srv'), cell_options)
+
+        key = (cell.client, cell.server, tuple(sorted(env.items())), setup,
+               cell.ciphers, runs, cell.cli_sizes, cell.srv_sizes,
+               json.dumps(cell_options, sort_keys=True))
+        if key in seen:
+            continue
+        seen.add(key)
+        cells.append(cell)
+
+    names = [cell.name for cell in cells]
+    if len(set(names)) != len(names):
+        raise ValueError('Several cells have the same name, give the payload '
+                         'grids a distinct "name"')
+
+    # the cells with the same setup and binaries next to each other, in the
+    # order they first show up in
+    groups = {}
+    for cell in cells:
+        groups.setdefault((cell.setup, cell.client, cell.server), len(groups))
+    return sorted(cells, key=lambda cell: groups[(cell.setup, cell.client, cell.server)])
+
+def cell_command(cell, output_dir, store_path):
+    """The profile.py command line of a cell."""
+    args = [sys.executable, str(PROFILE_SCRIPT), cell.client, cell.server,
+            str(cell.runs), cell.ciphers, '0', '0', '0', '0', '0', '0',
+            str(Path(output_dir) / cell.name), '--campaign', cell.name,
+            '--store', str(store_path)]
+    if cell.cli_sizes is not None:
+        args += ['--cli-sizes', str(cell.cli_sizes)]
+    if cell.srv_sizes is not None:
+        args += ['--srv-sizes', str(cell.srv_sizes)]
+    for option, value in sorted(cell.options.items()):
+        flag = '--' + option.replace('_', '-')
+        if value is True:
+            args.append(flag)
+        elif value is not False and value is not None:
+            args += [flag, str(value)]
+    return args
+
+class MatrixIndex:
+    """
+    The MATRIX_INDEX_FILE of an output directory, saved after each cell. The
+    cells of the matrix that aren't run this time keep their previous entry.
+    """
+
+    def __init__(self, output_dir, spec_path):
+        self.path = Path(output_dir) / MATRIX_INDEX_FILE
+        self.content = {'spec': str(Path(spec_path).resolve()),
+                        'store': STORE_DIR, 'cells': []}
+        self._previous = {}
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                self._previous = {cell['name']: cell for cell in json.load(f)['cells']}
+
+    def add(self, cell, command, keep_previous=False):
+        """
+        Adds the entry of a cell. With `keep_previous`, its previous entry is
+        kept if it had the same command.
+        """
+        entry = {'name': cell.name, 'build': cell.build, 'key_size': cell.key_size,
+                 'ciphers': cell.ciphers, 'sizes': cell.sizes, 'policy': cell.policy,
+                 'client': cell.client, 'server': cell.server,
+                 'directory': cell.name, 'command': command,
+                 'status': STATUS_PENDING, 'return_code': None, 'wall_time': None}
+        previous = self._previous.get(cell.name)
+        if keep_previous and previous is not None and previous['command'] == command:
+            entry.update(previous)
+        self.content['cells'].append(entry)
+        return entry
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.content, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+def _is_executable(path, cwd):
+    if os.sep not in path:
+        # looked up in the PATH, like Popen() does
+        return shutil.which(path) is not None
+    return os.access(Path(cwd) / path, os.X_OK)
+
+def run_matrix(spec_path, resume=False, dry_run=False, only=None, is_verbose=False,
+               overwrite=False):
+    """
+    Runs the cells of the spec at `spec_path`, or just prints them with
+    `dry_run`. `only` restricts the matrix to the cells with these names.
+    An output directory that already has results is only used with `resume`,
+    or with `overwrite`, which runs the cells again from scratch.
+    Returns the number of cells that failed.
+    """
+    if resume and overwrite:
+        raise ValueError('Only one of --resume and --overwrite can be given')
+    spec = load_spec(spec_path)
+    cwd = Path(spec_path).resolve().parent
+    all_cells = expand_matrix(spec)
+    if only:
+        unknown = set(only) - {cell.name for cell in all_cells}
+        if unknown:
+            raise ValueError(f'No cell named {", ".join(sorted(unknown))}')
+    cells = [cell for cell in all_cells if not only or cell.name in only]
+
+    output_dir = cwd / spec.get('output', Path(spec_path).stem)
+    store_path = output_dir / STORE_DIR
+    commands = [cell_command(cell, output_dir, store_path) for cell in cells]
+
+    print_green(f'Matrix of {spec_path}: {len(cells)} cells, output to {output_dir}')
+    if dry_run:
+        setup_done = set()
+        for cell, command in zip(cells, commands):
+            print(f'\t{cell.name}')
+            for setup_command in cell.setup:
+                if setup_command not in setup_done:
+                    setup_done.add(setup_command)
+                    print(f'\t\tsetup: {setup_command}')
+            if cell.env:
+                print(f'\t\tenv: {" ".join(f"{k}={v}" for k, v in sorted(cell.env.items()))}')
+            print(f'\t\t{" ".join(command[1:])}')
+        return 0
+
+    if not resume and not overwrite and ((output_dir / MATRIX_INDEX_FILE).exists()
+                                         or store_path.exists()):
+        raise ValueError(f'{output_dir} already has results, use --resume to carry '
+                         'on with them or --overwrite to run the cells again')
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    index = MatrixIndex(output_dir, spec_path)
+    entries = {cell.name: index.add(cell, cell_command(cell, output_dir, store_path),
+                                    keep_previous=resume or cell not in cells)
+               for cell in all_cells}
+    index.save()
+
+    setup_done = set()
+    # {path: whether it's executable}, checked after the setup of its cell
+    binaries = {}
+    num_failed = 0
+    for i, (cell, command) in enumerate(zip(cells, commands)):
+        entry = entries[cell.name]
+        if entry['status'] == STATUS_DONE:
+            print(f'[{i + 1}/{len(cells)}] {cell.name}: already done, skipping')
+            continue
+        print_green(f'[{i + 1}/{len(cells)}] {cell.name}')
+
+        start = time.monotonic()
+        try:
+            for setup_command in cell.setup:
+                if setup_command in setup_done:
+                    continue
+                print(f'\tsetup: {setup_command}')
+                return_code = subprocess.call(setup_command, shell=True, cwd=str(cwd))
+                if return_code != 0:
+                    raise ValueError(f'"{setup_command}" failed ({return_code})')
+                setup_done.add(setup_command)
+
+            for path in (cell.client, cell.server):
+                if path not in binaries:
+                    binaries[path] = _is_executable(path, cwd)
+                if not binaries[path]:
+                    raise ValueError(f'{path} is not an executable')
+
+            if is_verbose:
+                print(f'\t{" ".join(command[1:])}')
+            # profile.py removes the earlier samples of the cell's campaign
+            # with --overwrite
+            extra_args = ['--resume'] if resume else ['--overwrite'] if overwrite else []
+            p = subprocess.Popen(command + extra_args, cwd=str(cwd),
+                                 env=dict(os.environ, **cell.env))
+            try:
+                entry['return_code'] = p.wait()
+            except KeyboardInterrupt:
+                # profile.py is interrupted too, let it close its journal
+                p.wait()
+                raise
+            entry['status'] = STATUS_DONE if entry['return_code'] == 0 else STATUS_FAILED
+        except ValueError as e:
+            print_red(f'\t[!!!] {e}')
+            entry['status'] = STATUS_FAILED
+        except KeyboardInterrupt:
+            entry['status'] = STATUS_INTERRUPTED
+            print_red(f'\n[!] Interrupted, run again with --resume to carry on '
+                      f'from {cell.name}')
+            raise
+        finally:
+            entry['wall_time'] = time.monotonic() - start
+            index.save()
+
+        if entry['status'] == STATUS_FAILED:
+            num_failed += 1
+            print_yellow(f'\t[!] {cell.name} failed, carrying on with the next cell')
+
+    print_green(f'Done: {len(cells) - num_failed}/{len(cells)} cells, see {index.path}')
+    return num_failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the campaigns of a '
+                                     'matrix spec into a single indexed output')
+    parser.add_argument('spec', type=str, help='JSON (or TOML) matrix spec')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only print the cells, their setup and commands')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--resume', action='store_true',
+                       help='skip the cells that are done and resume the others')
+    group.add_argument('--overwrite', action='store_true',
+                       help='run the cells again, replacing their earlier results '
+                       '(default: refuse to run into an output with results)')
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='names of the cells to run (default: all)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print the command of each cell')
+
+    args = parser.parse_args()
+    try:
+        num_failed = run_matrix(args.spec, args.resume, args.dry_run, args.only,
+                                args.verbose, args.overwrite)
+    except ValueError as e:
+        print_red(f'[!!!] {e}')
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(1)
+    sys.exit(1 if num_failed else 0)
@@ -0,0 +1,247 @@
+"""Registry of the metrics reported by the client and server binaries.
+
+Besides the PAPI timers (virttime, realtime, virtcyc and realcyc), the
+binaries can report any PAPI event, e.g. `handshake_PAPI_L1_DCM 1234`.
+PAPI preset events (PAPI_*) are always accepted, native events have to be
+registered by name. Derived metrics, like the IPC, are computed from the
+events of each run.
+
+A registry can be loaded from a JSON file:
+
+    {
+        "events": ["PAPI_TOT_INS", "PAPI_TOT_CYC", "PAPI_L1_DCM",
+                   "perf::PERF_COUNT_HW_CACHE_MISSES"],
+        "max_counters": 4,
+        "groups": [["PAPI_TOT_INS", "PAPI_TOT_CYC"], ...],
+        "derived": {"ipc": "PAPI_TOT_INS / PAPI_TOT_CYC"},
+        "descriptions": {"PAPI_L1_DCM": "L1 Data Cache Misses"}
+    }
+
+All of the keys are optional. When there are more events than hardware
+counters, the events are split into groups that are measured in turns: run
+i measures group i % len(groups). The groups are either given or built
+from "max_counters", keeping the events of each derived metric together
+(see build_event_groups()).
+The events to measure in a run are passed to the binaries in the
+EVENTS_ENV_VAR environment variable, as a comma separated list.
+"""
+import re
+import ast
+import sys
+import json
+import operator
+from collections import namedtuple
+
+METRIC_VIRTTIME = 'virttime'
+METRIC_REALTIME = 'realtime'
+METRIC_VIRTCYC = 'virtcyc'
+METRIC_REALCYC = 'realcyc'
+
+TIMER_METRICS = (METRIC_VIRTTIME, METRIC_REALTIME, METRIC_VIRTCYC, METRIC_REALCYC)
+
+PAPI_PRESET_EVENT_PATTERN = r'PAPI_[A-Z0-9_]+'
+
+# the client and server binaries read the events to measure from this variable
+EVENTS_ENV_VAR = 'PAPI_EVENTS'
+
+DEFAULT_DESCRIPTIONS = {
+    METRIC_VIRTTIME: 'Virtual Time',
+    METRIC_REALTIME: 'Real Time',
+    METRIC_VIRTCYC: 'Virtual Cycles',
+    METRIC_REALCYC: 'Real Cycles',
+    'PAPI_TOT_INS': 'Instructions',
+    'PAPI_TOT_CYC': 'Total Cycles',
+    'PAPI_L1_DCM': 'L1 Data Cache Misses',
+    'PAPI_L2_TCM': 'L2 Cache Misses',
+    'PAPI_L3_TCM': 'L3 Cache Misses',
+    'PAPI_BR_MSP': 'Branch Mispredictions',
+    'PAPI_TLB_DM': 'Data TLB Misses',
+    'ipc': 'Instructions Per Cycle',
+    'l1_dcm_pki': 'L1 Data Cache Misses Per Kilo Instruction',
+    'l2_tcm_pki': 'L2 Cache Misses Per Kilo Instruction',
+    'l3_tcm_pki': 'L3 Cache Misses Per Kilo Instruction',
+    'br_msp_pki': 'Branch Mispredictions Per Kilo Instruction',
+    'tlb_dm_pki': 'Data TLB Misses Per Kilo Instruction',
+}
+
+# computed whenever a run reports all of their events
+DEFAULT_DERIVED_METRICS = {
+    'ipc': 'PAPI_TOT_INS / PAPI_TOT_CYC',
+    'l1_dcm_pki': '1000 * PAPI_L1_DCM / PAPI_TOT_INS',
+    'l2_tcm_pki': '1000 * PAPI_L2_TCM / PAPI_TOT_INS',
+    'l3_tcm_pki': '1000 * PAPI_L3_TCM / PAPI_TOT_INS',
+    'br_msp_pki': '1000 * PAPI_BR_MSP / PAPI_TOT_INS',
+    'tlb_dm_pki': '1000 * PAPI_TLB_DM / PAPI_TOT_INS',
+}
+
+# metrics for which a higher value is better, for all of the others (cycles,
+# time, misses) lower is better
+HIGHER_IS_BETTER_METRICS = ('ipc',)
+
+def format_metric_value(value, decimals=1):
+    """Rounds to `decimals` decimals, keeping 4 significant digits of small
+    values (e.g. of the IPC)."""
+    return f'{value:.{decimals}f}' if abs(value) >= 100 else f'{value:.4g}'
+
+DerivedMetric = namedtuple('DerivedMetric', ['name', 'expression', 'operands',
+                                             'evaluate'])
+
+_BINARY_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub,
+                     ast.Mult: operator.mul, ast.Div: operator.truediv}
+_UNARY_OPERATORS = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+# Python < 3.8 parses numbers into ast.Num, which is deprecated since
+_NUMBER_NODE = ast.Constant if sys.version_info >= (3, 8) else ast.Num
+
+def _compile_node(node, operands):
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        op = _BINARY_OPERATORS[type(node.op)]
+        left = _compile_node(node.left, operands)
+        right = _compile_node(node.right, operands)
+        return lambda metrics: op(left(metrics), right(metrics))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        op = _UNARY_OPERATORS[type(node.op)]
+        operand = _compile_node(node.operand, operands)
+        return lambda metrics: op(operand(metrics))
+    if isinstance(node, ast.Name):
+        operands.append(node.id)
+        return lambda metrics: metrics[node.id]
+    if isinstance(node, _NUMBER_NODE):
+        value = node.value if sys.version_info >= (3, 8) else node.n
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return lambda metrics: value
+    raise ValueError(f'Unsupported expression: {ast.dump(node)}')
+
+def parse_derived_metric(name, expression):
+    """
+    Parses the expression of a derived metric, made of metric names, numbers,
+    parentheses and + - * /, e.g. '1000 * PAPI_L1_DCM / PAPI_TOT_INS'. Metric
+    names that aren't valid Python names (e.g. native events) can't be used.
+    """
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f'Invalid expression of {name}: {expression}') from e
+    operands = []
+    try:
+        evaluate = _compile_node(tree.body, operands)
+    except ValueError as e:
+        raise ValueError(f'Invalid expression of {name}: {e}') from None
+    return DerivedMetric(name, expression, tuple(dict.fromkeys(operands)),
+                         evaluate)
+
+def build_event_groups(events, max_counters, derived_metrics=()):
+    """
+    Splits the events into groups of at most `max_counters` events, so that
+    the events of each derived metric are measured together. An event needed
+    by several derived metrics (e.g. PAPI_TOT_INS) can be in several groups.
+    """
+    # sets of events that must be measured together
+    clusters = [set(derived.operands) & set(events) for derived in derived_metrics]
+    clusters = [cluster for cluster in clusters if cluster]
+    covered = set().union(*clusters)
+    clusters += [{event} for event in events if event not in covered]
+
+    groups = []
+    # first fit, biggest clusters first
+    for cluster in sorted(clusters, key=len, reverse=True):
+        if len(cluster) > max_counters:
+            raise ValueError(f'The events {sorted(cluster)} are needed together '
+                             f'by a derived metric, but only {max_counters} can '
+                             'be measured at once')
+        for group in groups:
+            if len(group | cluster) <= max_counters:
+                group |= cluster
+                break
+        else:
+            groups.append(set(cluster))
+    return [tuple(event for event in events if event in group) for group in groups]
+
+class MetricRegistry:
+    """The metrics that are parsed from the output of the binaries and the
+    derived metrics computed from them."""
+
+    def __init__(self, events=(), derived=None, groups=None, max_counters=None,
+                 descriptions=None):
+        """
+        `events` are extra event names to accept (PAPI_* presets are always
+        accepted), `derived` is {name: expression} and replaces
+        DEFAULT_DERIVED_METRICS. See the module docstring for the groups.
+        """
+        self.events = tuple(events)
+        if derived is None:
+            derived = DEFAULT_DERIVED_METRICS
+        self.derived = [parse_derived_metric(name, expression)
+                        for name, expression in derived.items()]
+        self.descriptions = dict(DEFAULT_DESCRIPTIONS)
+        self.descriptions.update(descriptions or {})
+
+        if groups is None and max_counters and len(self.events) > max_counters:
+            groups = build_event_groups(self.events, max_counters,
+                                        self._measured_derived(self.events))
+        self.groups = [tuple(group) for group in groups] if groups else None
+
+        if self.groups:
+            grouped_events = [e for group in self.groups for e in group]
+            for d in self._measured_derived(grouped_events):
+                operands = set(d.operands) - set(TIMER_METRICS)
+                if not any(operands <= set(group) for group in self.groups):
+                    raise ValueError(f'The events of the derived metric {d.name} '
+                                     f'({d.expression}) are not in the same group')
+
+        metric_names = TIMER_METRICS + tuple(e for e in self.events
+                                             if not re.fullmatch(PAPI_PRESET_EVENT_PATTERN, e))
+        alternatives = [re.escape(name) for name in
+                        sorted(metric_names, key=len, reverse=True)]
+        alternatives.append(PAPI_PRESET_EVENT_PATTERN)
+        # a lazy funcname, so that the longest metric name that is a suffix
+        # of the line wins (see the output grammar in papiprof.papihelper)
+        self.line_regex = re.compile(
+            r'^(?P<funcname>.+?)_(?P<metric>' + '|'.join(alternatives) +
+            r') (?P<value>\d+)\r?$', flags=re.MULTILINE)
+
+    def _measured_derived(self, events):
+        """The derived metrics that can be computed from the timers and the
+        `events`."""
+        available = set(TIMER_METRICS) | set(events)
+        return [d for d in self.derived if set(d.operands) <= available]
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'r') as f:
+            config = json.load(f)
+        unknown = set(config) - {'events', 'derived', 'groups', 'max_counters',
+                                 'descriptions'}
+        if unknown:
+            raise ValueError(f'Unknown keys in {path}: {", ".join(sorted(unknown))}')
+        return cls(**config)
+
+    def event_group(self, run_index):
+        """Returns the events to measure in the `run_index`th run of a
+        configuration, or None to leave it up to the binaries."""
+        if self.groups:
+            return self.groups[run_index % len(self.groups)]
+        return self.events or None
+
+    def add_derived_metrics(self, profs):
+        """
+        Adds the derived metrics to the metrics of a single run, for each
+        function that reported all of their operands. profs structure:
+            {
+                'func_name': {
+                    'PAPI_TOT_INS': 123,
+                }
+            }
+        """
+        for metrics in profs.values():
+            for derived in self.derived:
+                if all(operand in metrics for operand in derived.operands):
+                    try:
+                        metrics[derived.name] = float(derived.evaluate(metrics))
+                    except ZeroDivisionError:
+                        pass
+        return profs
+
+    def describe(self, metric_name):
+        return self.descriptions.get(metric_name, metric_name)
+
+DEFAULT_METRIC_REGISTRY = MetricRegistry()
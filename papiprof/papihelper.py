@@ -1,17 +1,73 @@
 import json
-import re
+import os
+import selectors
 import subprocess
+import time
 from collections import defaultdict
 
 from utils.colors import print_green, print_red, print_yellow
 from utils.jsonhelper import convert_dict_keys_to_str, write_json_to_file
 
-METRIC_VIRTTIME = 'virttime'
-METRIC_REALTIME = 'realtime'
-METRIC_VIRTCYC = 'virtcyc'
-METRIC_REALCYC = 'realcyc'
+from papiprof.metrics import (METRIC_VIRTTIME, METRIC_REALTIME, METRIC_VIRTCYC,
+                              METRIC_REALCYC, TIMER_METRICS, EVENTS_ENV_VAR,
+                              DEFAULT_METRIC_REGISTRY)
+from papiprof.regions import RegionTreeBuilder
+from papiprof.records import RecordSeriesBuilder
+from papiprof import timing
+
+ALL_METRICS = TIMER_METRICS
+
+metric_registry = DEFAULT_METRIC_REGISTRY
+# The client and server binaries report each metric of an instrumented
+# function on its own line of stdout:
+#
+#     line     := funcname "_" metric " " value EOL
+#     funcname := any characters except line breaks (may contain "_")
+#     metric   := "virttime" | "realtime" | "virtcyc" | "realcyc"
+#               | "PAPI_" [A-Z0-9_]+      (PAPI preset events)
+#               | <registered event>      (see papiprof.metrics)
+#     value    := digit+
+#     EOL      := "\n" | "\r\n"
+#
+# The funcname is matched lazily, so the metric is the longest known metric
+# name before the value: function names can contain "_", and even end in
+# something that looks like a metric, e.g. `flush_L1_MISSES 12` is L1_MISSES
+# of flush() if both L1_MISSES and MISSES are registered. Lines that don't
+# follow this grammar are ignored, except for the region_enter and
+# region_exit lines of nested regions, which are added to the metrics as the
+# nodes of a call tree (see papiprof.regions), and the snapshot lines of the
+# data transfers (see papiprof.records).
+PAPI_OUTPUT_LINE_REGEX = metric_registry.line_regex
+
+def set_metric_registry(registry):
+    """Makes the output parsers accept the metrics of `registry` (a
+    papiprof.metrics.MetricRegistry)."""
+    global metric_registry, PAPI_OUTPUT_LINE_REGEX
+    metric_registry = registry
+    PAPI_OUTPUT_LINE_REGEX = registry.line_regex
+
+# keys of the saved results, next to the metrics of a function/ciphersuite,
+# that aren't metrics themselves
+NUM_RUNS_KEY = 'num_runs'
+SAMPLING_KEY = 'sampling'
+NON_METRIC_KEYS = (NUM_RUNS_KEY, SAMPLING_KEY)
+
+DEFAULT_SERVER_PORT = 4433
+# the client and server binaries read the port to use from this variable
+SERVER_PORT_ENV_VAR = 'PAPI_SERVER_PORT'
+TCP_LISTEN_STATE = '0A'
+PROC_NET_TCP_FILES = ('/proc/net/tcp', '/proc/net/tcp6')
+
+class RunMetrics(defaultdict):
+    """
+    The metrics of a single run, {funcname: {metric: value}}, with the records
+    of its data transfers in `records`, {funcname: RecordSeries} (see
+    papiprof.records).
+    """
 
-ALL_METRICS = (METRIC_VIRTTIME, METRIC_VIRTCYC)
+    def __init__(self, metrics=(), records=None):
+        super().__init__(dict, metrics)
+        self.records = records if records is not None else {}
 
 def verbose_print(content, is_verbose):
     if is_verbose:
@@ -45,7 +101,10 @@ def save_papi_metrics_to_file(metrics, filename):
 
 def parse_output_into_metrics(output, is_verbose=False):
     """
-    returns metrics: 
+    Parses the output of a client or server (see PAPI_OUTPUT_LINE_REGEX for
+    its grammar) in a single pass.
+
+    returns metrics (a RunMetrics): 
     {
         funcname : {
             virttime: 123,
@@ -53,25 +112,81 @@ def parse_output_into_metrics(output, is_verbose=False):
         }
     }
     """
-    metrics = defaultdict(dict)
+    metrics = RunMetrics()
 
-    for metric_name in ALL_METRICS:
-        verbose_print(f'Parsing {metric_name}...', is_verbose)
+    for funcname, metric_name, value in PAPI_OUTPUT_LINE_REGEX.findall(output):
+        metrics[funcname][metric_name] = float(value)
 
-        REGEX = fr'(?P<funcname>.+?)_{metric_name} (?P<value>\d+\n\r?)'
-        matches = re.finditer(REGEX, output, flags=re.MULTILINE)
+    regions = RegionTreeBuilder()
+    regions.feed(output)
+    regions.add_to_metrics(metrics)
+    records = RecordSeriesBuilder()
+    records.feed(output)
+    metrics.records = records.series
 
-        for match in matches:
-            match = match.groupdict()
-            funcname = match['funcname']
-            value = match['value']
-            metrics[funcname][metric_name] = float(value)
-
-            verbose_print(f'\tfuncname: {funcname}', is_verbose)
-            verbose_print(f'\tvalue: {value}', is_verbose)
+    verbose_print(f'Parsed {sum(len(m) for m in metrics.values())} values '
+                  f'of {len(metrics)} functions', is_verbose)
     
     return metrics
 
+class StreamingMetricsParser:
+    """Parses the output of a client or server as it is read, chunk by chunk.
+
+    Only the last, incomplete line of the output is kept between chunks, so
+    the memory use doesn't grow with the output (e.g. with the data printed
+    by long transfers). Lines longer than `max_line_length` can't be metric
+    lines and are dropped without being buffered.
+    """
+
+    def __init__(self, max_line_length=4096):
+        self.max_line_length = max_line_length
+        self.metrics = RunMetrics()
+        self.num_bytes = 0
+        self._regions = RegionTreeBuilder()
+        self._records = RecordSeriesBuilder()
+        self._partial_line = b''
+        self._is_skipping_line = False
+
+    def feed(self, data):
+        self.num_bytes += len(data)
+        end = data.rfind(b'\n')
+        if end == -1:
+            self._buffer_partial_line(data)
+            return
+
+        lines = data[:end + 1]
+        if self._is_skipping_line:
+            lines = lines[lines.find(b'\n') + 1:]
+            self._is_skipping_line = False
+        else:
+            lines = self._partial_line + lines
+        self._partial_line = b''
+        self._parse(lines)
+        self._buffer_partial_line(data[end + 1:])
+
+    def _buffer_partial_line(self, data):
+        if self._is_skipping_line:
+            return
+        self._partial_line += data
+        if len(self._partial_line) > self.max_line_length:
+            self._partial_line = b''
+            self._is_skipping_line = True
+
+    def _parse(self, lines):
+        text = lines.decode(encoding='utf-8', errors='replace')
+        for funcname, metric_name, value in PAPI_OUTPUT_LINE_REGEX.findall(text):
+            self.metrics[funcname][metric_name] = float(value)
+        self._regions.feed(text)
+        self._records.feed(text)
+
+    def close(self):
+        """Parses the last line, if the output didn't end with a line break,
+        and returns the metrics (see parse_output_into_metrics())."""
+        if self._partial_line:
+            self._parse(self._partial_line)
+            self._partial_line = b''
+        self.metrics.records = self._records.series
+        return self._regions.add_to_metrics(self.metrics)
 
 def get_cc_from_papi_file(papi_file, func_name):
     """Gets the number of CPU cycles for a function from a callgrind file."""
@@ -80,8 +195,136 @@ def get_cc_from_papi_file(papi_file, func_name):
     
     return get_cc_from_papi_output(file_content, func_name)
 
+def is_port_listening(port):
+    """Checks if there is a TCP socket in the LISTEN state on `port`.
+
+    The check is done by reading /proc/net/tcp{,6} instead of connecting to
+    the port, since a probe connection would be accepted by the server in
+    place of the client's one. Returns None if the information is not
+    available (i.e. not running on Linux).
+    """
+    port_hex = f'{port:04X}'
+    found_proc_file = False
+
+    for proc_file in PROC_NET_TCP_FILES:
+        try:
+            with open(proc_file, 'r') as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+        found_proc_file = True
+
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            local_address, state = fields[1], fields[3]
+            if state == TCP_LISTEN_STATE and local_address.endswith(f':{port_hex}'):
+                return True
+
+    return False if found_proc_file else None
+
+def wait_for_server_ready(server_started, port=None, max_wait=1,
+                          poll_interval=0.001, has_ready_marker=False):
+    """Waits until the server is ready to accept the client's connection.
+
+    `server_started` is the event passed to run_server(). It is set once the
+    server printed its ready marker (or right after it was spawned, if no
+    marker is used, `has_ready_marker` False). If `port` is given, this
+    additionally waits until the server is listening on it. If neither a
+    ready marker nor a port can be used, this simply sleeps for `max_wait`
+    seconds.
+
+    Returns True if the server became ready before `max_wait` seconds.
+    """
+    deadline = time.monotonic() + max_wait
+
+    if not server_started.wait(max_wait):
+        return False
+
+    if port is None:
+        if not has_ready_marker:
+            # nothing tells when the server is ready, fall back to the fixed wait
+            time.sleep(max(deadline - time.monotonic(), 0))
+        return True
+
+    while True:
+        listening = is_port_listening(port)
+        remaining = deadline - time.monotonic()
+
+        if listening is None:
+            # no way to probe the port, fall back to the fixed wait
+            time.sleep(max(remaining, 0))
+            return True
+        if listening:
+            return True
+        if remaining <= 0:
+            return False
+        time.sleep(poll_interval)
+
+def _read_until_marker(p, marker):
+    """
+    Reads the output of a running process until `marker` shows up in its
+    stdout or the process closes it. Reads straight from the file
+    descriptors, so that whatever is left can still be collected with
+    communicate(). Returns the (stdout, stderr) read so far.
+    """
+    out = {p.stdout: [], p.stderr: []}
+    stdout_so_far = b''
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(p.stdout, selectors.EVENT_READ)
+        selector.register(p.stderr, selectors.EVENT_READ)
+
+        while marker not in stdout_so_far and selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fd, 32768)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    if key.fileobj is p.stdout:
+                        return b''.join(out[p.stdout]), b''.join(out[p.stderr])
+                    continue
+                out[key.fileobj].append(data)
+                if key.fileobj is p.stdout:
+                    stdout_so_far = b''.join(out[p.stdout])
+
+    return stdout_so_far, b''.join(out[p.stderr])
+
+def _popen_kwargs(port=None, events=None):
+    """
+    Builds the extra Popen() arguments to run a binary on `port` (passed in
+    the SERVER_PORT_ENV_VAR environment variable), measuring the PAPI
+    `events` (in EVENTS_ENV_VAR).
+    """
+    kwargs = {}
+
+    if port is not None or events:
+        env = dict(os.environ)
+        if port is not None:
+            env[SERVER_PORT_ENV_VAR] = str(port)
+        if events:
+            env[EVENTS_ENV_VAR] = ','.join(events)
+        kwargs['env'] = env
+
+    return kwargs
+
+def pin_process(pid, cpus):
+    """
+    Pins the process `pid` to the `cpus`, right after it's spawned. This
+    isn't done in the child with preexec_fn, which isn't safe when the
+    parent has threads, as the runners do.
+    """
+    if not cpus:
+        return
+    try:
+        os.sched_setaffinity(pid, cpus)
+    except ProcessLookupError:
+        # it already exited, its return code tells why
+        pass
+
 def run_server(server_path, ciphersuite_id, show_output=True,
-               num_bytes_to_send=None):
+               num_bytes_to_send=None, ready_event=None, ready_marker=None,
+               port=None, cpus=None, events=None):
     """
     {
         func_name : {
@@ -89,6 +332,15 @@ def run_server(server_path, ciphersuite_id, show_output=True,
             realtime: 123,
         }
     }
+
+    If `ready_event` is given, it's set once the server is considered ready:
+    when `ready_marker` is printed to its stdout or, if there is no marker,
+    right after the process is spawned. It's always set before returning,
+    so that a server which dies early doesn't keep the client waiting.
+
+    If `port` is given, the server is told to listen on it. If `cpus` is
+    given, the server is pinned to that set of CPUs. If `events` are given,
+    the server is told to measure them.
     """
     srv_args = [server_path, str(ciphersuite_id)]
 
@@ -97,8 +349,23 @@ def run_server(server_path, ciphersuite_id, show_output=True,
 
     args = srv_args
 
-    p = subprocess.Popen(args, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = p.communicate()
+    with timing.phase(timing.PHASE_SPAWN):
+        p = subprocess.Popen(args, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             **_popen_kwargs(port, events))
+        pin_process(p.pid, cpus)
+
+    with timing.phase(timing.PHASE_COMMUNICATE):
+        early_stdout, early_stderr = b'', b''
+        try:
+            if ready_marker:
+                early_stdout, early_stderr = _read_until_marker(p, ready_marker.encode())
+        finally:
+            if ready_event is not None:
+                ready_event.set()
+
+        stdout, stderr = p.communicate()
+    stdout = early_stdout + stdout
+    stderr = early_stderr + stderr
 
     return_code = p.returncode
 
@@ -106,11 +373,12 @@ def run_server(server_path, ciphersuite_id, show_output=True,
         print(f'\n\nServer OUT:\n{stdout}')
         print(f'\n\nServer ERR:\n{stderr}')
 
-    metrics = parse_output_into_metrics(stdout.decode(encoding='utf-8'), show_output)
+    with timing.phase(timing.PHASE_PARSE):
+        metrics = parse_output_into_metrics(stdout.decode(encoding='utf-8'), show_output)
     return (return_code, metrics)
 
 def run_client(client_path, ciphersuite_id, show_output=True,
-                num_bytes_to_send=None):
+                num_bytes_to_send=None, port=None, cpus=None, events=None):
 
     cli_args = [client_path, str(ciphersuite_id)]
 
@@ -119,8 +387,12 @@ def run_client(client_path, ciphersuite_id, show_output=True,
 
     args =  cli_args
 
-    p = subprocess.Popen(args, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = p.communicate()
+    with timing.phase(timing.PHASE_SPAWN):
+        p = subprocess.Popen(args, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             **_popen_kwargs(port, events))
+        pin_process(p.pid, cpus)
+    with timing.phase(timing.PHASE_COMMUNICATE):
+        stdout, stderr = p.communicate()
 
 
 
@@ -130,5 +402,6 @@ def run_client(client_path, ciphersuite_id, show_output=True,
         print(f'\n\nClient OUT:\n{stdout}')
         print(f'\n\nClient ERR:\n{stderr}')
 
-    metrics = parse_output_into_metrics(stdout.decode(encoding='utf-8'), show_output)
+    with timing.phase(timing.PHASE_PARSE):
+        metrics = parse_output_into_metrics(stdout.decode(encoding='utf-8'), show_output)
     return (return_code, metrics)
@@ -0,0 +1,200 @@
+"""Persistent client/server processes that are reused for many runs.
+
+Spawning the binaries for every run means paying for the process startup,
+the dynamic linking and the mbedTLS/certificate setup each time. In the
+persistent mode the binaries are started once, with PERSISTENT_MODE_ARG as
+their only argument, and then run handshakes on request:
+
+    harness -> binary (stdin):
+        run <run_id> <ciphersuite_id> <num_bytes_to_send> [<events>]
+        quit
+
+    binary -> harness (stdout):
+        ready                    once, when it accepts commands
+        ready <run_id>           server only: it's listening for that run
+        <funcname>_<metric> <value>
+        ...                      the metrics of the run (see papihelper)
+        done <run_id> <return_code>
+
+The port to listen on/connect to is passed in the SERVER_PORT_ENV_VAR
+environment variable, as in the regular mode. <events> is the comma
+separated list of PAPI events to measure in the run, given when the event
+groups of the runs differ (see papiprof.metrics).
+
+A slow `ready <run_id>` doesn't stop the run: the client is started anyway,
+as in the regular mode. A run that isn't done after the process timeout
+kills the worker, which is started again by the next run.
+"""
+import time
+import queue
+import subprocess
+import threading
+
+from papiprof import timing
+from papiprof.papihelper import (_popen_kwargs, pin_process,
+                                 parse_output_into_metrics, verbose_print)
+from papiprof.aiorunner import TIMEOUT_RETURN_CODE
+
+PERSISTENT_MODE_ARG = '--persistent'
+
+# return code reported for a run during which the worker process died
+WORKER_DIED_RETURN_CODE = -1000
+
+class WorkerDiedError(Exception):
+    pass
+
+class PersistentWorker:
+    """A client or server binary running in the persistent mode."""
+
+    def __init__(self, path, port=None, cpus=None, is_verbose=False,
+                 start_timeout=10):
+        self.path = path
+        self.port = port
+        self.cpus = cpus
+        self.is_verbose = is_verbose
+        self.start_timeout = start_timeout
+        self.num_runs = 0
+        self._p = None
+        # the lines of its stdout, read by a thread so that they can be
+        # waited for with a timeout. None once it's closed.
+        self._lines = None
+
+    def is_running(self):
+        return self._p is not None and self._p.poll() is None
+
+    def start(self):
+        with timing.phase(timing.PHASE_SPAWN):
+            self._p = subprocess.Popen([self.path, PERSISTENT_MODE_ARG], shell=False,
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       stderr=None if self.is_verbose else subprocess.DEVNULL,
+                                       universal_newlines=True, bufsize=1,
+                                       **_popen_kwargs(self.port))
+            pin_process(self._p.pid, self.cpus)
+            self._lines = queue.Queue()
+            threading.Thread(target=self._read_lines,
+                             args=(self._p.stdout, self._lines), daemon=True).start()
+            is_ready = self._wait_for_line('ready', self.start_timeout)
+        if not is_ready:
+            self.stop()
+            raise WorkerDiedError(f'{self.path} did not get ready in persistent mode')
+        verbose_print(f'Started persistent {self.path} (pid {self._p.pid})',
+                      self.is_verbose)
+
+    def ensure_started(self):
+        if not self.is_running():
+            self.start()
+
+    def stop(self, kill=False):
+        """Asks the process to quit, or kills it with `kill`, e.g. when it
+        doesn't respond anymore."""
+        if self._p is None:
+            return
+        if self._p.poll() is None and not kill:
+            try:
+                self._p.stdin.write('quit\n')
+                self._p.stdin.flush()
+                self._p.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        if self._p.poll() is None:
+            self._p.kill()
+            self._p.wait()
+        self._p = None
+
+    @staticmethod
+    def _read_lines(stdout, lines):
+        for line in stdout:
+            lines.put(line.rstrip('\r\n'))
+        lines.put(None)
+
+    def _readline(self, deadline=None):
+        """
+        Returns the next line of the output. Raises queue.Empty if there was
+        none by the `deadline` (a time.monotonic() value), and
+        WorkerDiedError if the process exited.
+        """
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        line = self._lines.get(timeout=timeout)
+        if line is None:
+            # so that the next reads fail too
+            self._lines.put(None)
+            raise WorkerDiedError(f'{self.path} exited with code {self._p.wait()}')
+        return line
+
+    def _wait_for_line(self, expected, timeout):
+        """
+        Reads lines until `expected` is read. Returns False if that didn't
+        happen in `timeout` seconds or if the process died.
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            while self._readline(deadline) != expected:
+                pass
+            return True
+        except (WorkerDiedError, queue.Empty):
+            return False
+
+    def send_run(self, run_id, ciphersuite_id, num_bytes_to_send=0, events=None):
+        """Asks for a run. Raises WorkerDiedError if the process doesn't take
+        commands anymore."""
+        command = f'run {run_id} {ciphersuite_id} {num_bytes_to_send or 0}'
+        if events:
+            command += ' ' + ','.join(events)
+        try:
+            self._p.stdin.write(command + '\n')
+            self._p.stdin.flush()
+        except OSError:
+            return_code = self._p.poll()
+            self.stop(kill=True)
+            raise WorkerDiedError(f'{self.path} exited with code {return_code}'
+                                  if return_code is not None else
+                                  f'{self.path} stopped reading its commands') from None
+
+    def wait_until_ready_for(self, run_id, timeout):
+        """
+        Waits for the `ready <run_id>` line of a server. Returns False if it
+        didn't come in `timeout` seconds, in which case the worker is left
+        running and the line is skipped by collect_run().
+        """
+        return self._wait_for_line(f'ready {run_id}', timeout)
+
+    def collect_run(self, run_id, timeout=None):
+        """
+        Reads the output of a run until its `done` line. Returns
+        (return_code, metrics), like papihelper.run_client().
+
+        If the run isn't done after `timeout` seconds, the process is killed
+        and the return code is TIMEOUT_RETURN_CODE, as with the asyncio
+        runner.
+        """
+        done_prefix = f'done {run_id} '
+        deadline = None if timeout is None else time.monotonic() + timeout
+        lines = []
+        try:
+            with timing.phase(timing.PHASE_COMMUNICATE):
+                while True:
+                    line = self._readline(deadline)
+                    if line.startswith(done_prefix):
+                        return_code = int(line[len(done_prefix):])
+                        break
+                    if line.startswith('ready '):
+                        # a server that got ready after wait_until_ready_for()
+                        continue
+                    lines.append(line)
+        except WorkerDiedError:
+            return_code = WORKER_DIED_RETURN_CODE
+            self.stop()
+        except queue.Empty:
+            # its output can't be followed anymore, the next run starts it
+            # again
+            return_code = TIMEOUT_RETURN_CODE
+            self.stop(kill=True)
+
+        self.num_runs += 1
+        output = '\n'.join(lines)
+        if self.is_verbose:
+            print(f'\n\n{self.path} OUT:\n{output}')
+        with timing.phase(timing.PHASE_PARSE):
+            metrics = parse_output_into_metrics(output, self.is_verbose)
+        return return_code, metrics
@@ -0,0 +1,111 @@
+"""Counter snapshots of the data transfers in the output of the binaries.
+
+The <funcname>_<metric> lines only give one total per function and run. To
+see how a transfer goes, e.g. its throughput ramp-up or periodic stalls, the
+binaries can also report a snapshot of their counters every
+SNAPSHOT_BYTES_ENV_VAR bytes (0: after every record):
+
+    snapshot <funcname> <bytes> <metric> <value> [<metric> <value> ...]
+
+where <bytes> and the values are counted from the start of the function, like
+those of the flat lines. The cost of each record is the difference between
+two consecutive snapshots of its function (the first one from 0). A metric
+that is missing from a snapshot, or from the one before it after the first,
+has an unknown cost for that record, NaN.
+
+The records of a run are kept in arrays ('d'), one per metric, instead of a
+dict per record. See papiprof.timeseries for how they are saved and
+summarized.
+"""
+import re
+import math
+from array import array
+
+# the binaries read the bytes between two snapshots from this variable
+SNAPSHOT_BYTES_ENV_VAR = 'PAPI_SNAPSHOT_BYTES'
+
+SNAPSHOT = 'snapshot'
+SNAPSHOT_LINE_REGEX = re.compile(
+    r'^snapshot[ \t]+(\S+)[ \t]+(\d+)((?:[ \t]+\w+[ \t]+\d+)+)[ \t]*\r?$',
+    re.MULTILINE)
+
+class RecordSeries:
+    """The records of a function in a run: the bytes of each record and its
+    cost in each metric."""
+
+    def __init__(self):
+        self.bytes = array('d')
+        # {metric: array('d', [cost of each record])}
+        self.values = {}
+        self._last_bytes = 0
+        self._last_values = {}
+
+    def __len__(self):
+        return len(self.bytes)
+
+    def add_snapshot(self, num_bytes, values):
+        index = len(self.bytes)
+        self.bytes.append(num_bytes - self._last_bytes)
+        self._last_bytes = num_bytes
+        for metric_name, value in values.items():
+            series = self.values.get(metric_name)
+            if series is None:
+                # a metric that wasn't in the earlier snapshots
+                series = self.values[metric_name] = array('d', [math.nan]) * index
+            if index == 0:
+                series.append(value)
+            else:
+                # NaN if the previous snapshot didn't have it
+                series.append(value - self._last_values.get(metric_name, math.nan))
+            self._last_values[metric_name] = value
+        for metric_name, series in self.values.items():
+            if len(series) <= index:
+                series.append(math.nan)
+                # the next snapshot that has it has no previous value either
+                self._last_values.pop(metric_name, None)
+
+    def to_dict(self):
+        """JSON-serializable form, e.g. for the distributed runner:
+        {'bytes': [...], <metric>: [...]}"""
+        content = {metric_name: series.tolist()
+                   for metric_name, series in self.values.items()}
+        content['bytes'] = self.bytes.tolist()
+        return content
+
+    @classmethod
+    def from_dict(cls, content):
+        series = cls()
+        series.bytes = array('d', content['bytes'])
+        series.values = {metric_name: array('d', values)
+                         for metric_name, values in content.items()
+                         if metric_name != 'bytes'}
+        return series
+
+class RecordSeriesBuilder:
+    """Builds the RecordSeries of each function of a run from its snapshot
+    lines."""
+
+    def __init__(self):
+        # {funcname: RecordSeries}
+        self.series = {}
+
+    def feed(self, text):
+        """Parses the snapshot lines of `text`, which must end with a whole
+        line."""
+        if SNAPSHOT not in text:
+            return
+        for funcname, num_bytes, values in SNAPSHOT_LINE_REGEX.findall(text):
+            fields = values.split()
+            series = self.series.get(funcname)
+            if series is None:
+                series = self.series[funcname] = RecordSeries()
+            series.add_snapshot(float(num_bytes),
+                                {fields[i]: float(fields[i + 1])
+                                 for i in range(0, len(fields), 2)})
+
+def records_to_dict(records):
+    return {funcname: series.to_dict() for funcname, series in records.items()}
+
+def records_from_dict(content):
+    return {funcname: RecordSeries.from_dict(series)
+            for funcname, series in content.items()}
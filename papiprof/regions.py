@@ -0,0 +1,102 @@
+"""Nested regions in the output of the client and server binaries.
+
+Besides the flat <funcname>_<metric> lines (see papiprof.papihelper), a
+binary can report nested regions, e.g. the ECDH computation and the bignum
+routines inside the handshake:
+
+    region_enter <id> <parent_id> <name>      parent_id 0: a top-level region
+    region_exit <id> <metric> <value> [<metric> <value> ...]
+
+The ids only have to be unique among the regions that are open at the same
+time. The values of region_exit are measured from the enter to the exit of
+the region, so they include the cost of its children. A region can be
+entered several times in a run, e.g. from a loop.
+
+The regions of a run are folded into a call tree, with a node per path of
+names from the top-level region, and each node becomes a function of the
+flat metrics, named after its path (e.g. "handshake;ecdh_compute_shared";
+the separator is the one of folded stacks):
+
+    <metric>          inclusive cost, over all the times the node was entered
+    self_<metric>     exclusive cost: the inclusive cost minus that of the
+                      children
+    calls             number of times the node was entered
+
+so that the call tree is saved, summarized and compared like any other
+function. The values of a top-level region replace those of a flat function
+with the same name. See papiprof.calltree for the aggregated tree and folded
+stacks.
+"""
+import re
+
+PATH_SEPARATOR = ';'
+SELF_METRIC_PREFIX = 'self_'
+CALLS_METRIC = 'calls'
+
+REGION_ENTER = 'region_enter'
+REGION_EXIT = 'region_exit'
+
+REGION_LINE_REGEX = re.compile(
+    r'^(?:region_enter[ \t]+(\d+)[ \t]+(\d+)[ \t]+([^\r\n]+?)'
+    r'|region_exit[ \t]+(\d+)((?:[ \t]+\w+[ \t]+\d+)+))[ \t]*\r?$',
+    re.MULTILINE)
+
+class RegionTreeBuilder:
+    """
+    Builds the call tree of a run from its region lines. Only the open
+    regions and the nodes of the tree are kept, not every region that was
+    entered.
+    """
+
+    def __init__(self):
+        # {id: (path, parent id, {metric: inclusive value of the exited children})}
+        self._open_regions = {}
+        # {path: {metric: value}}
+        self.nodes = {}
+
+    def feed(self, text):
+        """Parses the region lines of `text`, which must end with a whole
+        line."""
+        if REGION_ENTER not in text and REGION_EXIT not in text:
+            return
+        for (enter_id, parent_id, name,
+             exit_id, values) in REGION_LINE_REGEX.findall(text):
+            if enter_id:
+                self.enter(int(enter_id), int(parent_id), name)
+            else:
+                fields = values.split()
+                self.exit(int(exit_id), {fields[i]: float(fields[i + 1])
+                                         for i in range(0, len(fields), 2)})
+
+    def enter(self, region_id, parent_id, name):
+        parent = self._open_regions.get(parent_id)
+        path = f'{parent[0]}{PATH_SEPARATOR}{name}' if parent else name
+        self._open_regions[region_id] = (path, parent_id, {})
+
+    def exit(self, region_id, values):
+        region = self._open_regions.pop(region_id, None)
+        if region is None:
+            return
+        path, parent_id, children = region
+
+        node = self.nodes.setdefault(path, {CALLS_METRIC: 0})
+        node[CALLS_METRIC] += 1
+        for metric_name, value in values.items():
+            self_metric = f'{SELF_METRIC_PREFIX}{metric_name}'
+            node[metric_name] = node.get(metric_name, 0) + value
+            node[self_metric] = (node.get(self_metric, 0)
+                                 + value - children.get(metric_name, 0))
+
+        # the parent is still open, so its id wasn't reused
+        parent = self._open_regions.get(parent_id)
+        if parent is not None:
+            parent_children = parent[2]
+            for metric_name, value in values.items():
+                parent_children[metric_name] = parent_children.get(metric_name, 0) + value
+
+    def add_to_metrics(self, metrics):
+        """Adds the nodes to the flat metrics of the run ({funcname: {metric:
+        value}}) and returns them."""
+        for path, values in self.nodes.items():
+            metrics[path].update(values)
+        return metrics
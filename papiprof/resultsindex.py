@@ -0,0 +1,180 @@
+"""Lazily indexed reading of directories of *.papi.out.* JSON files.
+
+Reading a directory of results used to mean loading every file in full. The
+ResultsIndex instead keeps a manifest of the directory, cached on disk as
+MANIFEST_FILE, recording for each file:
+
+    {
+        'mtime_ns': 123, 'size': 123, 'sha256': ...,
+        'functions': {
+            <funcname>: [<start>, <end>],  # byte offsets of its JSON value
+        }
+    }
+
+A file whose size and modification time didn't change is not read at all.
+One that did is hashed, and only parsed again if its content changed (a
+copied or touched directory keeps its manifest). The entries of the
+functions that are asked for are then read straight from a memory map of
+their file, without parsing the rest.
+
+This is the one index of the results files: printm.py and the call trees
+also cache their merged summaries on top of it (see papiprof.summarycache).
+"""
+import os
+import json
+import mmap
+import hashlib
+
+from papiprof.environment import file_sha256
+
+MANIFEST_FILE = '.papi.manifest.json'
+MANIFEST_VERSION = 2
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+def _skip_whitespace(text, pos):
+    while pos < len(text) and text[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+def scan_top_level_spans(text):
+    """
+    Scans a JSON object and returns {key: (value, start, end)} for each of its
+    top-level keys, where text[start:end] is the JSON of the value.
+    """
+    spans = {}
+    pos = _skip_whitespace(text, 0)
+    if text[pos:pos + 1] != '{':
+        raise ValueError('Expected a JSON object')
+    pos = _skip_whitespace(text, pos + 1)
+
+    while text[pos:pos + 1] != '}':
+        key, pos = _decoder.raw_decode(text, pos)
+        pos = _skip_whitespace(text, pos)
+        if text[pos:pos + 1] != ':':
+            raise ValueError(f'Expected ":" at {pos}')
+        start = _skip_whitespace(text, pos + 1)
+        value, end = _decoder.raw_decode(text, start)
+        spans[key] = (value, start, end)
+
+        pos = _skip_whitespace(text, end)
+        if text[pos:pos + 1] == ',':
+            pos = _skip_whitespace(text, pos + 1)
+
+    return spans
+
+def _file_stat(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def build_file_entry(path):
+    # the files are ASCII, so character offsets are also byte offsets
+    with open(path, 'rb') as f:
+        content = f.read()
+    text = content.decode('utf-8')
+    if len(text) != len(content):
+        raise ValueError(f'{path} is not an ASCII JSON file')
+
+    mtime_ns, size = _file_stat(path)
+    sha256 = hashlib.sha256(content).hexdigest()
+    functions = {funcname: [start, end] for funcname, (_, start, end)
+                 in scan_top_level_spans(text).items()}
+    return {'mtime_ns': mtime_ns, 'size': size, 'sha256': sha256,
+            'functions': functions}
+
+class ResultsIndex:
+    """Manifest of the *.papi.out.* files of a results directory."""
+
+    def __init__(self, directory, use_cache=True):
+        self.directory = directory
+        self.use_cache = use_cache
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+        self.files = {}
+        self.stats = {'unchanged': 0, 'rehashed': 0, 'parsed': 0, 'removed': 0}
+        self._is_dirty = False
+
+        if use_cache:
+            self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get('version') == MANIFEST_VERSION:
+            self.files = manifest['files']
+
+    def save(self):
+        """Saves the manifest next to the results, if anything changed. A
+        read-only results directory is not an error."""
+        if not (self.use_cache and self._is_dirty):
+            return
+        tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': MANIFEST_VERSION, 'files': self.files}, f)
+            os.replace(tmp_path, self.manifest_path)
+            self._is_dirty = False
+        except OSError:
+            pass
+
+    def update(self, file_names):
+        """Makes sure the manifest is up to date for `file_names` (relative to
+        the directory) and forgets about any other file."""
+        files = {}
+        for file_name in file_names:
+            path = os.path.join(self.directory, file_name)
+            entry = self.files.get(file_name)
+            stat = _file_stat(path)
+            if entry is not None and (entry['mtime_ns'], entry['size']) == stat:
+                self.stats['unchanged'] += 1
+            elif entry is not None and entry['sha256'] == file_sha256(path):
+                entry = dict(entry, mtime_ns=stat[0], size=stat[1])
+                self.stats['rehashed'] += 1
+                self._is_dirty = True
+            else:
+                entry = build_file_entry(path)
+                self.stats['parsed'] += 1
+                self._is_dirty = True
+            files[file_name] = entry
+
+        self.stats['removed'] += len(self.files.keys() - files.keys())
+        if files.keys() != self.files.keys():
+            self._is_dirty = True
+        self.files = files
+
+    def format_stats(self):
+        s = self.stats
+        return (f'{s["unchanged"]} files unchanged, {s["rehashed"]} touched but '
+                f'unchanged, {s["parsed"]} new or changed ones parsed, '
+                f'{s["removed"]} removed')
+
+    def functions(self):
+        return sorted({funcname for entry in self.files.values()
+                       for funcname in entry['functions']})
+
+    def iter_function_values(self, selected_functions=None, file_names=None):
+        """
+        Yields (file name, funcname, value) for each of the functions of each
+        of the `file_names` (all of the indexed files by default). Only the
+        selected functions are read, from a memory map of their file.
+        """
+        if file_names is None:
+            file_names = list(self.files)
+
+        for file_name in file_names:
+            entry = self.files[file_name]
+            functions = entry['functions']
+            wanted = [funcname for funcname in functions
+                      if not selected_functions or funcname in selected_functions]
+            if not wanted:
+                continue
+
+            path = os.path.join(self.directory, file_name)
+            with open(path, 'rb') as f, \
+                 mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for funcname in wanted:
+                    start, end = functions[funcname]
+                    yield file_name, funcname, json.loads(mm[start:end])
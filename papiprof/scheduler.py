@@ -0,0 +1,98 @@
+"""Scheduling of concurrent client/server pairs for a profiling campaign."""
+import os
+import time
+from collections import namedtuple
+
+"""
+A pair slot is what a single client/server pair runs with: its own server
+port and the CPUs the server and the client are pinned to. None for the
+CPUs means that the process is not pinned.
+"""
+PairSlot = namedtuple('PairSlot', ['index', 'port', 'server_cpus',
+                                   'client_cpus'])
+
+# a single run of a configuration. events: the PAPI events to measure in the
+# run, None to leave it up to the binaries
+ProfilingJob = namedtuple('ProfilingJob', ['sc_id', 'cli_bytes_to_send',
+                                           'srv_bytes_to_send', 'run_index',
+                                           'events'])
+
+def can_pin_cpus():
+    return hasattr(os, 'sched_setaffinity') and hasattr(os, 'sched_getaffinity')
+
+def get_available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def build_pair_slots(num_pairs, base_port=None, cpus_per_pair=2, pin=True):
+    """Builds `num_pairs` pair slots.
+
+    Slot `i` gets the port `base_port + i` and, if pinning, the `i`th group
+    of `cpus_per_pair` available CPUs. The first half of the group is used by
+    the server and the second half by the client (both share it if there is
+    a single CPU in the group). Groups never overlap, so that the PAPI
+    counters of a pair are not disturbed by the others.
+    """
+    cpus = get_available_cpus()
+    pin = pin and can_pin_cpus()
+
+    if num_pairs == 1:
+        cpus_per_pair = min(cpus_per_pair, len(cpus))
+
+    if pin and num_pairs * cpus_per_pair > len(cpus):
+        raise ValueError(f'{num_pairs} pairs with {cpus_per_pair} CPUs each '
+                         f'need {num_pairs * cpus_per_pair} CPUs, but only '
+                         f'{len(cpus)} are available')
+
+    slots = []
+    for i in range(num_pairs):
+        port = base_port + i if base_port else None
+        server_cpus = client_cpus = None
+
+        if pin:
+            group = cpus[i * cpus_per_pair:(i + 1) * cpus_per_pair]
+            half = max(len(group) // 2, 1)
+            server_cpus = set(group[:half])
+            client_cpus = set(group[half:]) or server_cpus
+
+        slots.append(PairSlot(i, port, server_cpus, client_cpus))
+    return slots
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+
+class CampaignProgress:
+    """Keeps track of the completed runs of a campaign and estimates the
+    remaining time from the average run throughput so far."""
+
+    def __init__(self, total_runs):
+        self.total_runs = total_runs
+        self.completed_runs = 0
+        self.start_time = time.monotonic()
+
+    def run_completed(self):
+        self.completed_runs += 1
+
+    def skip_runs(self, num_runs):
+        """Takes runs that won't be done after all out of the total."""
+        self.total_runs -= num_runs
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def eta(self):
+        if not self.completed_runs:
+            return None
+        remaining_runs = self.total_runs - self.completed_runs
+        return self.elapsed() / self.completed_runs * remaining_runs
+
+    def __str__(self):
+        percent = 100 * self.completed_runs / self.total_runs if self.total_runs else 100
+        eta = self.eta()
+        eta_str = format_duration(eta) if eta is not None else '--:--:--'
+        return (f'[{self.completed_runs}/{self.total_runs} runs {percent:.1f}% '
+                f'elapsed {format_duration(self.elapsed())} ETA {eta_str}]')
@@ -0,0 +1,601 @@
+"""Statistics helpers for the profiling results.
+
+numpy is optional (see the Pipfile): with it, summarize() and the bootstrap
+are vectorized, otherwise they run in plain Python.
+"""
+import math
+import random
+import operator
+from itertools import repeat
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class RunningStats:
+    """Constant memory accumulator of the count, mean, variance, min and max
+    of a series of values.
+
+    Values are added with Welford's online algorithm, which is numerically
+    stable. Two accumulators (e.g. from different workers) can be combined
+    with merge(), which gives the same result as if all of the values had
+    been added to a single one.
+    """
+
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+        self.min = math.inf
+        self.max = -math.inf
+
+    @classmethod
+    def from_values(cls, values):
+        """Accumulator of a series of values that are already in memory,
+        computed with C-level passes instead of add()."""
+        stats = cls()
+        count = len(values)
+        if not count:
+            return stats
+        stats.count = count
+        stats.mean = math.fsum(values) / count
+        stats.m2 = math.fsum(map(operator.mul,
+                                 map(operator.sub, values, repeat(stats.mean, count)),
+                                 map(operator.sub, values, repeat(stats.mean, count))))
+        stats.min = min(values)
+        stats.max = max(values)
+        return stats
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Merges the values of `other` into this accumulator (Chan et al.)."""
+        if not other.count:
+            return self
+        if not self.count:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        """Sample variance, 0 if there are less than two values."""
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    @property
+    def stdev(self):
+        """Sample standard deviation, 0 if there are less than two values."""
+        return math.sqrt(self.variance)
+
+    def relative_ci(self, confidence=0.95):
+        """
+        Half width of the confidence interval of the mean (from the normal
+        approximation), relative to the mean. Infinite if there are less than
+        two values or the mean is 0.
+        """
+        if self.count < 2 or not self.mean:
+            return math.inf
+        return (z_critical_value(confidence) * self.stdev /
+                math.sqrt(self.count) / abs(self.mean))
+
+    def __repr__(self):
+        return (f'RunningStats(count={self.count}, mean={self.mean}, '
+                f'stdev={self.stdev}, min={self.min}, max={self.max})')
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+DEFAULT_CONFIDENCE = 0.95
+
+# coefficients of Acklam's rational approximation of the normal quantile
+_ACKLAM_A = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+             1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+_ACKLAM_B = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+             6.680131188771972e+01, -1.328068155288572e+01)
+_ACKLAM_C = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+             -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_ACKLAM_D = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+             3.754408661907416e+00)
+_ACKLAM_P_LOW = 0.02425
+
+def normal_quantile(p):
+    """
+    Inverse of the CDF of the standard normal distribution, for 0 < p < 1.
+    Acklam's approximation, refined with a step of Halley's method to about
+    the precision of a float (statistics.NormalDist is Python 3.8+).
+    """
+    if not 0 < p < 1:
+        raise ValueError(f'normal_quantile() of {p}, expected 0 < p < 1')
+    a, b, c, d = _ACKLAM_A, _ACKLAM_B, _ACKLAM_C, _ACKLAM_D
+    if p < _ACKLAM_P_LOW or p > 1 - _ACKLAM_P_LOW:
+        q = math.sqrt(-2 * math.log(min(p, 1 - p)))
+        x = ((((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) /
+             ((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1))
+        if p > 0.5:
+            x = -x
+    else:
+        q = p - 0.5
+        r = q * q
+        x = ((((((a[0]*r + a[1])*r + a[2])*r + a[3])*r + a[4])*r + a[5])*q /
+             (((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1))
+
+    error = 0.5 * math.erfc(-x / math.sqrt(2)) - p
+    u = error * math.sqrt(2 * math.pi) * math.exp(x * x / 2)
+    return x - u / (1 + x * u / 2)
+
+def z_critical_value(confidence):
+    """Two-sided critical value of the standard normal distribution."""
+    if not 0 < confidence < 1:
+        raise ValueError(f'Invalid confidence level {confidence}, expected a '
+                         'value between 0 and 1, e.g. 0.95')
+    return normal_quantile((1 + confidence) / 2)
+
+def parse_confidence(value):
+    """Parses a confidence level given on the command line, e.g. "0.95"."""
+    confidence = float(value)
+    z_critical_value(confidence)
+    return confidence
+
+def percentile(sorted_values, p):
+    """
+    Returns the `p`th percentile (0-100) of the already sorted values, with
+    linear interpolation between the closest ranks.
+    """
+    if not len(sorted_values):
+        raise ValueError('percentile() of an empty series')
+    rank = (len(sorted_values) - 1) * p / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    fraction = rank - low
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * fraction
+
+def normal_mean_ci(mean, stdev, count, confidence=DEFAULT_CONFIDENCE):
+    """Confidence interval of the mean from the normal approximation."""
+    if count < 2:
+        return [mean, mean]
+    half_width = z_critical_value(confidence) * stdev / math.sqrt(count)
+    return [mean - half_width, mean + half_width]
+
+# without numpy, above this many samples, the bootstrap resamples the sums of
+# batches of samples instead of the samples themselves
+BOOTSTRAP_MAX_BATCHES = 10000
+# with numpy, the bootstrap draws at most about this many indices at once
+NUMPY_BOOTSTRAP_CHUNK = 1 << 22
+
+def _bootstrap_means_numpy(values, num_resamples, rng):
+    """The means of `num_resamples` resamples of the values, drawn in chunks
+    of resamples to bound the memory."""
+    data = numpy.asarray(values, dtype=float)
+    count = len(data)
+    generator = numpy.random.default_rng(rng.getrandbits(64))
+    means = numpy.empty(num_resamples)
+    rows = max(1, NUMPY_BOOTSTRAP_CHUNK // count)
+    for start in range(0, num_resamples, rows):
+        num_rows = min(rows, num_resamples - start)
+        indices = generator.integers(0, count, size=(num_rows, count))
+        means[start:start + num_rows] = data[indices].mean(axis=1)
+    means.sort()
+    return means
+
+def _bootstrap_means_python(values, num_resamples, rng, max_batches):
+    """
+    The sorted means of `num_resamples` resamples of the values. Series of
+    more than `max_batches` samples are cut into `max_batches` contiguous
+    batches, whose sums are resampled, so that each resample costs
+    O(max_batches) instead of O(n). This is a block bootstrap: for
+    independent samples its interval is close to that of resampling the
+    samples (see tests/test_stats.py), but it's an approximation.
+    """
+    count = len(values)
+    if count <= max_batches:
+        return sorted(math.fsum(rng.choices(values, k=count)) / count
+                      for _ in range(num_resamples))
+    batch_size = -(-count // max_batches)
+    sums = [math.fsum(values[i:i + batch_size]) for i in range(0, count, batch_size)]
+    sizes = [min(batch_size, count - i) for i in range(0, count, batch_size)]
+    indices = range(len(sums))
+    means = []
+    for _ in range(num_resamples):
+        chosen = rng.choices(indices, k=len(sums))
+        means.append(math.fsum(sums[i] for i in chosen) /
+                     sum(sizes[i] for i in chosen))
+    means.sort()
+    return means
+
+def bootstrap_mean_ci(values, confidence=DEFAULT_CONFIDENCE, num_resamples=1000,
+                      rng=None, max_batches=BOOTSTRAP_MAX_BATCHES):
+    """
+    Percentile bootstrap confidence interval of the mean. With numpy, the
+    samples themselves are resampled. Without it, series of more than
+    `max_batches` samples are resampled by batches (see
+    _bootstrap_means_python()).
+    """
+    rng = rng or random.Random(0)
+    if numpy is not None:
+        means = _bootstrap_means_numpy(values, num_resamples, rng)
+    else:
+        means = _bootstrap_means_python(values, num_resamples, rng, max_batches)
+    alpha = (1 - confidence) / 2
+    return [float(percentile(means, 100 * alpha)),
+            float(percentile(means, 100 * (1 - alpha)))]
+
+OUTLIERS_NONE = 'none'
+OUTLIERS_IQR = 'iqr'
+OUTLIERS_MAD = 'mad'
+OUTLIER_METHODS = (OUTLIERS_NONE, OUTLIERS_IQR, OUTLIERS_MAD)
+
+DEFAULT_OUTLIER_THRESHOLDS = {
+    # Tukey's fences: outside of [q1 - k * IQR, q3 + k * IQR]
+    OUTLIERS_IQR: 1.5,
+    # modified z-score (Iglewicz and Hoaglin): 0.6745 * |x - median| / MAD
+    OUTLIERS_MAD: 3.5,
+}
+
+"""
+How the samples of a series are filtered before being summarized:
+    warmup     number of first samples to discard
+    outliers   outlier rejection method, one of OUTLIER_METHODS
+    threshold  of the outlier rejection, None for its default
+    trim       proportion of the samples cut from each end for the trimmed
+               mean, 0 for none
+"""
+SampleFilter = namedtuple('SampleFilter', ['warmup', 'outliers', 'threshold',
+                                           'trim'])
+NO_SAMPLE_FILTER = SampleFilter(0, OUTLIERS_NONE, None, 0)
+
+def outlier_bounds(sorted_values, method, threshold=None):
+    """
+    Returns the (low, high) bounds outside of which values are outliers, or
+    None if they can't be computed (e.g. with a MAD of 0).
+    """
+    if method not in OUTLIER_METHODS:
+        raise ValueError(f'Unknown outlier rejection method {method}, use one of '
+                         f'{", ".join(OUTLIER_METHODS)}')
+    if method == OUTLIERS_NONE or len(sorted_values) < 3:
+        return None
+    if threshold is None:
+        threshold = DEFAULT_OUTLIER_THRESHOLDS[method]
+
+    if method == OUTLIERS_IQR:
+        q1 = percentile(sorted_values, 25)
+        q3 = percentile(sorted_values, 75)
+        if q3 == q1:
+            return None
+        return q1 - threshold * (q3 - q1), q3 + threshold * (q3 - q1)
+    if method == OUTLIERS_MAD:
+        median = percentile(sorted_values, 50)
+        mad = percentile(sorted(abs(v - median) for v in sorted_values), 50)
+        if not mad:
+            return None
+        half_width = threshold * mad / 0.6745
+        return median - half_width, median + half_width
+
+def filter_samples(values, sample_filter):
+    """
+    Discards the warm-up samples and then rejects the outliers of the rest.
+    At least one sample is always kept. Returns (kept values, rejected), with
+    rejected: {'warmup': 2, 'outliers': 1}
+    """
+    num_warmup = min(sample_filter.warmup, max(len(values) - 1, 0))
+    kept = list(values[num_warmup:])
+
+    bounds = outlier_bounds(sorted(kept), sample_filter.outliers,
+                            sample_filter.threshold)
+    num_outliers = 0
+    if bounds is not None:
+        low, high = bounds
+        num_kept = len(kept)
+        kept = [value for value in kept if low <= value <= high]
+        num_outliers = num_kept - len(kept)
+
+    return kept, {'warmup': num_warmup, 'outliers': num_outliers}
+
+def _trim_cut(count, proportion):
+    """Number of values cut from each end for a trimmed mean, at least one
+    value being kept."""
+    cut = int(count * proportion)
+    if 2 * cut >= count:
+        cut = (count - 1) // 2
+    return cut
+
+def trimmed_mean(sorted_values, proportion):
+    """Mean of the already sorted values without the `proportion` of them
+    at each end."""
+    cut = _trim_cut(len(sorted_values), proportion)
+    kept = sorted_values[cut:len(sorted_values) - cut]
+    return math.fsum(kept) / len(kept)
+
+def _summary_python(values, percentiles, trim):
+    """The statistics of summarize() but the CI, in plain Python with C-level
+    iteration (map(), fsum(), sorted())."""
+    count = len(values)
+    mean = math.fsum(values) / count
+    if count > 1:
+        squared_diffs = map(operator.mul,
+                            map(operator.sub, values, repeat(mean, count)),
+                            map(operator.sub, values, repeat(mean, count)))
+        stdev = math.sqrt(math.fsum(squared_diffs) / (count - 1))
+    else:
+        stdev = 0.0
+
+    sorted_values = sorted(values)
+    median = percentile(sorted_values, 50)
+    abs_deviations = sorted(map(abs, map(operator.sub, values,
+                                         repeat(median, count))))
+    summary = {
+        'avg': mean,
+        'stdev': stdev,
+        'min': sorted_values[0],
+        'max': sorted_values[-1],
+        'median': median,
+    }
+    for p in percentiles:
+        summary[f'p{p:g}'] = percentile(sorted_values, p)
+    summary['mad'] = percentile(abs_deviations, 50)
+    # filled in by summarize()
+    summary['ci'] = None
+    if trim:
+        summary['trimmed_avg'] = trimmed_mean(sorted_values, trim)
+    return summary
+
+def _summary_numpy(values, percentiles, trim):
+    """The same statistics as _summary_python(), vectorized with numpy."""
+    data = numpy.asarray(values, dtype=float)
+    count = len(data)
+    sorted_data = numpy.sort(data)
+    median = percentile(sorted_data, 50)
+    abs_deviations = numpy.abs(data - median)
+    abs_deviations.sort()
+    summary = {
+        'avg': float(data.mean()),
+        'stdev': float(data.std(ddof=1)) if count > 1 else 0.0,
+        'min': float(sorted_data[0]),
+        'max': float(sorted_data[-1]),
+        'median': float(median),
+    }
+    for p in percentiles:
+        summary[f'p{p:g}'] = float(percentile(sorted_data, p))
+    summary['mad'] = float(percentile(abs_deviations, 50))
+    summary['ci'] = None
+    if trim:
+        cut = _trim_cut(count, trim)
+        summary['trimmed_avg'] = float(sorted_data[cut:count - cut].mean())
+    return summary
+
+def summarize(values, percentiles=DEFAULT_PERCENTILES,
+              confidence=DEFAULT_CONFIDENCE, num_resamples=0, rng=None, trim=0):
+    """
+    Computes the statistics of a series of values (a list or an array):
+        {
+            'avg': 123, 'stdev': 12, 'min': 100, 'max': 150,
+            'median': 120, 'p50': 120, 'p90': 140, 'p99': 149,
+            'mad': 10,          # median absolute deviation
+            'ci': [119, 127],   # confidence interval of the mean
+            'trimmed_avg': 122, # only with `trim`
+        }
+
+    The confidence interval is bootstrapped if `num_resamples` is given,
+    otherwise it comes from the normal approximation.
+
+    With numpy, the passes over the values, the sorts and the bootstrap are
+    vectorized. Without it, the passes use C-level iteration but the sort
+    dominates, and all of the statistics take about as long as the mean and
+    stdev of the statistics module (see benchmarks/stats.py). Either way, the
+    values have to be in memory, unlike with RunningStats.
+    """
+    if not len(values):
+        raise ValueError('summarize() of an empty series')
+    if numpy is not None:
+        summary = _summary_numpy(values, percentiles, trim)
+    else:
+        summary = _summary_python(values, percentiles, trim)
+
+    if num_resamples and len(values) > 1:
+        ci = bootstrap_mean_ci(values, confidence, num_resamples, rng)
+    else:
+        ci = normal_mean_ci(summary['avg'], summary['stdev'], len(values), confidence)
+    summary['ci'] = ci
+    return summary
+
+def summarize_running_stats(stats, confidence=DEFAULT_CONFIDENCE):
+    """
+    The statistics of summarize() that only need the running stats (see
+    RunningStats), so not the samples:
+        {'avg': 123, 'stdev': 12, 'min': 100, 'max': 150, 'ci': [119, 127]}
+    """
+    if not stats.count:
+        raise ValueError('summarize_running_stats() of an empty series')
+    return {
+        'avg': stats.mean,
+        'stdev': stats.stdev,
+        'min': stats.min,
+        'max': stats.max,
+        'ci': normal_mean_ci(stats.mean, stats.stdev, stats.count, confidence),
+    }
+
+def summarize_series(series, **kwargs):
+    """Summarizes each series of a {key: values} dict, see summarize()."""
+    return {key: summarize(values, **kwargs)
+            for key, values in series.items() if len(values)}
+
+def _betacf(a, b, x, max_iterations=300, eps=3e-16):
+    """Continued fraction of the incomplete beta function (modified Lentz)."""
+    tiny = 1e-300
+    qab, qap, qam = a + b, a + 1, a - 1
+    c, d = 1.0, 1 - qab * x / qap
+    d = 1 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, max_iterations + 1):
+        m2 = 2 * m
+        for aa in (m * (b - m) * x / ((qam + m2) * (a + m2)),
+                   -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))):
+            d = 1 + aa * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + aa / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1) < eps:
+            break
+    return h
+
+def regularized_incomplete_beta(a, b, x):
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    log_front = (math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                 a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1) / (a + b + 2):
+        return math.exp(log_front) * _betacf(a, b, x) / a
+    return 1 - math.exp(log_front) * _betacf(b, a, 1 - x) / b
+
+def student_t_two_sided_p(t, df):
+    """Two-sided p-value of Student's t distribution with `df` degrees of
+    freedom."""
+    if math.isinf(df):
+        return math.erfc(abs(t) / math.sqrt(2))
+    return regularized_incomplete_beta(df / 2, 0.5, df / (df + t * t))
+
+def student_t_critical_value(confidence, df):
+    """Two-sided critical value of Student's t distribution, found by
+    bisection."""
+    alpha = 1 - confidence
+    low, high = 0.0, 1.0
+    while student_t_two_sided_p(high, df) > alpha:
+        high *= 2
+    for _ in range(100):
+        mid = (low + high) / 2
+        if student_t_two_sided_p(mid, df) > alpha:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+def welch_t_test(mean_a, stdev_a, count_a, mean_b, stdev_b, count_b):
+    """
+    Welch's t-test of the difference of the means of two samples, given by
+    their summaries. Returns (t, degrees of freedom, two-sided p-value).
+    """
+    var_a = stdev_a ** 2 / count_a
+    var_b = stdev_b ** 2 / count_b
+    se = math.sqrt(var_a + var_b)
+    if not se:
+        p = 1.0 if mean_a == mean_b else 0.0
+        return (0.0 if mean_a == mean_b else math.copysign(math.inf, mean_b - mean_a),
+                math.inf, p)
+    t = (mean_b - mean_a) / se
+    df = (var_a + var_b) ** 2 / (var_a ** 2 / (count_a - 1) +
+                                 var_b ** 2 / (count_b - 1))
+    return t, df, student_t_two_sided_p(t, df)
+
+def mann_whitney_u_test(values_a, values_b):
+    """
+    Mann-Whitney U test of two samples, with the normal approximation and
+    the tie correction. Returns (U of the second sample, z, two-sided
+    p-value, Cliff's delta). Cliff's delta is in [-1, 1], positive when the
+    values of the second sample tend to be larger.
+    """
+    count_a, count_b = len(values_a), len(values_b)
+    tagged = sorted([(v, 0) for v in values_a] + [(v, 1) for v in values_b])
+    total = len(tagged)
+
+    rank_sum_b = 0.0
+    tie_term = 0
+    i = 0
+    while i < total:
+        j = i
+        while j + 1 < total and tagged[j + 1][0] == tagged[i][0]:
+            j += 1
+        average_rank = (i + j) / 2 + 1
+        ties = j - i + 1
+        tie_term += ties ** 3 - ties
+        rank_sum_b += average_rank * sum(1 for k in range(i, j + 1) if tagged[k][1])
+        i = j + 1
+
+    u_b = rank_sum_b - count_b * (count_b + 1) / 2
+    mean_u = count_a * count_b / 2
+    var_u = count_a * count_b / 12 * ((total + 1) - tie_term / (total * (total - 1)))
+    if var_u <= 0:
+        z, p = 0.0, 1.0
+    else:
+        # continuity correction
+        z = (u_b - mean_u - math.copysign(0.5, u_b - mean_u)) / math.sqrt(var_u) \
+            if u_b != mean_u else 0.0
+        p = math.erfc(abs(z) / math.sqrt(2))
+    cliffs_delta = 2 * u_b / (count_a * count_b) - 1
+    return u_b, z, p, cliffs_delta
+
+def hedges_g(mean_a, stdev_a, count_a, mean_b, stdev_b, count_b,
+             confidence=DEFAULT_CONFIDENCE):
+    """
+    Standardized difference of the means (b - a) with the small sample
+    correction, and its approximate confidence interval. Returns (g, [low,
+    high]), or (None, None) if the pooled standard deviation is 0.
+    """
+    df = count_a + count_b - 2
+    if df <= 0:
+        return None, None
+    pooled = math.sqrt(((count_a - 1) * stdev_a ** 2 +
+                        (count_b - 1) * stdev_b ** 2) / df)
+    if not pooled:
+        return None, None
+    correction = 1 - 3 / (4 * df - 1)
+    g = (mean_b - mean_a) / pooled * correction
+    se = math.sqrt((count_a + count_b) / (count_a * count_b) +
+                   g * g / (2 * (count_a + count_b)))
+    half_width = z_critical_value(confidence) * se
+    return g, [g - half_width, g + half_width]
+
+def relative_difference(mean_a, stdev_a, count_a, mean_b, stdev_b, count_b,
+                        confidence=DEFAULT_CONFIDENCE):
+    """
+    Relative difference of the means, mean_b / mean_a - 1, with its
+    confidence interval from the delta method and Welch's degrees of
+    freedom. Returns (difference, [low, high]), or (None, None) if mean_a is
+    0.
+    """
+    if not mean_a:
+        return None, None
+    ratio = mean_b / mean_a
+    var_a = stdev_a ** 2 / count_a
+    var_b = stdev_b ** 2 / count_b
+    se = math.sqrt(var_b / mean_a ** 2 + ratio ** 2 * var_a / mean_a ** 2)
+    if se and count_a > 1 and count_b > 1:
+        _, df, _ = welch_t_test(mean_a, stdev_a, count_a, mean_b, stdev_b, count_b)
+        half_width = student_t_critical_value(confidence, df) * se
+    else:
+        half_width = 0.0
+    return ratio - 1, [ratio - 1 - half_width, ratio - 1 + half_width]
+
+def holm_adjust(p_values):
+    """Holm-Bonferroni adjusted p-values, in the same order, for testing many
+    hypotheses at once."""
+    order = sorted(range(len(p_values)), key=lambda i: p_values[i])
+    adjusted = [0.0] * len(p_values)
+    running_max = 0.0
+    for rank, i in enumerate(order):
+        running_max = max(running_max, min(1.0, (len(p_values) - rank) * p_values[i]))
+        adjusted[i] = running_max
+    return adjusted
@@ -0,0 +1,537 @@
+"""Append-only columnar store of the raw per-run profiling samples.
+
+A store is a directory with two files:
+
+    samples.f64   the raw samples, as little-endian 64-bit floats
+    index.jsonl   one JSON object per line, describing a block of samples
+
+Each block holds consecutive samples of a single series, identified by a
+StoreKey: (campaign, entity, ciphersuite, bytes sent, bytes received,
+function, metric). A series can span several blocks, which are
+concatenated in the order they were appended.
+
+An index entry with "kind": "samples" points at its block with "offset" and
+"count" (both in samples). It also keeps the running stats of the block,
+"mean", "m2", "min" and "max" (see papiprof.stats.RunningStats), which are
+merged into the count, mean, variance, min and max of a series without
+reading its samples (see ResultsStore.running_stats()). Entries with "kind": "summary" carry no samples,
+only "num_runs", "avg" and "stdev". They are used for results imported from
+the JSON files, which don't keep the raw samples.
+
+The samples of a block are written before its index entry, so a store that
+was interrupted while being written is still consistent. Only its last index
+line can be cut short: it is dropped, and the index rewritten without it, when
+the store is opened again.
+
+Usage:
+    python -m papiprof.store import <store> <results_dir> [<results_dir> ...]
+    python -m papiprof.store info <store>
+"""
+import os
+import sys
+import json
+import mmap
+import argparse
+from array import array
+from collections import namedtuple, defaultdict
+from pathlib import Path
+
+from utils.colors import print_green, print_yellow
+from papiprof.papihelper import NON_METRIC_KEYS
+from papiprof.stats import RunningStats
+
+SAMPLES_FILE = 'samples.f64'
+INDEX_FILE = 'index.jsonl'
+STORE_DIR = 'papi.store'
+# written to a results directory whose samples are in another store, e.g. the
+# shared store of a matrix (see papiprof.matrix): {"store": <path relative to
+# the directory>, "campaign": <name>}
+STORE_REF_FILE = 'papi.store.ref.json'
+
+KIND_SAMPLES = 'samples'
+KIND_SUMMARY = 'summary'
+
+SAMPLE_TYPECODE = 'd'
+SAMPLE_SIZE = array(SAMPLE_TYPECODE).itemsize
+
+# number of buffered samples of a series after which they are written out
+DEFAULT_BLOCK_SIZE = 65536
+
+# [client|server].papi.out.<ciphersuite_id>.<num_bytes_sent>.<num_bytes_received>
+PAPI_OUT_FILE_PREFIX = '.papi.out.'
+
+StoreKey = namedtuple('StoreKey', ['campaign', 'entity', 'ciphersuite',
+                                   'bytes_sent', 'bytes_received',
+                                   'function', 'metric'])
+
+def _key_from_entry(entry):
+    return StoreKey(*(entry[field] for field in StoreKey._fields))
+
+def _key_matches(key, filters):
+    return all(getattr(key, field) in values for field, values in filters.items())
+
+# the StoreKey fields of a configuration, i.e. everything but the function and
+# the metric. The series of a configuration are indexed together, as that's
+# what profile.py queries after each iteration.
+CONFIG_FIELDS = StoreKey._fields[:5]
+
+def _config_of(key):
+    return key[:len(CONFIG_FIELDS)]
+
+def _normalize_filters(filters):
+    """
+    Turns keyword filters (e.g. entity='client', metric=['virttime',
+    'virtcyc']) into {field: set_of_accepted_values}. None means any value.
+    """
+    normalized = {}
+    for field, value in filters.items():
+        if field not in StoreKey._fields:
+            raise ValueError(f'Unknown store key field: {field}')
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set, frozenset)):
+            normalized[field] = {str(v) for v in value}
+        else:
+            normalized[field] = {str(value)}
+    return normalized
+
+class ResultsStore:
+    """Appends samples to and loads them from a store directory.
+
+    The samples of a series are written out every `block_size` samples and on
+    flush(). With a `block_size` of None, they are only written out on
+    flush().
+    """
+
+    def __init__(self, path, block_size=DEFAULT_BLOCK_SIZE):
+        self.path = Path(path)
+        self.block_size = block_size
+        self._buffers = defaultdict(lambda: array(SAMPLE_TYPECODE))
+        self._index = None
+        # {StoreKey(...): [entry, ...]}, in the order the series were first
+        # appended, and {configuration: [StoreKey(...), ...]}
+        self._series = None
+        self._configs = None
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._samples_path = self.path / SAMPLES_FILE
+        self._index_path = self.path / INDEX_FILE
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def append(self, key, value):
+        """Buffers a sample of the series `key` (a StoreKey)."""
+        buf = self._buffers[key]
+        buf.append(value)
+        if self.block_size and len(buf) >= self.block_size:
+            self._write_blocks({key: buf})
+            del self._buffers[key]
+
+    def extend(self, key, values):
+        """Buffers several samples of the series `key` at once."""
+        buf = self._buffers[key]
+        buf.extend(values)
+        if self.block_size and len(buf) >= self.block_size:
+            self._write_blocks({key: buf})
+            del self._buffers[key]
+
+    def append_run(self, campaign, entity, ciphersuite, bytes_sent,
+                   bytes_received, profs):
+        """
+        Buffers the samples of a single run. profs structure:
+            {
+                'func_name': {
+                    'virttime: 123,
+                }
+            }
+        """
+        for funcname, metrics in profs.items():
+            for metric_name, value in metrics.items():
+                key = StoreKey(str(campaign), entity, str(ciphersuite),
+                               str(bytes_sent), str(bytes_received),
+                               funcname, metric_name)
+                self.append(key, value)
+
+    def append_summaries(self, summaries):
+        """
+        Appends summaries of series that have no raw samples:
+            {StoreKey(...): {'num_runs': 10, 'avg': 123, 'stdev': 12}}
+        """
+        self._write_entries([self._entry(key, KIND_SUMMARY, **summary)
+                             for key, summary in summaries.items()])
+
+    def flush(self):
+        """Writes out all of the buffered samples."""
+        if self._buffers:
+            self._write_blocks(self._buffers)
+            self._buffers = defaultdict(lambda: array(SAMPLE_TYPECODE))
+
+    def _entry(self, key, kind, **fields):
+        entry = key._asdict()
+        entry['kind'] = kind
+        entry.update(fields)
+        return entry
+
+    def _write_blocks(self, buffers):
+        entries = []
+        with open(self._samples_path, 'ab') as f:
+            offset = f.tell() // SAMPLE_SIZE
+            for key, buf in buffers.items():
+                if sys.byteorder != 'little':
+                    buf = array(SAMPLE_TYPECODE, buf)
+                    buf.byteswap()
+                buf.tofile(f)
+                stats = RunningStats.from_values(buf)
+                entries.append(self._entry(key, KIND_SAMPLES, offset=offset,
+                                           count=len(buf), mean=stats.mean,
+                                           m2=stats.m2, min=stats.min,
+                                           max=stats.max))
+                offset += len(buf)
+        self._write_entries(entries)
+
+    def _write_entries(self, entries):
+        # loading the index first drops a cut short last line before appending
+        index = self.index()
+        with open(self._index_path, 'a') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        index.extend(entries)
+        self._add_to_series(entries)
+
+    def _rewrite_index(self, entries):
+        tmp_path = self._index_path.with_name(INDEX_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        tmp_path.replace(self._index_path)
+
+    def _add_to_series(self, entries):
+        for entry in entries:
+            key = _key_from_entry(entry)
+            blocks = self._series.get(key)
+            if blocks is None:
+                blocks = self._series[key] = []
+                self._configs.setdefault(_config_of(key), []).append(key)
+            blocks.append(entry)
+
+    def _set_index(self, entries):
+        self._index = entries
+        self._series = {}
+        self._configs = {}
+        self._add_to_series(entries)
+
+    def remove(self, **filters):
+        """
+        Removes the series matching the filters (see load()), e.g. the samples
+        of a campaign that is run again from scratch. Only the index is
+        rewritten, the space of their samples isn't reclaimed. Returns the
+        number of index entries removed.
+        """
+        filters = _normalize_filters(filters)
+        self.flush()
+        entries = self.index()
+        kept = [entry for entry in entries
+                if not _key_matches(_key_from_entry(entry), filters)]
+        if len(kept) == len(entries):
+            return 0
+
+        self._rewrite_index(kept)
+        self._set_index(kept)
+        return len(entries) - len(kept)
+
+    def index(self):
+        """Returns all of the entries of the index."""
+        if self._index is None:
+            lines = []
+            if self._index_path.exists():
+                with open(self._index_path, 'r') as f:
+                    lines = [line for line in f if line.strip()]
+
+            # the last line may have been cut short by an interruption
+            entries = []
+            for line in lines:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+
+            # rewrite the index without the cut short line, if there was one,
+            # so that the next entry doesn't end up on the same line
+            if len(entries) != len(lines) or (lines and not lines[-1].endswith('\n')):
+                self._rewrite_index(entries)
+            self._set_index(entries)
+        return self._index
+
+    def _matching_series(self, filters):
+        """
+        Yields (StoreKey(...), [entry, ...]) for each series matching the
+        (normalized) filters, in the order they were first appended. When the
+        filters pin a single configuration, only its series are looked at.
+        """
+        self.index()
+        if all(len(filters.get(field, ())) == 1 for field in CONFIG_FIELDS):
+            config = tuple(next(iter(filters[field])) for field in CONFIG_FIELDS)
+            keys = self._configs.get(config, [])
+        else:
+            keys = self._series
+        for key in keys:
+            if _key_matches(key, filters):
+                yield key, self._series[key]
+
+    def keys(self, **filters):
+        """Returns the keys of the series in the store, in append order."""
+        filters = _normalize_filters(filters)
+        return [key for key, _ in self._matching_series(filters)]
+
+    def load(self, **filters):
+        """
+        Loads the raw samples of the series matching the filters. Each filter
+        is a StoreKey field name with a value or a list of accepted values,
+        e.g. load(entity='client', metric=['virttime']).
+
+        Returns: {StoreKey(...): array('d', [...])}
+
+        Only the blocks of the matching series are read, straight from a
+        memory map of the samples file.
+        """
+        filters = _normalize_filters(filters)
+        self.flush()
+        result = defaultdict(lambda: array(SAMPLE_TYPECODE))
+
+        entries = [entry for _, blocks in self._matching_series(filters)
+                   for entry in blocks if entry['kind'] == KIND_SAMPLES]
+        if not entries or not self._samples_path.stat().st_size:
+            return dict(result)
+
+        with open(self._samples_path, 'rb') as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for entry in entries:
+                start = entry['offset'] * SAMPLE_SIZE
+                end = start + entry['count'] * SAMPLE_SIZE
+                buf = result[_key_from_entry(entry)]
+                buf.frombytes(mm[start:end])
+
+        if sys.byteorder != 'little':
+            for buf in result.values():
+                buf.byteswap()
+        return dict(result)
+
+    def iter_series(self, **filters):
+        """
+        Yields (StoreKey(...), array('d', [...])) for each series matching the
+        filters (see load()), in the order they were first appended. Only the
+        samples of one series are in memory at a time.
+        """
+        filters = _normalize_filters(filters)
+        self.flush()
+        # {StoreKey(...): [entry, ...]}
+        blocks = {}
+        for key, entries in self._matching_series(filters):
+            entries = [entry for entry in entries if entry['kind'] == KIND_SAMPLES]
+            if entries:
+                blocks[key] = entries
+        if not blocks or not self._samples_path.stat().st_size:
+            return
+
+        with open(self._samples_path, 'rb') as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for key, entries in blocks.items():
+                buf = array(SAMPLE_TYPECODE)
+                for entry in entries:
+                    start = entry['offset'] * SAMPLE_SIZE
+                    buf.frombytes(mm[start:start + entry['count'] * SAMPLE_SIZE])
+                if sys.byteorder != 'little':
+                    buf.byteswap()
+                yield key, buf
+
+    def running_stats(self, **filters):
+        """
+        Returns the running stats of the series matching the filters (see
+        load()), merged from those of their blocks, in constant memory:
+            {StoreKey(...): RunningStats(...)}
+
+        Only the blocks of stores written before the running stats were kept
+        in the index are read, one at a time.
+        """
+        filters = _normalize_filters(filters)
+        self.flush()
+        result = {}
+        mm = None
+        try:
+            for key, entries in self._matching_series(filters):
+                for entry in entries:
+                    if entry['kind'] != KIND_SAMPLES:
+                        continue
+
+                    if 'm2' in entry:
+                        stats = RunningStats()
+                        stats.count, stats.mean, stats.m2 = (entry['count'], entry['mean'],
+                                                             entry['m2'])
+                        stats.min, stats.max = entry['min'], entry['max']
+                    else:
+                        if mm is None:
+                            with open(self._samples_path, 'rb') as f:
+                                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        start = entry['offset'] * SAMPLE_SIZE
+                        buf = array(SAMPLE_TYPECODE,
+                                    mm[start:start + entry['count'] * SAMPLE_SIZE])
+                        if sys.byteorder != 'little':
+                            buf.byteswap()
+                        stats = RunningStats.from_values(buf)
+                    result.setdefault(key, RunningStats()).merge(stats)
+        finally:
+            if mm is not None:
+                mm.close()
+        return result
+
+    def load_summaries(self, **filters):
+        """
+        Loads the imported summaries of the series matching the filters (see
+        load()).
+
+        Returns: {StoreKey(...): {'num_runs': 10, 'avg': 123, 'stdev': 12}}
+        """
+        filters = _normalize_filters(filters)
+        return {key: {'num_runs': entry['num_runs'],
+                      'avg': entry['avg'],
+                      'stdev': entry['stdev']}
+                for key, entries in self._matching_series(filters)
+                for entry in entries if entry['kind'] == KIND_SUMMARY}
+
+def results_dir_campaign(store, results_dir):
+    """The campaign of `results_dir` in `store`: the one named after the
+    directory (the default of profile.py) or the only one there is. None if
+    there are several campaigns and none is named after the directory."""
+    campaigns = {key.campaign for key in store.keys()}
+    name = Path(results_dir).resolve().name
+    if name in campaigns:
+        return name
+    if len(campaigns) == 1:
+        return campaigns.pop()
+    return None
+
+def write_store_ref(results_dir, store_path, campaign):
+    """Points `results_dir` to its campaign in the store at `store_path`."""
+    ref = {'store': os.path.relpath(store_path, results_dir), 'campaign': campaign}
+    with open(Path(results_dir) / STORE_REF_FILE, 'w') as f:
+        json.dump(ref, f, indent=4)
+
+def open_results_store(results_dir):
+    """
+    Opens the store of `results_dir`, its STORE_DIR or the store of its
+    STORE_REF_FILE. Returns (ResultsStore, campaign), with a campaign of None
+    if it can't be told apart (see results_dir_campaign()), or (None, None)
+    if the directory has no store.
+    """
+    ref_path = Path(results_dir) / STORE_REF_FILE
+    if ref_path.is_file():
+        with open(ref_path, 'r') as f:
+            ref = json.load(f)
+        store_path = Path(results_dir) / ref['store']
+        if store_path.is_dir():
+            return ResultsStore(store_path), ref['campaign']
+
+    store_path = Path(results_dir) / STORE_DIR
+    if not store_path.is_dir():
+        return None, None
+    store = ResultsStore(store_path)
+    return store, results_dir_campaign(store, results_dir)
+
+def parse_papi_out_file_name(file_name):
+    """
+    Parses a [client|server].papi.out.<ciphersuite>.<sent>.<received> file
+    name into (entity, ciphersuite, bytes sent, bytes received). Returns None
+    if the name doesn't follow that format.
+    """
+    entity, sep, rest = file_name.partition(PAPI_OUT_FILE_PREFIX)
+    parts = rest.split('.')
+    if not sep or entity not in ('client', 'server') or len(parts) != 3:
+        return None
+    return (entity, *parts)
+
+def import_results_dir(store, results_dir, campaign=None):
+    """
+    Imports the summaries of the *.papi.out.* JSON files of `results_dir`
+    into `store`. The campaign defaults to the name of the directory.
+    Returns the number of imported files.
+
+    Older files also contain the results of the ciphersuites profiled before
+    theirs, so the same series can show up in several files. The summary
+    with the most runs is kept.
+    """
+    results_dir = Path(results_dir)
+    campaign = campaign or results_dir.resolve().name
+    summaries = {}
+    num_files = 0
+
+    for file_path in sorted(results_dir.iterdir()):
+        parsed = parse_papi_out_file_name(file_path.name)
+        if parsed is None or not file_path.is_file():
+            continue
+        entity, _, bytes_sent, bytes_received = parsed
+
+        with open(file_path, 'r') as f:
+            metrics = json.load(f)
+
+        for funcname, cs_ids in metrics.items():
+            for cs_id, measurments in cs_ids.items():
+                num_runs = measurments.get('num_runs', 0)
+                for metric_name, values in measurments.items():
+                    if metric_name in NON_METRIC_KEYS:
+                        continue
+                    key = StoreKey(campaign, entity, cs_id, bytes_sent,
+                                   bytes_received, funcname, metric_name)
+                    if key in summaries and summaries[key]['num_runs'] >= num_runs:
+                        continue
+                    summaries[key] = {'num_runs': num_runs,
+                                      'avg': values['avg'],
+                                      'stdev': values['stdev']}
+        num_files += 1
+
+    store.append_summaries(summaries)
+    return num_files
+
+def print_store_info(store):
+    index = store.index()
+    num_samples = sum(entry['count'] for entry in index
+                      if entry['kind'] == KIND_SAMPLES)
+    num_summaries = sum(1 for entry in index if entry['kind'] == KIND_SUMMARY)
+    print_green(f'Store: {store.path}')
+    print(f'\tIndex entries: {len(index)}')
+    print(f'\tSeries: {len(store.keys())}')
+    print(f'\tRaw samples: {num_samples}')
+    print(f'\tImported summaries: {num_summaries}')
+
+    campaigns = defaultdict(set)
+    for key in store.keys():
+        campaigns[key.campaign].add(key.entity)
+    for campaign, entities in sorted(campaigns.items()):
+        print(f'\t\t{campaign}: {", ".join(sorted(entities))}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage a PAPI results store')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    import_parser = subparsers.add_parser('import', help='import directories '
+                                          'of *.papi.out.* JSON files')
+    import_parser.add_argument('store', type=str, help='store path')
+    import_parser.add_argument('dirs', type=str, nargs='+', help='results '
+                               'directories to import. Each one is imported '
+                               'as a campaign named after the directory')
+
+    info_parser = subparsers.add_parser('info', help='show what is in a store')
+    info_parser.add_argument('store', type=str, help='store path')
+
+    args = parser.parse_args()
+    store = ResultsStore(args.store)
+
+    if args.command == 'import':
+        for results_dir in args.dirs:
+            num_files = import_results_dir(store, results_dir)
+            if not num_files:
+                print_yellow(f'[!] No *.papi.out.* files in {results_dir}')
+            print(f'Imported {num_files} files from {results_dir}')
+    print_store_info(store)
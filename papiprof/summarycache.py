@@ -0,0 +1,128 @@
+"""Cache of the merged summaries of a directory of *.papi.out.* JSON files.
+
+printm.py merges the summaries of all of the files of an entity every time it
+runs. The files are read through the ResultsIndex of the directory (see
+papiprof.resultsindex), the one index of the results files, which keeps
+their state and where each function is in them. On top of it, the
+SummaryCache keeps the merged metrics of each entity in CACHE_FILE:
+
+    {
+        'version': 2,
+        'merged': {
+            <entity>: {
+                'fingerprint': ...,   # of the names and hashes of its files
+                'functions': {<funcname>: {<cipherid>: {<measurment>: {...}}}}
+            }
+        }
+    }
+
+The merged metrics of an entity are reused as long as the fingerprint of its
+files is the same, so an unchanged directory is served from the manifest and
+CACHE_FILE alone. On a miss, only the selected functions are read from the
+files (e.g. printm.py -m), and the merged metrics are only cached when all of
+them were.
+"""
+import os
+import json
+import hashlib
+
+from papiprof.papihelper import NON_METRIC_KEYS
+from papiprof.resultsindex import ResultsIndex
+
+CACHE_FILE = '.papi.summary-cache.json'
+CACHE_VERSION = 2
+
+def merge_function_values(function_values):
+    """
+    Merges the (file name, funcname, {cipherid: {measurment: values}}) of
+    several files (see ResultsIndex.iter_function_values()), the later files
+    overriding the measurments of the earlier ones. The run counts and the
+    other non-metric keys are left out.
+    """
+    merged = {}
+    for _, funcname, cs_ids in function_values:
+        merged_cs_ids = merged.setdefault(funcname, {})
+        for cs_id, measurments in cs_ids.items():
+            merged_cs_ids.setdefault(cs_id, {}).update(
+                (name, values) for name, values in measurments.items()
+                if name not in NON_METRIC_KEYS)
+    return merged
+
+class SummaryCache:
+    """Merged summaries of the *.papi.out.* files of a results directory."""
+
+    def __init__(self, directory, use_cache=True):
+        self.directory = directory
+        self.use_cache = use_cache
+        self.index = ResultsIndex(directory, use_cache)
+        self.cache_path = os.path.join(directory, CACHE_FILE)
+        self.merged = {}
+        self.stats = {'merged_hits': 0, 'merged_misses': 0}
+        self._is_dirty = False
+
+        if use_cache:
+            try:
+                with open(self.cache_path, 'r') as f:
+                    cache = json.load(f)
+            except (OSError, ValueError):
+                cache = None
+            if cache is not None and cache.get('version') == CACHE_VERSION:
+                self.merged = cache['merged']
+
+    def save(self):
+        """Saves the manifest and the cache next to the results, if anything
+        changed. A read-only results directory is not an error."""
+        if not self.use_cache:
+            return
+        self.index.save()
+        if not self._is_dirty:
+            return
+        tmp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                # a single write is a lot faster than json.dump()
+                f.write(json.dumps({'version': CACHE_VERSION, 'merged': self.merged}))
+            os.replace(tmp_path, self.cache_path)
+            self._is_dirty = False
+        except OSError:
+            pass
+
+    def update(self, file_names):
+        """Makes sure the index is up to date for `file_names` (relative to the
+        directory) and forgets about any other file."""
+        self.index.update(file_names)
+
+    def _fingerprint(self, file_names):
+        sha256 = hashlib.sha256()
+        for file_name in file_names:
+            sha256.update(f'{file_name} {self.index.files[file_name]["sha256"]}\n'.encode())
+        return sha256.hexdigest()
+
+    def merged_metrics(self, name, file_names, functions=None):
+        """
+        The merged metrics of `file_names`, in that order, cached under `name`
+        (e.g. the entity): {funcname: {cipherid: {measurment: values}}}. With
+        `functions`, only those are returned.
+        """
+        fingerprint = self._fingerprint(file_names)
+        cached = self.merged.get(name)
+        if cached and cached['fingerprint'] == fingerprint:
+            self.stats['merged_hits'] += 1
+            merged = cached['functions']
+            if functions:
+                merged = {funcname: cs_ids for funcname, cs_ids in merged.items()
+                          if funcname in functions}
+            return merged
+
+        self.stats['merged_misses'] += 1
+        merged = merge_function_values(self.index.iter_function_values(functions,
+                                                                       file_names))
+        if not functions:
+            self.merged[name] = {'fingerprint': fingerprint, 'functions': merged}
+            self._is_dirty = True
+        return merged
+
+    def format_stats(self):
+        s = self.stats
+        return (f'{self.index.format_stats()}, merged summaries: '
+                f'{s["merged_hits"]} hits, {s["merged_misses"]} misses')
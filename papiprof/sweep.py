@@ -0,0 +1,361 @@
+"""Payload size grids and the scaling curves fitted over them.
+
+A size grid is given as:
+
+    1024,4096,16384      explicit sizes
+    log:64:1048576:8     8 log-spaced sizes from 64 bytes to 1 MiB
+    range:0:10000:1000   like range(0, 10000, 1000)
+
+For each (entity, function, ciphersuite) of a campaign, the cost of a metric
+(virtcyc by default) is fitted against the payload size, i.e. the bytes
+sent plus the bytes received by the entity, over all of the raw samples:
+
+    linear:     cost = overhead + cycles_per_byte * size
+    piecewise:  cost = overhead + slope * size + extra_slope * max(0, size - knee)
+
+The piecewise fit is kept if it explains the samples better (higher
+adjusted R^2), e.g. when small payloads fit in a single record. Its cycles
+per byte are those above the knee, the bulk transfer regime. Break-even
+sizes are the sizes at which the fitted cost of two ciphersuites crosses.
+
+Usage:
+    python -m papiprof.sweep <store> [--campaign <name>] [--metric virtcyc]
+"""
+import math
+import json
+import argparse
+from collections import defaultdict
+
+from utils.colors import print_green, print_yellow
+from papiprof.metrics import METRIC_VIRTCYC
+from papiprof.store import ResultsStore
+
+DEFAULT_FIT_METRIC = METRIC_VIRTCYC
+SCALING_FILE = 'papi.scaling.json'
+
+MODEL_LINEAR = 'linear'
+MODEL_PIECEWISE = 'piecewise'
+
+def log_spaced_sizes(start, end, num_points):
+    """`num_points` sizes from `start` to `end` (both included), evenly spaced
+    on a log scale and rounded to whole bytes."""
+    if start <= 0 or end < start or num_points < 1:
+        raise ValueError(f'Invalid log-spaced grid: {start}..{end}, {num_points} points')
+    if num_points == 1:
+        return [start]
+    ratio = (end / start) ** (1 / (num_points - 1))
+    sizes = [round(start * ratio ** i) for i in range(num_points)]
+    return sorted(set(sizes))
+
+def parse_size_grid(spec):
+    """Parses a size grid (see the module docstring) into a list of sizes."""
+    kind, sep, params = spec.partition(':')
+    try:
+        if not sep:
+            return [int(size) for size in spec.split(',') if size.strip()]
+        values = [int(value) for value in params.split(':')]
+        if kind == 'log' and len(values) == 3:
+            return log_spaced_sizes(*values)
+        if kind == 'range' and len(values) == 3:
+            return list(range(*values))
+    except ValueError:
+        pass
+    raise ValueError(f'Invalid size grid "{spec}", expected e.g. "1024,4096", '
+                     '"log:64:1048576:8" or "range:0:10000:1000"')
+
+def _size_stats(values):
+    """(count, mean, sum of squared deviations from the mean) of the samples
+    of a size."""
+    count = len(values)
+    mean = math.fsum(values) / count
+    return count, mean, math.fsum((v - mean) ** 2 for v in values)
+
+def _solve(matrix, vector):
+    """Solves a small linear system with Gaussian elimination. Returns None if
+    it is singular."""
+    n = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(n):
+            if r != col:
+                factor = rows[r][col] / rows[col][col]
+                rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [rows[i][n] / rows[i][i] for i in range(n)]
+
+def _least_squares(points, basis):
+    """
+    Least squares fit of y = sum(c_j * basis(x)_j) over all of the samples,
+    given per size as points: [(x, count, mean_y, within_ss)]. All of the
+    samples of a size share x, so this is the fit of the means weighted by
+    their counts, plus the spread within each size. Returns (coefficients,
+    sse) or None.
+    """
+    num_params = len(basis(points[0][0]))
+    xtx = [[0.0] * num_params for _ in range(num_params)]
+    xty = [0.0] * num_params
+    for x, count, mean_y, _ in points:
+        f = basis(x)
+        for j in range(num_params):
+            xty[j] += count * f[j] * mean_y
+            for k in range(num_params):
+                xtx[j][k] += count * f[j] * f[k]
+
+    coefficients = _solve(xtx, xty)
+    if coefficients is None:
+        return None
+    sse = math.fsum(within_ss + count * (mean_y - sum(c * b for c, b in
+                                                      zip(coefficients, basis(x)))) ** 2
+                    for x, count, mean_y, within_ss in points)
+    return coefficients, sse
+
+def _adjusted_r2(sse, sst, count, num_params):
+    if sst <= 0 or count <= num_params:
+        return None
+    return 1 - (sse / (count - num_params)) / (sst / (count - 1))
+
+def fit_scaling_curve(points):
+    """
+    Fits the cost against the payload size. points: [(size, count, mean,
+    within_ss)], one per size (see _size_stats()). Needs at least 2 sizes, 4
+    for the piecewise fit. Returns None if there are too few sizes,
+    otherwise:
+        {
+            'model': 'linear' | 'piecewise',
+            'overhead': 123,          # fitted cost of an empty payload
+            'cycles_per_byte': 1.2,   # above the knee, if piecewise
+            'knee': 4096,             # piecewise only
+            'slope_below_knee': 3.4,  # piecewise only
+            'r2': 0.99,               # adjusted R^2
+            'num_sizes': 5, 'num_samples': 100,
+            'min_size': 64, 'max_size': 1048576,
+            'linear': {'overhead': 123, 'cycles_per_byte': 1.2,
+                       'cycles_per_byte_se': 0.01, 'r2': 0.98},
+        }
+    """
+    points = sorted(points)
+    count = sum(p[1] for p in points)
+    if len(points) < 2 or count < 3:
+        return None
+    # the sizes are scaled to 0..1 to keep the normal equations well
+    # conditioned, the slopes are scaled back below
+    scale = float(points[-1][0]) or 1.0
+    scaled = [(x / scale, n, mean_y, within_ss) for x, n, mean_y, within_ss in points]
+    grand_mean = sum(n * mean_y for _, n, mean_y, _ in points) / count
+    sst = math.fsum(within_ss + n * (mean_y - grand_mean) ** 2
+                    for _, n, mean_y, within_ss in points)
+
+    linear = _least_squares(scaled, lambda u: (1.0, u))
+    if linear is None:
+        return None
+    (overhead, slope), linear_sse = linear
+    slope /= scale
+    linear_r2 = _adjusted_r2(linear_sse, sst, count, 2)
+    # standard error of the slope
+    mean_x = sum(n * x for x, n, _, _ in points) / count
+    sxx = math.fsum(n * (x - mean_x) ** 2 for x, n, _, _ in points)
+    slope_se = math.sqrt(linear_sse / (count - 2) / sxx) if sxx else math.inf
+    fit = {
+        'model': MODEL_LINEAR,
+        'overhead': overhead,
+        'cycles_per_byte': slope,
+        'r2': linear_r2,
+        'num_sizes': len(points),
+        'num_samples': count,
+        'min_size': points[0][0],
+        'max_size': points[-1][0],
+        'linear': {'overhead': overhead, 'cycles_per_byte': slope,
+                   'cycles_per_byte_se': slope_se, 'r2': linear_r2},
+    }
+
+    # the knee is searched among the inner sizes, so that there are at
+    # least 2 sizes on each side of it
+    best = None
+    for knee, *_ in points[1:-2]:
+        knee_u = knee / scale
+        piecewise = _least_squares(scaled, lambda u: (1.0, u, max(0.0, u - knee_u)))
+        if piecewise is not None and (best is None or piecewise[1] < best[2]):
+            best = (knee, *piecewise)
+
+    if best is not None:
+        knee, (p_overhead, p_slope, p_extra), p_sse = best
+        # the knee is a fitted parameter too
+        p_r2 = _adjusted_r2(p_sse, sst, count, 4)
+        if p_r2 is not None and (linear_r2 is None or p_r2 > linear_r2):
+            fit.update({
+                'model': MODEL_PIECEWISE,
+                'overhead': p_overhead,
+                'cycles_per_byte': (p_slope + p_extra) / scale,
+                'knee': knee,
+                'slope_below_knee': p_slope / scale,
+                'r2': p_r2,
+            })
+    return fit
+
+def predict_cost(fit, size):
+    cost = fit['overhead'] + fit.get('slope_below_knee', fit['cycles_per_byte']) * size
+    if fit['model'] == MODEL_PIECEWISE and size > fit['knee']:
+        cost += (fit['cycles_per_byte'] - fit['slope_below_knee']) * (size - fit['knee'])
+    return cost
+
+def _crossings(fit_a, fit_b):
+    """Sizes >= 0 at which the fitted costs cross. Both costs are piecewise
+    linear, so they're compared on each segment between their knees."""
+    edges = sorted({0.0} | {float(fit['knee']) for fit in (fit_a, fit_b)
+                            if fit['model'] == MODEL_PIECEWISE})
+    crossings = []
+    for i, start in enumerate(edges):
+        end = edges[i + 1] if i + 1 < len(edges) else None
+        # d(x) = d0 + slope * (x - start) on this segment
+        d0 = predict_cost(fit_a, start) - predict_cost(fit_b, start)
+        probe = end if end is not None else start + 1.0
+        slope = (predict_cost(fit_a, probe) - predict_cost(fit_b, probe) - d0) / (probe - start)
+        if slope == 0:
+            continue
+        x = start - d0 / slope
+        if x >= start and (end is None or x < end) and (x > 0 or d0 != 0):
+            crossings.append(x)
+    return crossings
+
+def _slopes_differ(fit_a, fit_b, z=1.96):
+    """Whether the linear cycles per byte of the fits differ significantly.
+    Costs that don't depend on the size only cross because of noise."""
+    a, b = fit_a['linear'], fit_b['linear']
+    se = math.hypot(a['cycles_per_byte_se'], b['cycles_per_byte_se'])
+    return abs(a['cycles_per_byte'] - b['cycles_per_byte']) > z * se
+
+def find_break_even_sizes(fits):
+    """
+    Finds the sizes at which the fitted cost of one ciphersuite drops below
+    another's, for each entity and function:
+        [{'entity': 'client', 'function': 'handshake', 'size': 12345,
+          'cheaper_below': '60', 'cheaper_above': '174',
+          'extrapolated': False}, ...]
+    `fits` is {(entity, function, ciphersuite): fit}. Only the ciphersuites
+    whose cycles per byte differ significantly are compared. Sizes beyond the
+    measured ones are marked as extrapolated.
+    """
+    by_function = defaultdict(list)
+    for (entity, function, ciphersuite), fit in fits.items():
+        by_function[entity, function].append((ciphersuite, fit))
+
+    break_evens = []
+    for (entity, function), suites in sorted(by_function.items()):
+        for i, (suite_a, fit_a) in enumerate(suites):
+            for suite_b, fit_b in suites[i + 1:]:
+                if not _slopes_differ(fit_a, fit_b):
+                    continue
+                for size in _crossings(fit_a, fit_b):
+                    a_is_cheaper_above = (predict_cost(fit_a, size + 1) <
+                                          predict_cost(fit_b, size + 1))
+                    break_evens.append({
+                        'entity': entity,
+                        'function': function,
+                        'size': size,
+                        'cheaper_below': suite_b if a_is_cheaper_above else suite_a,
+                        'cheaper_above': suite_a if a_is_cheaper_above else suite_b,
+                        'extrapolated': size > min(fit_a['max_size'], fit_b['max_size']),
+                    })
+    return break_evens
+
+def fit_campaign(store, campaign, metric=DEFAULT_FIT_METRIC, entity=None,
+                 functions=None):
+    """
+    Fits the scaling curve of each (entity, function, ciphersuite) of a
+    campaign from its raw samples in `store`. Returns {(entity, function,
+    ciphersuite): fit}, without the ones with too few sizes.
+    """
+    points = defaultdict(list)
+    samples = store.load(campaign=campaign, entity=entity, metric=metric,
+                         function=functions)
+    for key, values in samples.items():
+        if not len(values):
+            continue
+        size = int(key.bytes_sent) + int(key.bytes_received)
+        points[key.entity, key.function, key.ciphersuite].append(
+            (size, *_size_stats(values)))
+
+    fits = {}
+    for series, series_points in points.items():
+        fit = fit_scaling_curve(series_points)
+        if fit is not None:
+            fits[series] = fit
+    return fits
+
+def scaling_report(fits, break_evens, metric=DEFAULT_FIT_METRIC):
+    """The fits and break-even sizes as a JSON serializable dict."""
+    return {
+        'metric': metric,
+        'fits': [dict(fit, entity=entity, function=function,
+                      ciphersuite=ciphersuite)
+                 for (entity, function, ciphersuite), fit in sorted(fits.items())],
+        'break_even_sizes': break_evens,
+    }
+
+def save_scaling_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
+
+def print_scaling_report(fits, break_evens, metric=DEFAULT_FIT_METRIC,
+                         names=None):
+    """Prints the fits. `names` optionally maps ciphersuite ids to names."""
+    names = names or {}
+    print_green(f'--- SCALING ({metric} vs. payload bytes) ---')
+    if not fits:
+        print_yellow('\t[!] Nothing to fit, at least 2 payload sizes are needed')
+        return
+
+    for (entity, function, ciphersuite), fit in sorted(fits.items()):
+        name = names.get(ciphersuite, ciphersuite)
+        r2 = f'{fit["r2"]:.4f}' if fit['r2'] is not None else 'n/a'
+        print(f'\t{entity} {function} {name}: '
+              f'{fit["cycles_per_byte"]:.3f} {metric}/byte, '
+              f'fixed overhead {fit["overhead"]:.0f} '
+              f'({fit["model"]}, R^2 {r2}, {fit["num_sizes"]} sizes)')
+        if fit['model'] == MODEL_PIECEWISE:
+            print(f'\t\t{fit["slope_below_knee"]:.3f} {metric}/byte up to '
+                  f'{fit["knee"]} bytes')
+
+    for break_even in break_evens:
+        below = names.get(break_even['cheaper_below'], break_even['cheaper_below'])
+        above = names.get(break_even['cheaper_above'], break_even['cheaper_above'])
+        extrapolated = ' (extrapolated)' if break_even['extrapolated'] else ''
+        print(f'\t{break_even["entity"]} {break_even["function"]}: {above} '
+              f'beats {below} above {break_even["size"]:.0f} bytes{extrapolated}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit the cost of the '
+                                     'profiled functions against the payload '
+                                     'size')
+    parser.add_argument('store', type=str, help='store path')
+    parser.add_argument('--campaign', type=str, default=None,
+                        help='campaign to fit (default: every campaign)')
+    parser.add_argument('--entity', type=str, default=None,
+                        choices=('client', 'server'),
+                        help='entity to fit (default: both)')
+    parser.add_argument('--metric', type=str, default=DEFAULT_FIT_METRIC,
+                        help=f'metric to fit (default: {DEFAULT_FIT_METRIC})')
+    parser.add_argument('-f', '--functions', nargs='+', default=None,
+                        help='functions to fit (default: all)')
+    parser.add_argument('--json', type=str, default=None,
+                        help='also save the report to this JSON file')
+
+    args = parser.parse_args()
+    store = ResultsStore(args.store)
+    campaigns = ([args.campaign] if args.campaign else
+                 sorted({key.campaign for key in store.keys()}))
+
+    reports = {}
+    for campaign in campaigns:
+        print_green(f'Campaign: {campaign}')
+        fits = fit_campaign(store, campaign, args.metric, args.entity,
+                            args.functions)
+        break_evens = find_break_even_sizes(fits)
+        print_scaling_report(fits, break_evens, args.metric)
+        reports[campaign] = scaling_report(fits, break_evens, args.metric)
+
+    if args.json:
+        save_scaling_report(reports, args.json)
@@ -0,0 +1,254 @@
+"""Per-record time series of the data transfers.
+
+The records of each run (see papiprof.records) are saved to the RECORDS_DIR
+results store of the output directory (see papiprof.store), with a series per
+function and metric, plus RECORD_BYTES_METRIC (the bytes of each record) and
+RECORD_RUN_METRIC (the index of the run of each record). All of the series of
+a function have a value per record, NaN if the metric wasn't measured in its
+run.
+
+The records are summarized per ciphersuite, payload sizes and function: the
+cost of each record (e.g. its cycles), and the throughput and latency
+computed from the time metric (realtime by default). PAPI reports the time
+in microseconds, so bytes per microsecond are MB/s. The throughput of the
+first records of each run (the ramp-up) is given apart, and the records that
+take over STALL_FACTOR times the median latency are counted as stalls.
+
+Usage:
+    python -m papiprof.timeseries <results_dir> [-c|-s] [--metric virtcyc]
+                                  [--time-metric realtime] [--json report.json]
+"""
+import math
+import json
+import argparse
+from array import array
+from collections import defaultdict
+from os.path import isdir, join
+
+from utils.colors import print_green, print_yellow
+from papiprof.ciphersuites import CipherSuiteRegistry
+from papiprof.metrics import METRIC_VIRTCYC, METRIC_REALTIME, format_metric_value
+from papiprof.stats import percentile, DEFAULT_PERCENTILES
+from papiprof.store import ResultsStore, StoreKey
+
+RECORDS_DIR = 'papi.records'
+RECORD_BYTES_METRIC = 'bytes'
+RECORD_RUN_METRIC = 'run'
+
+DEFAULT_TIME_METRIC = METRIC_REALTIME
+DEFAULT_COST_METRIC = METRIC_VIRTCYC
+# number of records at the start of each run that count as the ramp-up
+DEFAULT_RAMP_UP_RECORDS = 4
+# a record that takes this many times the median latency is a stall
+STALL_FACTOR = 4
+
+class RecordsWriter:
+    """
+    Appends the records of the runs to the records store at `path`, which is
+    only created once there are records. The series of a function that
+    weren't measured in a run (e.g. the events of another event group) are
+    padded with NaN, so that all of the series of a function stay aligned.
+    As in the results store of a campaign, the records are only written out
+    on flush().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.store = None
+        self.num_records = 0
+        # {(campaign, entity, ..., funcname): (number of records, {metric, ...})}
+        self._functions = {}
+
+    def append_run(self, campaign, entity, ciphersuite, bytes_sent, bytes_received,
+                   run_index, records):
+        """Buffers the records of a run, {funcname: RecordSeries}."""
+        if records and self.store is None:
+            self.store = ResultsStore(self.path, block_size=None)
+        for funcname, series in records.items():
+            group = (str(campaign), entity, str(ciphersuite), str(bytes_sent),
+                     str(bytes_received), funcname)
+            num_records, metrics = self._functions.get(group, (0, set()))
+            values = dict(series.values)
+            values[RECORD_RUN_METRIC] = array('d', [run_index]) * len(series)
+            values[RECORD_BYTES_METRIC] = series.bytes
+
+            for metric_name in values.keys() - metrics:
+                self.store.extend(StoreKey(*group, metric_name),
+                                  array('d', [math.nan]) * num_records)
+            for metric_name in metrics | values.keys():
+                self.store.extend(StoreKey(*group, metric_name),
+                                  values.get(metric_name,
+                                             array('d', [math.nan]) * len(series)))
+            self._functions[group] = (num_records + len(series),
+                                      metrics | values.keys())
+            self.num_records += len(series)
+
+    def flush(self):
+        if self.store is not None:
+            self.store.flush()
+
+def _percentiles(sorted_values, percentiles=DEFAULT_PERCENTILES):
+    return {f'p{p}': percentile(sorted_values, p) for p in percentiles}
+
+def _median(values):
+    return percentile(sorted(values), 50) if values else None
+
+def summarize_records(records, metric=DEFAULT_COST_METRIC,
+                      time_metric=DEFAULT_TIME_METRIC,
+                      ramp_up_records=DEFAULT_RAMP_UP_RECORDS):
+    """
+    Summarizes the records of a function, {metric: array('d', [...])} with the
+    RECORD_BYTES_METRIC and RECORD_RUN_METRIC series:
+        {
+            'num_records': 120, 'num_runs': 10,
+            'bytes': {'avg': 16384, ...},
+            'cost': {'metric': 'virtcyc', 'avg': 123, 'p50': 123, ..., 'per_byte': 1.2},
+            'throughput': {'p50': 120.5, ..., 'ramp_up_p50': 80.1},  # MB/s
+            'latency': {'metric': 'realtime', 'p50': 123, ..., 'max': 456,
+                        'num_stalls': 2},
+        }
+    The parts of the metrics that weren't measured are left out.
+    """
+    num_bytes = records[RECORD_BYTES_METRIC]
+    runs = records[RECORD_RUN_METRIC]
+    summary = {'num_records': len(num_bytes), 'num_runs': len(set(runs))}
+    if not num_bytes:
+        return summary
+    summary['bytes'] = {'avg': sum(num_bytes) / len(num_bytes),
+                        **_percentiles(sorted(num_bytes))}
+
+    # the records that measured the metric, as (bytes, cost)
+    costs = [(b, c) for b, c in zip(num_bytes, records.get(metric, ()))
+             if not math.isnan(c)]
+    if costs:
+        sorted_costs = sorted(c for _, c in costs)
+        total_bytes = sum(b for b, _ in costs)
+        summary['cost'] = {'metric': metric, 'avg': sum(sorted_costs) / len(costs),
+                           **_percentiles(sorted_costs),
+                           'per_byte': sum(sorted_costs) / total_bytes if total_bytes else None}
+
+    # the index of each record in its run
+    positions = array('l')
+    last_run, position = None, 0
+    for run in runs:
+        position = position + 1 if run == last_run else 0
+        last_run = run
+        positions.append(position)
+
+    # as (bytes, time, position)
+    times = [(b, t, i) for b, t, i in zip(num_bytes, records.get(time_metric, ()), positions)
+             if not math.isnan(t)]
+    if times:
+        sorted_times = sorted(t for _, t, _ in times)
+        median_time = percentile(sorted_times, 50)
+        summary['latency'] = {
+            'metric': time_metric, **_percentiles(sorted_times),
+            'max': sorted_times[-1],
+            'num_stalls': sum(1 for t in sorted_times
+                              if median_time and t > STALL_FACTOR * median_time),
+        }
+
+        throughputs = [b / t for b, t, _ in times if t > 0]
+        if throughputs:
+            summary['throughput'] = {
+                **_percentiles(sorted(throughputs), (10, 50, 90)),
+                'ramp_up_p50': _median([b / t for b, t, i in times
+                                        if t > 0 and i < ramp_up_records]),
+                'steady_p50': _median([b / t for b, t, i in times
+                                       if t > 0 and i >= ramp_up_records]),
+            }
+    return summary
+
+def load_record_summaries(store, entity=None, functions=None, **kwargs):
+    """
+    Summarizes the records of each ciphersuite, payload sizes and function of
+    the records `store`:
+        {(campaign, entity, ciphersuite, bytes_sent, bytes_received, funcname):
+            summary (see summarize_records())}
+    """
+    # {(..., funcname): {metric: array('d', [...])}}
+    grouped = defaultdict(dict)
+    for key, values in store.iter_series(entity=entity, function=functions):
+        grouped[key[:-1]][key.metric] = values
+    return {group: summarize_records(records, **kwargs)
+            for group, records in grouped.items()
+            if RECORD_BYTES_METRIC in records and RECORD_RUN_METRIC in records}
+
+def print_record_summaries(summaries, registry, indent='\t'):
+    def fmt(value):
+        return '-' if value is None else format_metric_value(value)
+
+    for (campaign, entity, cs_id, bytes_sent, bytes_received,
+         funcname), summary in sorted(
+             summaries.items(),
+             key=lambda item: (item[0][0], item[0][1], registry.sort_key(item[0][2]),
+                               int(item[0][3]), int(item[0][4]), item[0][5])):
+        print_green(f'{registry.name(cs_id)} {entity} {funcname} '
+                    f'({bytes_sent} B sent, {bytes_received} B received)')
+        print(f'{indent}Records: {summary["num_records"]} in {summary["num_runs"]} runs')
+        if 'bytes' not in summary:
+            continue
+        print(f'{indent}Record size: avg {fmt(summary["bytes"]["avg"])} B, '
+              f'p50 {fmt(summary["bytes"]["p50"])} B')
+        cost = summary.get('cost')
+        if cost:
+            print(f'{indent}{cost["metric"]} per record: avg {fmt(cost["avg"])}, '
+                  + ', '.join(f'p{p} {fmt(cost[f"p{p}"])}' for p in DEFAULT_PERCENTILES)
+                  + f', {fmt(cost["per_byte"])} per byte')
+        throughput = summary.get('throughput')
+        if throughput:
+            print(f'{indent}Throughput (MB/s): p10 {fmt(throughput["p10"])}, '
+                  f'p50 {fmt(throughput["p50"])}, p90 {fmt(throughput["p90"])}, '
+                  f'ramp-up p50 {fmt(throughput["ramp_up_p50"])}, '
+                  f'steady p50 {fmt(throughput["steady_p50"])}')
+        latency = summary.get('latency')
+        if latency:
+            print(f'{indent}Latency ({latency["metric"]}): '
+                  + ', '.join(f'p{p} {fmt(latency[f"p{p}"])}' for p in DEFAULT_PERCENTILES)
+                  + f', max {fmt(latency["max"])}, {latency["num_stalls"]} stalls '
+                  f'(over {STALL_FACTOR}x the median)')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-record cost, throughput '
+                                     'and latency of the data transfers')
+    parser.add_argument('results_dir', type=str, help='results directory')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-c', '--client', action='store_true', help='client records only')
+    group.add_argument('-s', '--server', action='store_true', help='server records only')
+    parser.add_argument('-f', '--functions', nargs='+', default=None,
+                        help='functions to summarize (default: all)')
+    parser.add_argument('--metric', type=str, default=DEFAULT_COST_METRIC,
+                        help=f'cost metric of the records (default: {DEFAULT_COST_METRIC})')
+    parser.add_argument('--time-metric', type=str, default=DEFAULT_TIME_METRIC,
+                        help='metric of the throughput and latency, in '
+                        f'microseconds (default: {DEFAULT_TIME_METRIC})')
+    parser.add_argument('--ramp-up', type=int, default=DEFAULT_RAMP_UP_RECORDS,
+                        help='records at the start of each run that count as the '
+                        f'ramp-up (default: {DEFAULT_RAMP_UP_RECORDS})')
+    parser.add_argument('--ciphers', type=str, default=None,
+                        help='ciphersuite list, to name the ciphersuites '
+                        '(default: ciphers_mbedtls.txt)')
+    parser.add_argument('--json', type=str, default=None,
+                        help='also save the summaries to this JSON file')
+
+    args = parser.parse_args()
+    records_path = join(args.results_dir, RECORDS_DIR)
+    if not isdir(records_path):
+        print_yellow(f'[!] No records in {args.results_dir}, profile with '
+                     '--snapshot-every to capture them')
+        raise SystemExit(1)
+
+    entity = 'client' if args.client else 'server' if args.server else None
+    summaries = load_record_summaries(ResultsStore(records_path), entity, args.functions,
+                                      metric=args.metric, time_metric=args.time_metric,
+                                      ramp_up_records=args.ramp_up)
+    if not summaries:
+        print_yellow(f'[!] No {f"{entity} " if entity else ""}records in '
+                     f'{args.results_dir}')
+    print_record_summaries(summaries, CipherSuiteRegistry.from_file(args.ciphers))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([dict(zip(('campaign', 'entity', 'ciphersuite', 'bytes_sent',
+                                 'bytes_received', 'function'), group), **summary)
+                       for group, summary in summaries.items()], f, indent=4)
@@ -0,0 +1,149 @@
+"""Timers of the profiler's own phases.
+
+To tell whether a campaign is bound by the binaries or by the profiler
+itself, the hot path of the runners times its phases:
+
+    spawn         starting a client or server (Popen(), the asyncio
+                  subprocess or a persistent worker)
+    server_wait   waiting for the server to be ready, per run
+    pair          from starting the client to both processes being done,
+                  per run (includes the spawn, communicate and parse of the
+                  client)
+    communicate   a process running and its output being drained, per
+                  process (the handshake and transfer happen in here)
+    parse         parsing the output of a process into metrics
+    journal       writing the runs and iterations to the campaign journal
+    store         appending the runs to the results store and flushing it
+    summarize     the statistics of the iterations (includes loading their
+                  samples back from the store, one series at a time)
+    json          writing the JSON summaries
+    environment   checking the environment after each iteration
+
+The timers are module-level, like the metric registry of papihelper, so that
+the runners don't have to pass them around:
+
+    with timing.phase(timing.PHASE_PARSE):
+        metrics = parse_output_into_metrics(output)
+
+    timing.add(timing.PHASE_SERVER_WAIT, wait_time)
+
+The phases of concurrent pairs overlap and some phases are nested in others
+(see above), so the phases don't add up to the wall time of the campaign.
+With the distributed runner, the phases of the workers are not seen by the
+coordinator, only server_wait and pair are.
+
+At the end of a campaign, the timings are printed and saved to TIMING_FILE:
+
+    {
+        'wall_time': 12.5,          # seconds, from the first run to the last
+        'num_runs': 100,            # runs measured in this session
+        'runs_per_minute': 480.0,
+        'runner': 'threads',
+        'num_pairs': 2,
+        'persistent': False,
+        'phases': {
+            <phase>: {'total': 1.2, 'count': 200, 'avg': 0.006,
+                      'share': 0.096},  # of the wall time
+        }
+    }
+"""
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+TIMING_FILE = 'papi.timing.json'
+
+PHASE_SPAWN = 'spawn'
+PHASE_SERVER_WAIT = 'server_wait'
+PHASE_PAIR = 'pair'
+PHASE_COMMUNICATE = 'communicate'
+PHASE_PARSE = 'parse'
+PHASE_JOURNAL = 'journal'
+PHASE_STORE = 'store'
+PHASE_SUMMARIZE = 'summarize'
+PHASE_JSON = 'json'
+PHASE_ENVIRONMENT = 'environment'
+# in the order they're reported in
+PHASES = (PHASE_SPAWN, PHASE_SERVER_WAIT, PHASE_PAIR, PHASE_COMMUNICATE,
+          PHASE_PARSE, PHASE_JOURNAL, PHASE_STORE, PHASE_SUMMARIZE, PHASE_JSON,
+          PHASE_ENVIRONMENT)
+
+class PhaseTimers:
+    """The total time and count of each phase. Safe to use from the threads
+    of the runners."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # {phase: [seconds, count]}
+            self.totals = {}
+            self.start_time = time.perf_counter()
+
+    def add(self, phase, seconds, count=1):
+        with self._lock:
+            total = self.totals.get(phase)
+            if total is None:
+                self.totals[phase] = [seconds, count]
+            else:
+                total[0] += seconds
+                total[1] += count
+
+    @contextmanager
+    def phase(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def report(self, num_runs, wall_time=None, **info):
+        """The timings as saved to TIMING_FILE. `info` is added as is, e.g.
+        the runner."""
+        wall_time = self.elapsed() if wall_time is None else wall_time
+        with self._lock:
+            totals = {phase: tuple(total) for phase, total in self.totals.items()}
+        order = {phase: i for i, phase in enumerate(PHASES)}
+
+        phases = {}
+        for phase in sorted(totals, key=lambda p: (order.get(p, len(PHASES)), p)):
+            seconds, count = totals[phase]
+            phases[phase] = {'total': seconds, 'count': count,
+                             'avg': seconds / count if count else None,
+                             'share': seconds / wall_time if wall_time else None}
+        return {
+            'wall_time': wall_time,
+            'num_runs': num_runs,
+            'runs_per_minute': 60 * num_runs / wall_time if wall_time else None,
+            **info,
+            'phases': phases,
+        }
+
+# the timers of the current campaign
+HARNESS_TIMERS = PhaseTimers()
+
+def phase(name):
+    return HARNESS_TIMERS.phase(name)
+
+def add(name, seconds, count=1):
+    HARNESS_TIMERS.add(name, seconds, count)
+
+def save_timing_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
+
+def print_timing_report(report, indent='\t'):
+    print(f'{indent}Wall time: {report["wall_time"]:.3f}s, {report["num_runs"]} runs, '
+          + (f'{report["runs_per_minute"]:.1f} runs per minute'
+             if report['runs_per_minute'] is not None else '- runs per minute'))
+    print(f'{indent}{"phase":<12} {"total":>11} {"share":>6} {"count":>8}   {"avg":>11}')
+    for phase, timing in report['phases'].items():
+        share = f'{timing["share"]:6.1%}' if timing['share'] is not None else '     -'
+        print(f'{indent}{phase:<12} {timing["total"]:10.3f}s {share} '
+              f'{timing["count"]:>8} x {1000 * (timing["avg"] or 0):9.3f}ms')
@@ -1,3 +1,4 @@
+import sys
 import time
 import argparse
 from pathlib import Path
@@ -10,108 +11,80 @@ import json
 from utils.colors import print_green, print_red, print_yellow
 import papiprof.papihelper as papihelper
 from papiprof.papihelper import (parse_ciphersuite_list_from_file, run_server, 
-                     run_client, save_papi_metrics_to_file)
-
-def cipher_id_to_name(id):
-    idtoname = {
-        '174': 'PSK',
-        '182': 'RSA-PSK',
-        '60': 'RSA',
-        '178': 'DHE-PSK',
-        '103': 'DHE-RSA',
-        '49189': 'ECDH-ECDSA',
-        '49187': 'ECDHE-ECDSA',
-        '49207': 'ECDHE-PSK',
-        '49191': 'ECDHE-RSA',
-        '49193': 'ECDH-RSA'
-    }
-    return idtoname[id]
-
-def collect_metrics(files):
-    res = defaultdict(dict)
-
-    jsons = []
-
-    for file in files:
-        with open(file, 'r') as f:
-            jsons.append(json.load(f))
-
-    for jmetric in jsons:
-        for metric_name, cipher_metric in jmetric.items():
-            metric_res = res[metric_name]
-            for cipher_id, measurments in cipher_metric.items():
-                cipher_id_name = cipher_id_to_name(cipher_id)
-                for measurment_name, value_dict in measurments.items():
-                    if measurment_name == 'num_runs':
-                        continue
-                    if cipher_id_name not in res[metric_name].keys():
-                        res[metric_name][cipher_id_name] = {}
-                    if measurment_name not in res[metric_name][cipher_id_name].keys():
-                        res[metric_name][cipher_id_name][measurment_name] = {}
-                    res[metric_name][cipher_id_name][measurment_name] = value_dict
-    return res
-
-def print_metrics(metrics, selected_metrics, is_print_list):
+                     run_client, save_papi_metrics_to_file, verbose_print)
+from papiprof.summarycache import SummaryCache
+from papiprof.ciphersuites import CipherSuiteRegistry, ATTRIBUTES
+from papiprof.metrics import DEFAULT_METRIC_REGISTRY, format_metric_value
+from papiprof.store import PAPI_OUT_FILE_PREFIX, STORE_DIR
+from papiprof.compare import (load_results_dir, compare_results, print_comparison,
+                              save_comparison, DEFAULT_THRESHOLD, DEFAULT_ALPHA,
+                              VERDICT_REGRESSION, environment_differences)
+from papiprof.stats import DEFAULT_CONFIDENCE, parse_confidence
+from papiprof.export import (export_results_dir, FORMATS, format_from_path,
+                             DEFAULT_BATCH_SIZE)
+
+DEFAULT_SORT_ATTRIBUTES = ('key_exchange', 'cipher', 'mac')
+
+def collect_metrics(summary_cache, entity, files, selected_metrics=None):
+    """
+    Merges the metrics of the cached `files` of `entity`:
+    {funcname: {cipherid: {measurment: values}}}. Only the functions in
+    `selected_metrics` are read, if any are given.
+    """
+    return summary_cache.merged_metrics(entity, files, selected_metrics)
+
+def print_groups(cipher_metric, registry, group_by):
+    """Prints the average, minimum and maximum of the ciphersuite averages of
+    each group of ciphersuites with the same `group_by` attribute."""
+    for value, cipher_ids in registry.group_ids(cipher_metric, group_by).items():
+        print_green(f'\t[{group_by}: {value}] {len(cipher_ids)} ciphersuites')
+        # {measurment_name: [avg, ...]}
+        avgs = defaultdict(list)
+        for cipher_id in cipher_ids:
+            for measurment_name, values in cipher_metric[cipher_id].items():
+                avgs[measurment_name].append(values['avg'])
+        for measurment_name, avg_list in avgs.items():
+            print('\t'*2 + measurment_name)
+            print('\t'*3 + f'AVG: {format_metric_value(mean(avg_list), 0)}')
+            print('\t'*3 + f'MIN: {format_metric_value(min(avg_list), 0)}')
+            print('\t'*3 + f'MAX: {format_metric_value(max(avg_list), 0)}')
+
+def print_metrics(metrics, selected_metrics, is_print_list, registry,
+                  sort_by=DEFAULT_SORT_ATTRIBUTES, group_by=None):
     #import pdb; pdb.set_trace()
     if selected_metrics:
         metrics = {name : metrics[name] for name in selected_metrics}
-    mes_virttime_avg = []
-    mes_cycles_avg = []
+    # {measurment_name: [avg, ...]}
+    mes_avg_lists = defaultdict(list)
     for metric_name, cipher_metric in metrics.items():
         print(metric_name)
-        ciphers_order_1 = [
-                            'PSK',
-                            'RSA-PSK',
-                            'RSA',
-                            'ECDH-RSA',
-                            'ECDH-ECDSA',
-                            'ECDHE-PSK',
-                            'ECDHE-RSA',
-                            'ECDHE-ECDSA',
-                            'DHE-PSK',
-                            'DHE-RSA',
-                          ]
-        ciphers_order_2 = [
-                              'PSK',
-                              'ECDHE-PSK',
-                              'DHE-PSK',
-                              'ECDH-RSA',
-                              'ECDHE-RSA',
-                              'DHE-RSA',
-                              'RSA',
-                              'RSA-PSK',
-                              'ECDH-ECDSA',
-                              'ECDHE-ECDSA'
-                              ]
-        cipher_names_order = ciphers_order_2
-
-        for cipher_name in cipher_names_order:
-            print('\t' + cipher_name)
-            measurments = cipher_metric[cipher_name]
+
+        for cipher_id in registry.sorted_ids(cipher_metric, sort_by):
+            print('\t' + registry.name(cipher_id))
+            measurments = cipher_metric[cipher_id]
 
             for measurment_name, values in measurments.items():
-                if measurment_name == 'virttime':
-                    mes_virttime_avg.append(values['avg'])
-                elif measurment_name == 'virtcyc':
-                    mes_cycles_avg.append(values['avg'])
+                mes_avg_lists[measurment_name].append(values['avg'])
 
-                avg_rnd = round(values['avg'])
-                stdev_rnd = round(values['stdev'])
+                avg_rnd = format_metric_value(values['avg'], 0)
+                stdev_rnd = format_metric_value(values['stdev'], 0)
                 print('\t'*2 + measurment_name)
                 print('\t'*3 + f'AVG: {avg_rnd}' )
                 print('\t'*3 + f'STD: {stdev_rnd}' )
+        if group_by:
+            print_groups(cipher_metric, registry, group_by)
         if is_print_list:
-            print_green('** Virtual Time Average List**')
-            for value in mes_virttime_avg:
-                print(round(value))
-            print('')
-            print_green('** Virtual Cycles Average List**')
-            for value in mes_cycles_avg:
-                print(round(value))
+            for measurment_name, avg_list in mes_avg_lists.items():
+                description = DEFAULT_METRIC_REGISTRY.describe(measurment_name)
+                print_green(f'** {description} Average List**')
+                for value in avg_list:
+                    print(format_metric_value(value, 0))
+                print('')
 
 
 def run(ciphers, path, is_client, is_server, chosen_measurments, 
-        is_print_list, is_verbose):
+        is_print_list, is_verbose, use_cache=True,
+        sort_by=DEFAULT_SORT_ATTRIBUTES, group_by=None):
     SERVER_CALLGRIND_OUT_FILE = '{}/server.papi.out.{}.{}.{}'
     CLIENT_CALLGRIND_OUT_FILE = '{}/client.papi.out.{}.{}.{}'
     PROFILE_RESULTS_SRV = {}
@@ -121,10 +94,24 @@ def run(ciphers, path, is_client, is_server, chosen_measurments,
     
     print_green(f'Parsing {entity} results...\n')
 
-    all_files = [join(path, f) for f in listdir(path) if isfile(join(path, f)) and f.startswith(entity)]
+    start_time = time.perf_counter()
+    all_files = sorted(f for f in listdir(path) if isfile(join(path, f)) and PAPI_OUT_FILE_PREFIX in f)
+    entity_files = [f for f in all_files if f.startswith(entity)]
+
+    # both entities are cached, so that the cache serves -c and -s alike
+    summary_cache = SummaryCache(path, use_cache)
+    summary_cache.update(all_files)
+    collected_metrics = collect_metrics(summary_cache, entity, entity_files,
+                                        chosen_measurments)
+    summary_cache.save()
+    verbose_print(f'Summary cache{"" if use_cache else " (disabled)"}: '
+                  f'{summary_cache.format_stats()}, loaded in '
+                  f'{1000 * (time.perf_counter() - start_time):.1f}ms',
+                  is_verbose)
 
-    collected_metrics = collect_metrics(all_files)
-    print_metrics(collected_metrics, chosen_measurments, is_print_list)
+    registry = CipherSuiteRegistry.from_file(ciphers)
+    print_metrics(collected_metrics, chosen_measurments, is_print_list,
+                  registry, sort_by, group_by)
 
     #import pdb; pdb.set_trace()
 
@@ -159,21 +146,199 @@ def run(ciphers, path, is_client, is_server, chosen_measurments,
     total_iterations = len(max_iter) * num_cipheruites
 """
     
+def run_compare(baseline_path, candidate_path, is_client, is_server,
+                chosen_functions, chosen_measurments, threshold, alpha,
+                confidence, ciphers_path, json_path, is_verbose):
+    """Compares two results directories. Returns the exit code: 1 if there
+    are regressions, 2 if there is nothing to compare, 0 otherwise."""
+    entities = [entity for entity, is_chosen in (('client', is_client),
+                                                 ('server', is_server))
+                if is_chosen] or ['client', 'server']
+    names = CipherSuiteRegistry.from_file(ciphers_path).names()
+
+    print_green(f'Baseline: {baseline_path}')
+    print_green(f'Candidate: {candidate_path}\n')
+
+    baseline = load_results_dir(baseline_path, entities, chosen_functions,
+                                chosen_measurments, is_verbose)
+    candidate = load_results_dir(candidate_path, entities, chosen_functions,
+                                 chosen_measurments, is_verbose)
+
+    only_baseline = len(baseline.keys() - candidate.keys())
+    only_candidate = len(candidate.keys() - baseline.keys())
+    if only_baseline or only_candidate:
+        print_yellow(f'\t[!] Not compared: {only_baseline} series only in the '
+                     f'baseline, {only_candidate} only in the candidate\n')
+
+    env_differences = environment_differences(baseline_path, candidate_path)
+    if env_differences:
+        print_yellow('\t[!] The results were measured in different environments:')
+        for difference in env_differences:
+            print_yellow(f'\t\t{difference}')
+        print('')
+
+    comparisons = compare_results(baseline, candidate, threshold, alpha, confidence)
+    if not comparisons:
+        print_red('[!] The directories have no series in common')
+        return 2
+
+    print_comparison(comparisons, names, is_verbose)
+    if json_path:
+        save_comparison(comparisons, json_path)
+        print(f'\tSaved the comparison to {json_path}')
+
+    if any(c['verdict'] == VERDICT_REGRESSION for c in comparisons.values()):
+        return 1
+    return 0
+
+def compare_main(argv):
+    parser = argparse.ArgumentParser(prog='printm.py compare', description=
+    'Compare two directories of PAPI profilings, e.g. of two mbedTLS builds. '
+    'Exits with 1 if there are regressions')
+
+    parser.add_argument('baseline', type=str, help='path to folder with the '
+                        'baseline JSON profilings')
+    parser.add_argument('candidate', type=str, help='path to folder with the '
+                        'candidate JSON profilings')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-c', '--client', default=False,
+                        action='store_true', help='compare client metrics only')
+    group.add_argument('-s', '--server', default=False, action='store_true',
+                        help='compare server metrics only')
+    parser.add_argument('-m', '--metrics', nargs='+', help='compare the '
+                       'selected function(s) only', default=[])
+    parser.add_argument('--measurements', nargs='+', default=[],
+                        help='compare the selected measurement(s) only, '
+                        'e.g. virtcyc (default: all)')
+    parser.add_argument('--threshold', type=float, default=100 * DEFAULT_THRESHOLD,
+                        help='smallest change, in percent, that counts as a '
+                        f'regression (default: {100 * DEFAULT_THRESHOLD:g})')
+    parser.add_argument('--alpha', type=float, default=DEFAULT_ALPHA,
+                        help='significance level of the tests, after the '
+                        f'Holm correction (default: {DEFAULT_ALPHA})')
+    parser.add_argument('--confidence', type=parse_confidence,
+                        default=DEFAULT_CONFIDENCE,
+                        help='confidence level of the intervals '
+                        f'(default: {DEFAULT_CONFIDENCE})')
+    parser.add_argument('--ciphers', type=str, default=None,
+                        help='file with the ciphersuite names, in the format '
+                        'of profile.py (default: the names of mbedTLS)')
+    parser.add_argument('--json', type=str, default=None,
+                        help='save the comparison to this JSON file')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        default=False, help='also show the unchanged series')
+
+    args = parser.parse_args(argv)
+    return run_compare(
+        args.baseline,
+        args.candidate,
+        args.client,
+        args.server,
+        args.metrics,
+        args.measurements,
+        args.threshold / 100,
+        args.alpha,
+        args.confidence,
+        args.ciphers,
+        args.json,
+        args.verbose
+        )
+
+def run_export(path, out_path, is_client, is_server, chosen_functions,
+               chosen_measurments, export_format, with_summaries, with_samples,
+               ciphers_path, batch_size, is_verbose):
+    entities = [entity for entity, is_chosen in (('client', is_client),
+                                                 ('server', is_server))
+                if is_chosen] or ['client', 'server']
+    export_format = export_format or format_from_path(out_path)
+    registry = CipherSuiteRegistry.from_file(ciphers_path)
+
+    print_green(f'Exporting {path} to {out_path} ({export_format})...')
+    start_time = time.perf_counter()
+    try:
+        num_rows = export_results_dir(path, out_path, registry, export_format,
+                                      entities, chosen_functions, chosen_measurments,
+                                      with_summaries, with_samples, batch_size)
+    except ValueError as e:
+        print_red(f'[!] {e}')
+        return 2
+    print(f'\tSummary rows: {num_rows["summary"]}')
+    print(f'\tSample rows: {num_rows["sample"]}')
+    verbose_print(f'Exported in {time.perf_counter() - start_time:.2f}s', is_verbose)
+    return 0
+
+def export_main(argv):
+    parser = argparse.ArgumentParser(prog='printm.py export', description=
+    'Export the summaries and the raw samples of a folder of PAPI profilings '
+    'in a tidy long format, one value per row, see papiprof/export.py')
+
+    parser.add_argument('path', type=str, help='path to folder with JSON '
+                        'profilings')
+    parser.add_argument('out', type=str, help='file to export to')
+    parser.add_argument('-f', '--format', choices=FORMATS, default=None,
+                        help='format of the file, parquet and arrow need '
+                        'pyarrow (default: from the file extension, csv '
+                        'if unknown)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-c', '--client', default=False,
+                        action='store_true', help='export client metrics only')
+    group.add_argument('-s', '--server', default=False, action='store_true',
+                        help='export server metrics only')
+    parser.add_argument('-m', '--metrics', nargs='+', help='export the '
+                       'selected function(s) only', default=[])
+    parser.add_argument('--measurements', nargs='+', default=[],
+                        help='export the selected measurement(s) only, '
+                        'e.g. virtcyc (default: all)')
+    parser.add_argument('--no-summaries', action='store_true', default=False,
+                        help='do not export the summaries of the JSON files')
+    parser.add_argument('--no-samples', action='store_true', default=False,
+                        help=f'do not export the raw samples of <path>/{STORE_DIR}')
+    parser.add_argument('--ciphers', type=str, default=None,
+                        help='file with the ciphersuite names, in the format '
+                        'of profile.py (default: the names of mbedTLS)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='number of rows written to parquet and arrow '
+                        f'files at once (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        default=False, help='enable verbose output')
+
+    args = parser.parse_args(argv)
+    return run_export(
+        args.path,
+        args.out,
+        args.client,
+        args.server,
+        args.metrics,
+        args.measurements,
+        args.format,
+        not args.no_summaries,
+        not args.no_samples,
+        args.ciphers,
+        args.batch_size,
+        args.verbose
+        )
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        sys.exit(compare_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'export':
+        sys.exit(export_main(sys.argv[2:]))
 
     parser = argparse.ArgumentParser(description= 
     'Print stats for PAPI profilings outputs'
     'All the tool outputs JSON files wit the following naming:'
     '\t[client|server].papi.out.<ciphersuite_id>.<num_bytes_sent>.'
-    '<num_bytes_received>')
+    '<num_bytes_received>. '
+    'Use "printm.py compare <baseline> <candidate>" to compare two folders '
+    'and "printm.py export <path> <file>" to export one to CSV or Parquet')
 
     parser.add_argument('ciphers', type=str, help='file containing a '
                         'list of '
                         'ciphersuite ids and their respective names.'
                         'Each line of the file must have the format: '
                         '<ciphersuite_id> <ciphersuite_name> '
-                        '[arbitrary_info, ...]')
+                        '[arbitrary_info, ...]. Ciphersuites that are not in '
+                        'it get their mbedTLS name')
     parser.add_argument('path', type=str, help='path to folder with '
                                                'JSON profilings') 
 
@@ -187,8 +352,21 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--print', help='print metrics list at the '
                         'end. Useful for copy/paste to Excel',
                         default=False, action='store_true')
+    parser.add_argument('--sort-by', nargs='+', choices=ATTRIBUTES,
+                        default=list(DEFAULT_SORT_ATTRIBUTES),
+                        help='ciphersuite attributes to sort the ciphersuites '
+                        f'by (default: {" ".join(DEFAULT_SORT_ATTRIBUTES)})')
+    parser.add_argument('--group-by', choices=ATTRIBUTES, default=None,
+                        help='also print the average, minimum and maximum '
+                        'cost of the ciphersuites grouped by this attribute, '
+                        'e.g. kx for the key exchange algorithm')
+    parser.add_argument('--no-cache', action='store_true', default=False,
+                        help='read all of the JSON files again instead of '
+                        'using the summary cache of the folder, and leave '
+                        'the cache as it is')
     parser.add_argument('-v', '--verbose', action='store_true', 
-                        default=False, help='enable verbose output')
+                        default=False, help='enable verbose output and the '
+                        'summary cache statistics')
 
     args = parser.parse_args()
     run(
@@ -198,5 +376,8 @@ if __name__ == '__main__':
         args.server,
         args.metrics,
         args.print,
-        args.verbose
+        args.verbose,
+        not args.no_cache,
+        args.sort_by,
+        args.group_by
         )
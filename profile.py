@@ -1,13 +1,65 @@
+import os
+import math
 import time
+import queue
 import argparse
+import threading
 from pathlib import Path
-from statistics import mean, stdev
-from collections import defaultdict
+from functools import partial
+from collections import namedtuple
 from multiprocessing.pool import ThreadPool
 from utils.colors import print_green, print_red, print_yellow
 import papiprof.papihelper as papihelper
 from papiprof.papihelper import (parse_ciphersuite_list_from_file, run_server, 
-                     run_client, save_papi_metrics_to_file)
+                     run_client, save_papi_metrics_to_file,
+                     wait_for_server_ready, DEFAULT_SERVER_PORT,
+                     NUM_RUNS_KEY, SAMPLING_KEY, NON_METRIC_KEYS,
+                     set_metric_registry)
+from papiprof.metrics import (MetricRegistry, DEFAULT_METRIC_REGISTRY,
+                              format_metric_value)
+from papiprof.scheduler import (build_pair_slots, get_available_cpus,
+                                CampaignProgress, ProfilingJob)
+from papiprof.stats import (RunningStats, summarize, summarize_running_stats,
+                            filter_samples, DEFAULT_CONFIDENCE, SampleFilter,
+                            NO_SAMPLE_FILTER,
+                            OUTLIER_METHODS, OUTLIERS_NONE, parse_confidence)
+from papiprof.store import (ResultsStore, STORE_DIR, STORE_REF_FILE,
+                            write_store_ref)
+from papiprof.records import SNAPSHOT_BYTES_ENV_VAR
+from papiprof.timeseries import RecordsWriter, RECORDS_DIR
+from papiprof.journal import (CampaignJournal, JournalMismatchError,
+                              JOURNAL_FILE, iteration_key)
+from papiprof.persistent import (PersistentWorker, WorkerDiedError,
+                                 WORKER_DIED_RETURN_CODE)
+from papiprof.sweep import (parse_size_grid, fit_campaign, find_break_even_sizes,
+                            print_scaling_report, scaling_report,
+                            save_scaling_report, DEFAULT_FIT_METRIC, SCALING_FILE)
+from papiprof.distributed import (DistributedRunner, DEFAULT_COORDINATOR_PORT,
+                                  HOSTS_FILE, parse_address)
+from papiprof.aiorunner import (AsyncPairRunner, DEFAULT_PROCESS_TIMEOUT,
+                                TIMEOUT_RETURN_CODE)
+from papiprof.environment import (EnvironmentMonitor, EnvironmentDriftError,
+                                  ENVIRONMENT_FILE)
+from papiprof import timing
+from papiprof.timing import (HARNESS_TIMERS, TIMING_FILE, print_timing_report,
+                             save_timing_report)
+
+DEFAULT_ADAPTIVE_METRIC = 'handshake:virtcyc'
+STOP_TARGET_REACHED = 'target_rel_ci'
+STOP_MAX_RUNS = 'max_runs'
+# with outlier rejection, the adaptive sampling checks the relative CIs every
+# this many runs
+ADAPTIVE_FILTER_EVERY = 10
+
+RUNNER_THREADS = 'threads'
+RUNNER_ASYNCIO = 'asyncio'
+RUNNER_DISTRIBUTED = 'distributed'
+# full: all of the statistics of papiprof.stats.summarize(), from the samples
+# basic: count, mean, stdev, min, max and the normal CI, from the running
+# stats of the store, without loading the samples
+SUMMARY_FULL = 'full'
+SUMMARY_BASIC = 'basic'
+SUMMARY_MODES = (SUMMARY_FULL, SUMMARY_BASIC)
 
 def get_next_or_default(iterator, default):
     try:
@@ -15,6 +67,160 @@ def get_next_or_default(iterator, default):
     except StopIteration:
         return default
 
+def pair_bytes_to_send(cli_bytes_to_send_list, srv_bytes_to_send_list, default):
+    """
+    Yields the (client bytes, server bytes) to send in each iteration. The
+    shorter list is padded with `default`.
+    """
+    max_iter = max(srv_bytes_to_send_list, cli_bytes_to_send_list, key=len)
+    srv_bytes_to_send_iter = iter(srv_bytes_to_send_list)
+    cli_bytes_to_send_iter = iter(cli_bytes_to_send_list)
+
+    for _ in max_iter:
+        cli_bytes_to_send = get_next_or_default(cli_bytes_to_send_iter, default)
+        srv_bytes_to_send = get_next_or_default(srv_bytes_to_send_iter, default)
+        yield cli_bytes_to_send, srv_bytes_to_send
+
+def profile_pair(job, client_path, server_path, slots, server_pool,
+                 is_verbose=False, ready_marker=None, probe_port=True,
+                 max_wait=1, should_skip=None):
+    """
+    Runs a client/server pair for `job` on the first free slot of the `slots`
+    queue. The server runs in `server_pool`, while the client runs in the
+    calling thread. Returns None without running anything if
+    `should_skip(job)` is true.
+
+    Returns:
+        {
+            'slot': PairSlot(...),
+            'srv_ret': 0,
+            'cli_ret': 0,
+            'srv_prof': {<funcname>: {<metric>: 123}},
+            'cli_prof': {<funcname>: {<metric>: 123}},
+            'is_ready': True,
+            'wait_time': 0.01,
+            'measure_time': 0.5,
+        }
+    """
+    if should_skip and should_skip(job):
+        return None
+
+    slot = slots.get()
+    try:
+        server_started = threading.Event()
+
+        wait_start = time.monotonic()
+        async_result_srv = server_pool.apply_async(run_server,
+                                                   (server_path,
+                                                    job.sc_id,
+                                                    is_verbose,
+                                                    job.srv_bytes_to_send,
+                                                    server_started,
+                                                    ready_marker,
+                                                    slot.port,
+                                                    slot.server_cpus,
+                                                    job.events
+                                                    )
+                                                   )
+
+        ready_port = slot.port if probe_port else None
+        is_ready = wait_for_server_ready(server_started, ready_port, max_wait,
+                                         has_ready_marker=ready_marker is not None)
+        measure_start = time.monotonic()
+
+        cli_ret, cli_prof = run_client(client_path, job.sc_id, is_verbose,
+                                       job.cli_bytes_to_send, slot.port,
+                                       slot.client_cpus, job.events)
+        srv_ret, srv_prof = async_result_srv.get()
+        measure_end = time.monotonic()
+    finally:
+        slots.put(slot)
+
+    return {
+        'slot': slot,
+        'srv_ret': srv_ret,
+        'cli_ret': cli_ret,
+        'srv_prof': srv_prof,
+        'cli_prof': cli_prof,
+        'is_ready': is_ready,
+        'wait_time': measure_start - wait_start,
+        'measure_time': measure_end - measure_start,
+    }
+
+def create_persistent_workers(pair_slots, client_path, server_path,
+                               is_verbose=False):
+    """
+    Returns {slot index: (client worker, server worker)}. The workers are
+    started by the first run of their slot.
+    """
+    return {slot.index: (PersistentWorker(client_path, slot.port,
+                                          slot.client_cpus, is_verbose),
+                         PersistentWorker(server_path, slot.port,
+                                          slot.server_cpus, is_verbose))
+            for slot in pair_slots}
+
+def stop_persistent_workers(workers):
+    for client_worker, server_worker in workers.values():
+        client_worker.stop()
+        server_worker.stop()
+
+def profile_persistent_pair(job, slots, workers, max_wait=1, should_skip=None,
+                            timeout=DEFAULT_PROCESS_TIMEOUT):
+    """
+    Like profile_pair(), but runs the job on the resident client/server
+    `workers` of the first free slot instead of starting new processes. The
+    workers are killed if the run isn't done after `timeout` seconds.
+    """
+    if should_skip and should_skip(job):
+        return None
+
+    slot = slots.get()
+    try:
+        client_worker, server_worker = workers[slot.index]
+        run_id = (f'{job.sc_id}.{job.cli_bytes_to_send}.'
+                  f'{job.srv_bytes_to_send}.{job.run_index}')
+
+        wait_start = time.monotonic()
+        try:
+            server_worker.ensure_started()
+            client_worker.ensure_started()
+            server_worker.send_run(run_id, job.sc_id, job.srv_bytes_to_send,
+                                   job.events)
+            is_ready = server_worker.wait_until_ready_for(run_id, max_wait)
+            measure_start = time.monotonic()
+            client_worker.send_run(run_id, job.sc_id, job.cli_bytes_to_send,
+                                   job.events)
+        except WorkerDiedError as e:
+            print_red(f'\t\t[!!!] {e}')
+            # the other one may be in the middle of the run
+            server_worker.stop(kill=True)
+            client_worker.stop(kill=True)
+            return {'slot': slot, 'srv_ret': WORKER_DIED_RETURN_CODE,
+                    'cli_ret': WORKER_DIED_RETURN_CODE, 'srv_prof': {},
+                    'cli_prof': {}, 'is_ready': False,
+                    'wait_time': time.monotonic() - wait_start,
+                    'measure_time': 0}
+
+        # the client and the server share the timeout, as they run together
+        deadline = measure_start + timeout
+        cli_ret, cli_prof = client_worker.collect_run(run_id, timeout)
+        srv_ret, srv_prof = server_worker.collect_run(
+            run_id, max(deadline - time.monotonic(), 0))
+        measure_end = time.monotonic()
+    finally:
+        slots.put(slot)
+
+    return {
+        'slot': slot,
+        'srv_ret': srv_ret,
+        'cli_ret': cli_ret,
+        'srv_prof': srv_prof,
+        'cli_prof': cli_prof,
+        'is_ready': is_ready,
+        'wait_time': measure_start - wait_start,
+        'measure_time': measure_end - measure_start,
+    }
+
 def build_key(sc_id, name, flags):
     flag_to_use = ''
     if flags.lower() != 'none':
@@ -28,69 +234,200 @@ def create_output_directory_if_needed(out_dir):
         print(f'\t[!] Creating {out_dir} since it did not exit.\n')
         p.mkdir(parents=True)
 
-def init_funcname_dict_if_needed(all_profs, funcname, sc_id):
-    funcname_dict = all_profs[funcname]
+def parse_adaptive_metric(adaptive_metric):
+    """Splits '<funcname>:<metric>' into (funcname, metric)."""
+    funcname, sep, metric_name = adaptive_metric.rpartition(':')
+    if not sep or not funcname or not metric_name:
+        raise ValueError(f'Invalid adaptive metric "{adaptive_metric}", '
+                         'expected <funcname>:<metric>')
+    return funcname, metric_name
 
-    if sc_id not in funcname_dict:
-        funcname_dict[sc_id] = {}
-        funcname_dict[sc_id]['num_runs'] = 0
-        for metric_id in papihelper.ALL_METRICS:
-            funcname_dict[sc_id][metric_id] = []
-    
-def append_profiling_results(all_profs, indiv_profs, sc_id):
+"""
+The values of the adaptive sampling metric of an iteration, per entity:
+    values  {'client': [123, ...], 'server': [...]}, for the outlier rejection
+    stats   {'client': RunningStats(...), ...} of the values after the warm-up
+"""
+AdaptiveSamples = namedtuple('AdaptiveSamples', ['values', 'stats'])
+
+def append_adaptive_samples(adaptive_samples, profs_by_entity, funcname,
+                            metric_name, sample_filter=NO_SAMPLE_FILTER):
+    """Appends the values of the adaptive sampling metric of a run to
+    adaptive_samples."""
+    for entity, profs in profs_by_entity.items():
+        value = profs.get(funcname, {}).get(metric_name)
+        if value is None:
+            continue
+        values = adaptive_samples.values.setdefault(entity, [])
+        values.append(value)
+        if len(values) > sample_filter.warmup:
+            adaptive_samples.stats.setdefault(entity, RunningStats()).add(value)
+
+def is_sampling_check_due(num_successful_runs, sample_filter):
+    """Whether the relative CIs are checked after this run. The outliers are
+    only rejected every ADAPTIVE_FILTER_EVERY runs, since the values are
+    filtered again from scratch."""
+    return (sample_filter.outliers == OUTLIERS_NONE or
+            num_successful_runs % ADAPTIVE_FILTER_EVERY == 0)
+
+def get_sampling_relative_cis(adaptive_samples, confidence,
+                              sample_filter=NO_SAMPLE_FILTER):
     """
-    indiv_profs structure:
-        {
-            'func_name': {
-                'virttime: 123,
-            }
-        }
+    Returns the relative confidence interval (see RunningStats.relative_ci())
+    of the filtered samples of each entity that reported the metric:
+        {'client': 0.01, 'server': 0.02}
+    Without outlier rejection, these come from the running stats in O(1).
     """
-    for funcname, metrics in indiv_profs.items():
-        init_funcname_dict_if_needed(all_profs, funcname, sc_id)
+    if sample_filter.outliers == OUTLIERS_NONE:
+        return {entity: adaptive_samples.stats[entity].relative_ci(confidence)
+                if entity in adaptive_samples.stats else math.inf
+                for entity in adaptive_samples.values}
+
+    rel_cis = {}
+    for entity, values in adaptive_samples.values.items():
+        metric_stats = RunningStats()
+        for value in filter_samples(values, sample_filter)[0]:
+            metric_stats.add(value)
+        rel_cis[entity] = metric_stats.relative_ci(confidence)
+    return rel_cis
 
-        all_profs[funcname][sc_id]['num_runs'] += 1
-        for metric_id in papihelper.ALL_METRICS:
-            all_profs[funcname][sc_id][metric_id].append(metrics[metric_id])
+def is_sampling_target_reached(rel_cis, num_successful_runs, target_rel_ci,
+                               min_runs):
+    return (num_successful_runs >= min_runs and bool(rel_cis) and
+            all(rel_ci <= target_rel_ci for rel_ci in rel_cis.values()))
 
-def print_max_min_for_entity(prof_res, cs_id, entity, indent='\t'*3):
+def print_summary_for_entity(prof_res_avg, cs_id, entity, indent='\t'*3):
     print_green(f'{indent}{entity}---')
+    fmt = format_metric_value
     
-    #import pdb; pdb.set_trace()
-    for func_name, values in prof_res.items():
+    for func_name, values in prof_res_avg.items():
         print_green(f'{indent}\t{func_name}:')
 
         cs_values = values[cs_id]
 
-        for metric_name, metric_values in cs_values.items():
-            if metric_name == 'num_runs':
-                print_green(f'{indent}\t\t Number of runs: {metric_values}')
+        for metric_name, summary in cs_values.items():
+            if metric_name == NUM_RUNS_KEY:
+                print_green(f'{indent}\t\t Number of runs: {summary}')
+                continue
+            if metric_name in NON_METRIC_KEYS:
                 continue
 
-            print_green(f'{indent}\t\t{metric_name} Min: {min(metric_values)}')
-            print_green(f'{indent}\t\t{metric_name} Max: {max(metric_values)}')
+            ci_low, ci_high = summary['ci']
+            if summary.get('num_runs', cs_values[NUM_RUNS_KEY]) != cs_values[NUM_RUNS_KEY]:
+                print_green(f'{indent}\t\t{metric_name} Measured in: '
+                            f'{summary["num_runs"]} runs')
+            print_green(f'{indent}\t\t{metric_name} Min: {summary["min"]}')
+            print_green(f'{indent}\t\t{metric_name} Max: {summary["max"]}')
+            print_green(f'{indent}\t\t{metric_name} Avg: {fmt(summary["avg"])} '
+                        f'(stdev {fmt(summary["stdev"])}, '
+                        f'CI {fmt(ci_low)}..{fmt(ci_high)})')
+            if 'median' in summary:
+                print_green(f'{indent}\t\t{metric_name} Median: {fmt(summary["median"])} '
+                            f'(MAD {fmt(summary["mad"])}, p90 {fmt(summary["p90"])}, '
+                            f'p99 {fmt(summary["p99"])})')
+            if 'trimmed_avg' in summary:
+                print_green(f'{indent}\t\t{metric_name} Trimmed Avg: '
+                            f'{fmt(summary["trimmed_avg"])}')
+            if 'rejected' in summary:
+                rejected = summary['rejected']
+                print_green(f'{indent}\t\t{metric_name} Rejected: '
+                            f'{rejected["warmup"]} warm-up, '
+                            f'{rejected["outliers"]} outliers '
+                            f'of {summary["num_runs"]} runs')
     print_green('')
 
-def avg_profiling_results(prof_res, is_verbose=False):
-    result = {}
-    for func_name, cs_ids in prof_res.items():
-        result[func_name] = {}
-        for cs_id, metrics in cs_ids.items():
-            result[func_name][cs_id] = {}
-            for metric_name, metric_values in metrics.items():
-                if metric_name == 'num_runs':
-                    result[func_name][cs_id][metric_name] = metric_values
-                    continue
-                result[func_name][cs_id][metric_name] = {
-                    'avg': mean(metric_values),
-                    'stdev': stdev(metric_values)
+def iter_profiling_samples(store, campaign, entity, sc_id, bytes_sent,
+                           bytes_received):
+    """
+    Yields (func_name, metric_name, array('d', [123, ...])) for the raw
+    samples of each series of a configuration in the results store, one
+    series at a time.
+    """
+    for key, values in store.iter_series(campaign=campaign, entity=entity,
+                                         ciphersuite=sc_id, bytes_sent=bytes_sent,
+                                         bytes_received=bytes_received):
+        yield key.function, key.metric, values
+
+def avg_profiling_results(prof_samples, sc_id, is_verbose=False,
+                          sample_filter=NO_SAMPLE_FILTER, **stats_options):
+    """
+    Summarizes the raw samples of a configuration (see
+    iter_profiling_samples()) with papiprof.stats.summarize(), after
+    filtering them with `sample_filter` (a papiprof.stats.SampleFilter):
+        {
+            'func_name': {
+                <cipherid>: {
+                    'num_runs': 123,
+                    'virttime': {
+                        'avg': 123, 'stdev': 12, ...,
+                        # only when filtering
+                        'rejected': {'warmup': 2, 'outliers': 1},
+                    }
                 }
+            }
+        }
+
+    The series are summarized one at a time, so only the samples of one of
+    them need to be in memory. The number of runs includes the rejected
+    samples.
+    """
+    is_filtering = sample_filter != NO_SAMPLE_FILTER
+    result = {}
+    for func_name, metric_name, values in prof_samples:
+        # with event groups, not every run measures every metric
+        num_runs = len(values)
+        if not num_runs:
+            continue
+        if is_filtering:
+            values, rejected = filter_samples(values, sample_filter)
+        summary = summarize(values, trim=sample_filter.trim, **stats_options)
+
+        cs_result = result.setdefault(func_name, {}).setdefault(sc_id, {})
+        summary['num_runs'] = num_runs
+        if is_filtering:
+            summary['rejected'] = rejected
+        cs_result['num_runs'] = max(cs_result.get('num_runs', 0), num_runs)
+        cs_result[metric_name] = summary
+    return result
+
+def running_profiling_results(store, campaign, entity, sc_id, bytes_sent,
+                              bytes_received, confidence=DEFAULT_CONFIDENCE):
+    """
+    Summarizes a configuration like avg_profiling_results(), but only with
+    the statistics of papiprof.stats.summarize_running_stats(), from the
+    running stats of the results store. The samples aren't loaded.
+    """
+    result = {}
+    for key, stats in store.running_stats(campaign=campaign, entity=entity,
+                                          ciphersuite=sc_id, bytes_sent=bytes_sent,
+                                          bytes_received=bytes_received).items():
+        if not stats.count:
+            continue
+        summary = summarize_running_stats(stats, confidence)
+        summary['num_runs'] = stats.count
+        cs_result = result.setdefault(key.function, {}).setdefault(sc_id, {})
+        cs_result['num_runs'] = max(cs_result.get('num_runs', 0), stats.count)
+        cs_result[key.metric] = summary
     return result
 
+def print_environment_drift(changes):
+    print_yellow('\t[!] The environment changed since the campaign started:')
+    for change in changes:
+        print_yellow(f'\t\t{change}')
+
 def run(client_path, server_path, num_runs, ciphers_path, 
         cli_bytes_start, cli_bytes_end, cli_bytes_step, 
         srv_bytes_start, srv_bytes_end, srv_bytes_step,
-        out_path, is_verbose):
+        out_path, is_verbose, ready_marker=None, port=DEFAULT_SERVER_PORT,
+        max_wait=1, num_pairs=1, cpus_per_pair=2, pin_cpus=True,
+        campaign=None, save_json=True, confidence=DEFAULT_CONFIDENCE,
+        num_resamples=0, resume=False, target_rel_ci=None, min_runs=10,
+        max_runs=None, adaptive_metric=DEFAULT_ADAPTIVE_METRIC,
+        persistent=False, runner=RUNNER_THREADS,
+        process_timeout=DEFAULT_PROCESS_TIMEOUT, metric_registry=None,
+        cli_sizes=None, srv_sizes=None, fit_metric=DEFAULT_FIT_METRIC,
+        strict_env=False, sample_filter=NO_SAMPLE_FILTER,
+        listen=('127.0.0.1', DEFAULT_COORDINATOR_PORT), snapshot_every=None,
+        store_path=None, append=False, overwrite=False, summary_mode=SUMMARY_FULL):
     SERVER_CALLGRIND_OUT_FILE = '{}/server.papi.out.{}.{}.{}'
     CLIENT_CALLGRIND_OUT_FILE = '{}/client.papi.out.{}.{}.{}'
     PROFILE_RESULTS_SRV = {}
@@ -98,52 +435,163 @@ def run(client_path, server_path, num_runs, ciphers_path,
 
     DEFAULT_BYTES_TO_SEND = 0
 
-    timeout = 1
+    if target_rel_ci:
+        # in adaptive mode, the number of runs is the maximum
+        num_runs = max_runs or num_runs
+        min_runs = min(min_runs, num_runs)
+        adaptive_funcname, adaptive_metric_name = parse_adaptive_metric(adaptive_metric)
+
+    metric_registry = metric_registry or DEFAULT_METRIC_REGISTRY
+    set_metric_registry(metric_registry)
+
+    if resume + append + overwrite > 1:
+        raise ValueError('Only one of resume, append and overwrite can be '
+                         'given.')
+
+    if persistent and runner != RUNNER_THREADS:
+        raise ValueError('The persistent client/server mode can only be used '
+                         f'with the {RUNNER_THREADS} runner.')
+
+    if summary_mode == SUMMARY_BASIC and (sample_filter != NO_SAMPLE_FILTER or
+                                          num_resamples):
+        raise ValueError(f'The {SUMMARY_BASIC} summaries don\'t load the samples, '
+                         'so they can\'t filter them or bootstrap the confidence '
+                         'intervals.')
+
+    if sample_filter.warmup < 0 or not 0 <= sample_filter.trim < 0.5:
+        raise ValueError('The warm-up runs must be at least 0 and the trimmed '
+                         'proportion between 0 and 0.5')
+
+    if num_pairs > 1 and not port:
+        raise ValueError('Running several pairs at once needs a port for each '
+                         'of them. Set a non-zero base port.')
+
+    # port 0 disables port probing
+    pair_slots = build_pair_slots(num_pairs, port, cpus_per_pair, pin_cpus)
 
     print('Running with configurations: ')
     print(f'\tClient Path: {client_path}')
     print(f'\tSever Path: {server_path}')
     print(f'\tCiphesuite List Path: {ciphers_path}')
-    print(f'\tclient bytes to send start, end, step: '
-          f'{cli_bytes_start} {cli_bytes_end} {cli_bytes_step}')
-    print(f'\tserver bytes to send start, end, step: '
-          f'{srv_bytes_start} {srv_bytes_end} {srv_bytes_step}')
+    if cli_sizes is not None:
+        print(f'\tclient bytes to send: {", ".join(map(str, cli_sizes))}')
+    else:
+        print(f'\tclient bytes to send start, end, step: '
+              f'{cli_bytes_start} {cli_bytes_end} {cli_bytes_step}')
+    if srv_sizes is not None:
+        print(f'\tserver bytes to send: {", ".join(map(str, srv_sizes))}')
+    else:
+        print(f'\tserver bytes to send start, end, step: '
+              f'{srv_bytes_start} {srv_bytes_end} {srv_bytes_step}')
+    campaign = campaign or Path(out_path).resolve().name
+    # several campaigns can share a store, e.g. the cells of a matrix
+    store_path = Path(store_path) if store_path else Path(out_path) / STORE_DIR
+
     print(f'\tOutput directory: {out_path}')
-    print(f'\tTimeout: {timeout}')
+    print(f'\tResults store: {store_path} (campaign: {campaign})')
+    print(f'\tSave JSON summaries: {save_json}')
+    print(f'\tResume: {resume}'
+          + (' (appending to the earlier samples)' if append else '')
+          + (' (overwriting the earlier samples)' if overwrite else ''))
+    if target_rel_ci:
+        print(f'\tAdaptive sampling: until the CI of {adaptive_metric} is '
+              f'within ±{target_rel_ci:.2%} of the mean, '
+              f'{min_runs}..{num_runs} runs')
+    if sample_filter != NO_SAMPLE_FILTER:
+        threshold = (f', threshold {sample_filter.threshold}'
+                     if sample_filter.threshold is not None else '')
+        print(f'\tSample filter: {sample_filter.warmup} warm-up runs, '
+              f'{sample_filter.outliers} outlier rejection{threshold}, '
+              f'{sample_filter.trim:.0%} trimmed mean')
+    print(f'\tConfidence level: {confidence} '
+          f'({f"{num_resamples} bootstrap resamples" if num_resamples else "normal approximation"})')
+    print(f'\tSummaries: {summary_mode}')
+    print(f'\tServer ready marker: {ready_marker}')
+    print(f'\tMax wait for server: {max_wait}')
+    print(f'\tPersistent client/server: {persistent}')
+    print(f'\tRunner: {runner}'
+          + (f' (process timeout: {process_timeout}s)'
+             if runner == RUNNER_ASYNCIO or persistent else '')
+          + (f' (listening on {listen[0]}:{listen[1]})' if runner == RUNNER_DISTRIBUTED else ''))
+    if runner == RUNNER_DISTRIBUTED:
+        print('\tClient/server pairs: run by the workers')
+    else:
+        print(f'\tClient/server pairs: {num_pairs}')
+        for slot in pair_slots:
+            print(f'\t\tPair {slot.index}: port {slot.port}, '
+                  f'server CPUs {slot.server_cpus}, client CPUs {slot.client_cpus}')
+    if metric_registry.events:
+        print(f'\tPAPI events: {", ".join(metric_registry.events)}')
+    for i, group in enumerate(metric_registry.groups or ()):
+        print(f'\t\tEvent group {i} (runs {i}, {i + len(metric_registry.groups)}, ...): '
+              f'{", ".join(group)}')
+    print(f'\tStop on environment drift: {strict_env}')
+    print(f'\tRecord snapshots: '
+          + ('off' if snapshot_every is None else
+             'every record' if snapshot_every == 0 else f'every {snapshot_every} bytes'))
     print(f'\tVerbose: {is_verbose}')
 
     print('\n')
 
     create_output_directory_if_needed(out_path)
+    # the samples are only written at the end of each iteration, which is
+    # what the journal relies on to resume the campaign
+    store = ResultsStore(store_path, block_size=None)
+    # lets printm.py compare and export find the samples of the campaign
+    store_ref_path = Path(out_path) / STORE_REF_FILE
+    if (store_path.resolve() != (Path(out_path) / STORE_DIR).resolve()
+            or campaign != Path(out_path).resolve().name):
+        write_store_ref(out_path, store_path, campaign)
+    elif store_ref_path.exists():
+        store_ref_path.unlink()
+    records_writer = RecordsWriter(Path(out_path) / RECORDS_DIR)
+    if snapshot_every is not None:
+        # inherited by the binaries, and passed on to the distributed workers
+        os.environ[SNAPSHOT_BYTES_ENV_VAR] = str(snapshot_every)
+    stats_options = {'confidence': confidence, 'num_resamples': num_resamples,
+                     'sample_filter': sample_filter}
 
     print('Parsing ciphersuties...',end='')
     ciphersuites = parse_ciphersuite_list_from_file(ciphers_path)
     num_cipheruites = len(ciphersuites)
     num_skipped_ciphersuites = 0
-    completed_iterations = 0
     num_sigttou = 0
+    num_server_wait_timeouts = 0
+    num_process_timeouts = 0
+    total_wait_time = 0
+    total_measure_time = 0
+    num_measured_runs = 0
     ciphersuite_names = []  # display names in graph
     print('ok')
 
-    if 0 in (srv_bytes_step, srv_bytes_end):
+    if srv_sizes is None and 0 in (srv_bytes_step, srv_bytes_end):
         print('\t[!] Setting server send bytes to zero')
         srv_bytes_start = 0
         srv_bytes_end = 1
         srv_bytes_step = 1
 
-    if 0 in (cli_bytes_step, cli_bytes_end):
+    if cli_sizes is None and 0 in (cli_bytes_step, cli_bytes_end):
         print('\t[!] Setting client send bytes to zero')
         cli_bytes_start = 0
         cli_bytes_end = 1
         cli_bytes_step = 1
 
-    srv_bytes_to_send_list = list(range(srv_bytes_start, srv_bytes_end, 
-                                        srv_bytes_step))
-    cli_bytes_to_send_list = list(range(cli_bytes_start, cli_bytes_end, 
-                                        cli_bytes_step))
+    # a size grid replaces the start, end, step range
+    if srv_sizes is not None:
+        srv_bytes_to_send_list = list(srv_sizes)
+    else:
+        srv_bytes_to_send_list = list(range(srv_bytes_start, srv_bytes_end, 
+                                            srv_bytes_step))
+    if cli_sizes is not None:
+        cli_bytes_to_send_list = list(cli_sizes)
+    else:
+        cli_bytes_to_send_list = list(range(cli_bytes_start, cli_bytes_end, 
+                                            cli_bytes_step))
 
-    max_iter = max(srv_bytes_to_send_list, cli_bytes_to_send_list)
-    total_iterations = len(max_iter) * num_cipheruites
+    bytes_to_send = list(pair_bytes_to_send(cli_bytes_to_send_list,
+                                            srv_bytes_to_send_list,
+                                            DEFAULT_BYTES_TO_SEND))
+    total_runs = len(bytes_to_send) * num_cipheruites * num_runs
 
     """
     {
@@ -160,119 +608,421 @@ def run(client_path, server_path, num_runs, ciphers_path,
     """
 
 
-    for sc_id, name, flags in ciphersuites:
-        """
-        1. Start server in thread 1
-        2. Start client in thread 2
-        3. Make sure that server ret code == 0
-            else - continue
-        4. Make sure that server ret coce == 0
-            else - continue
-        """
-        cli_prof_res = defaultdict(dict)
-        srv_prof_res = defaultdict(dict)
-
-        srv_bytes_to_send_iter = iter(srv_bytes_to_send_list)
-        cli_bytes_to_send_iter = iter(cli_bytes_to_send_list)
-
-        for _ in max_iter:
-            cli_bytes_to_send = get_next_or_default(cli_bytes_to_send_iter,
-                                                        DEFAULT_BYTES_TO_SEND)
-            srv_bytes_to_send = get_next_or_default(srv_bytes_to_send_iter,
-                                                    DEFAULT_BYTES_TO_SEND)
-
-            papi_out_srv = SERVER_CALLGRIND_OUT_FILE.format(out_path,
-                                                            sc_id,
-                                                            srv_bytes_to_send,
-                                                            cli_bytes_to_send)
-            papi_out_cli = CLIENT_CALLGRIND_OUT_FILE.format(out_path,
-                                                            sc_id,
-                                                            cli_bytes_to_send,
-                                                            srv_bytes_to_send)
-            for i in range(num_runs):
-                pool = ThreadPool(processes=2)
-                completed_iterations += 1
-                print(f'--- Begin profiling for {sc_id} : {name} : {flags} [{completed_iterations}/{total_iterations} Run {i+1}/{num_runs}] ---')
-
-                print(f'\tStarting server... (Out file: {papi_out_srv})')
-
-                async_result_srv = pool.apply_async(run_server,
-                                                    (server_path,
-                                                    sc_id,
-                                                    is_verbose,
-                                                    srv_bytes_to_send
-                                                    )
-                                                    )
+    slots = queue.Queue()
+    for slot in pair_slots:
+        slots.put(slot)
 
-                print(f'\t\tWaiting {timeout} seconds for server to load...')
-                time.sleep(timeout) # give the server time to start
+    journal_config = {
+        'client': str(client_path),
+        'server': str(server_path),
+        'num_runs': num_runs,
+        'target_rel_ci': target_rel_ci,
+        'min_runs': min_runs if target_rel_ci else None,
+        'adaptive_metric': adaptive_metric if target_rel_ci else None,
+        'ciphersuites': [sc_id for sc_id, _, _ in ciphersuites],
+        'bytes_to_send': [list(pair) for pair in bytes_to_send],
+        'events': list(metric_registry.events),
+        'event_groups': [list(group) for group in metric_registry.groups or ()],
+    }
+    journal_path = Path(out_path) / JOURNAL_FILE
+    if resume and not journal_path.exists():
+        print_yellow(f'\t[!] No journal at {journal_path}, starting the '
+                     'campaign from the beginning\n')
+        resume = False
+    if not resume and store.keys(campaign=campaign):
+        if overwrite:
+            store.remove(campaign=campaign)
+            records_path = Path(out_path) / RECORDS_DIR
+            if records_path.is_dir():
+                ResultsStore(records_path).remove(campaign=campaign)
+            print_yellow(f'\t[!] Removed the earlier samples of the campaign '
+                         f'{campaign} from {store_path}\n')
+        elif append:
+            print_yellow(f'\t[!] The campaign {campaign} already has samples in '
+                         f'{store_path}. The new runs are summarized together with them.\n')
+        else:
+            print_red(f'[!!!] The campaign {campaign} already has samples in '
+                      f'{store_path}. Use --resume to carry on with it, --append '
+                      'to add the new runs to it, --overwrite to start it again '
+                      'or --campaign to start another one.')
+            return
 
-                print(f'\tStarting client... (Out file: {papi_out_cli})')
-                async_result_cli = pool.apply_async(run_client,
-                                                    (client_path,
-                                                    sc_id,
-                                                    is_verbose,
-                                                    cli_bytes_to_send
-                                                    )
-                                                    )
+    pinned_cpus = set()
+    for slot in pair_slots:
+        pinned_cpus |= (slot.server_cpus or set()) | (slot.client_cpus or set())
+    env_monitor = EnvironmentMonitor(Path(out_path) / ENVIRONMENT_FILE,
+                                     {'client': client_path, 'server': server_path},
+                                     pinned_cpus or get_available_cpus(),
+                                     pinned_cpus, resume)
+    env_warnings, env_changes = env_monitor.start()
+    for warning in env_warnings:
+        print_yellow(f'\t[!] {warning}')
+    if env_changes:
+        print_environment_drift(env_changes)
+        if strict_env:
+            print_red('[!!!] Cannot resume: the environment changed since the '
+                      f'campaign started, see {env_monitor.path}')
+            return
+    num_env_drifts = 1 if env_changes else 0
+
+    try:
+        journal = CampaignJournal(journal_path, campaign, journal_config, resume)
+    except JournalMismatchError as e:
+        print_red(f'[!!!] Cannot resume: {e}')
+        return
 
-                srv_res = async_result_srv.get()
-                cli_res = async_result_cli.get()
+    # iterations that were being written to the store when interrupted
+    stored_iterations = {key for key in journal.flushed - journal.done
+                         if store.keys(campaign=campaign, entity='client',
+                                       ciphersuite=key[0], bytes_sent=key[1],
+                                       bytes_received=key[2])}
 
-                srv_ret = srv_res[0]
-                cli_ret = cli_res[0]
+    def is_run_pending(sc_id, cli_bytes_to_send, srv_bytes_to_send, i):
+        key = iteration_key(sc_id, cli_bytes_to_send, srv_bytes_to_send)
+        return not (key in journal.done or key in stored_iterations
+                    or i in journal.runs.get(key, {}))
 
-                srv_prof = srv_res[1]
-                cli_prof = cli_res[1]
+    cells = [(sc_id, cli_bytes_to_send, srv_bytes_to_send)
+             for sc_id, _, _ in ciphersuites
+             for cli_bytes_to_send, srv_bytes_to_send in bytes_to_send]
+    jobs = (ProfilingJob(*cell, i, metric_registry.event_group(i))
+            for cell in cells for i in range(num_runs)
+            if is_run_pending(*cell, i))
+    pending_runs = sum(1 for cell in cells for i in range(num_runs)
+                       if is_run_pending(*cell, i))
 
-                pool.close()
+    if resume:
+        print(f'Resuming campaign {campaign}: {len(journal.done)} iterations '
+              f'done, {journal.num_journaled_runs()} runs restored from the '
+              f'journal, {pending_runs}/{total_runs} runs left\n')
 
-                if srv_ret != 0 or cli_ret != 0:
-                    print(f'\n\t[!!!] Non-zero return code from ciphersuite {sc_id} {name} {flags}')
-                    print(f'\t\tServer: {srv_ret} Client: {cli_ret}')
-                    print('\t\tSkipping to next ciphersuite...\n')
-                    num_skipped_ciphersuites += 1
+    # iterations that reached their sampling target, their queued runs are
+    # skipped by the workers
+    stopped_iterations = set()
+    should_skip = lambda job: iteration_key(*job[:3]) in stopped_iterations
+    workers = {}
+    # the phases of the profiler itself, from here to the last run
+    HARNESS_TIMERS.reset()
+    if runner == RUNNER_DISTRIBUTED:
+        # the workers run the pairs, the results come back in the same order
+        pool = DistributedRunner(listen, client_path, server_path,
+                                 Path(out_path) / HOSTS_FILE, is_verbose)
+        print(f'Waiting for workers on {listen[0]}:{listen[1]}, start them with: '
+              f'python -m papiprof.distributed worker {listen[0]}:{listen[1]} '
+              f'--client {client_path} --server {server_path}\n')
+        results = pool.imap(jobs, should_skip)
+    elif runner == RUNNER_ASYNCIO:
+        # one event loop drives all of the pairs
+        pool = AsyncPairRunner(pair_slots, client_path=client_path,
+                               server_path=server_path, is_verbose=is_verbose,
+                               ready_marker=ready_marker, probe_port=bool(port),
+                               max_wait=max_wait, timeout=process_timeout)
+        results = pool.imap(jobs, should_skip)
+    else:
+        # one thread per pair drives the client, one more per pair the server
+        pool = ThreadPool(processes=num_pairs)
+        server_pool = ThreadPool(processes=num_pairs)
+        if persistent:
+            workers = create_persistent_workers(pair_slots, client_path,
+                                                server_path, is_verbose)
+            run_job = partial(profile_persistent_pair, slots=slots, workers=workers,
+                              max_wait=max_wait, should_skip=should_skip,
+                              timeout=process_timeout)
+        else:
+            run_job = partial(profile_pair, client_path=client_path,
+                              server_path=server_path, slots=slots,
+                              server_pool=server_pool, is_verbose=is_verbose,
+                              ready_marker=ready_marker, probe_port=bool(port),
+                              max_wait=max_wait, should_skip=should_skip)
+        # imap() returns the results in the same order as the jobs, which is
+        # the order they're consumed in below
+        results = pool.imap(run_job, jobs)
+    progress = CampaignProgress(pending_runs)
 
-                    if -27 in (srv_ret, cli_ret):
-                        # This here is sort of for debugging. If you're getting
-                        # -27 return codes, make sure you're not compiling/linking
-                        # with the "-pg" option
-                        num_sigttou += 1
+    try:
+        for sc_id, name, flags in ciphersuites:
+            """
+            1. Start server in thread 1
+            2. Wait for the server to be ready
+            3. Start client in thread 2
+            4. Make sure that server ret code == 0
+                else - continue
+            5. Make sure that client ret coce == 0
+                else - continue
+            """
+            print(f'--- Begin profiling for {sc_id} : {name} : {flags} ---')
 
+            for cli_bytes_to_send, srv_bytes_to_send in bytes_to_send:
+                key = iteration_key(sc_id, cli_bytes_to_send, srv_bytes_to_send)
+                if key in journal.done:
+                    print(f'\tBytes sent: {cli_bytes_to_send} client, '
+                          f'{srv_bytes_to_send} server already done, skipping\n')
                     continue
 
-                append_profiling_results(cli_prof_res, 
-                                            cli_prof, sc_id) 
+                journaled_runs = journal.runs.get(key, {})
+                is_in_store = key in stored_iterations
 
-                append_profiling_results(srv_prof_res,
-                                            srv_prof, sc_id)
-            
+                papi_out_srv = SERVER_CALLGRIND_OUT_FILE.format(out_path,
+                                                                sc_id,
+                                                                srv_bytes_to_send,
+                                                                cli_bytes_to_send)
+                papi_out_cli = CLIENT_CALLGRIND_OUT_FILE.format(out_path,
+                                                                sc_id,
+                                                                cli_bytes_to_send,
+                                                                srv_bytes_to_send)
+                adaptive_samples = AdaptiveSamples({}, {})
 
-            print_max_min_for_entity(cli_prof_res,
-                                    sc_id,
-                                    'client')
+                iteration_wait_time = 0
+                iteration_measure_time = 0
+                num_successful_runs = 0
+                is_target_reached = False
+                sampling = journal.sampling.get(key) if is_in_store else None
 
-        
-            print_max_min_for_entity(srv_prof_res,
-                                    sc_id,
-                                    'server')
+                for i in range(num_runs):
+                    if is_in_store:
+                        print('\tRuns already in the results store')
+                        break
 
-            cli_prof_res_avg = avg_profiling_results(cli_prof_res)
-            srv_prof_res_avg = avg_profiling_results(srv_prof_res)
-            
-            save_papi_metrics_to_file(cli_prof_res_avg, papi_out_cli,)
-            save_papi_metrics_to_file(srv_prof_res_avg, papi_out_srv)
+                    if i in journaled_runs:
+                        cli_prof, srv_prof = journaled_runs[i]
+                        print(f'\tRun {i+1}/{num_runs}: restored from the journal')
+                        if target_rel_ci:
+                            append_adaptive_samples(adaptive_samples,
+                                                    {'client': cli_prof, 'server': srv_prof},
+                                                    adaptive_funcname, adaptive_metric_name,
+                                                    sample_filter)
+                        with timing.phase(timing.PHASE_STORE):
+                            store.append_run(campaign, 'client', sc_id, cli_bytes_to_send,
+                                             srv_bytes_to_send, cli_prof)
+                            store.append_run(campaign, 'server', sc_id, srv_bytes_to_send,
+                                             cli_bytes_to_send, srv_prof)
+                        num_successful_runs += 1
+                    else:
+                        res = next(results)
+                        progress.run_completed()
+
+                        iteration_wait_time += res['wait_time']
+                        iteration_measure_time += res['measure_time']
+                        timing.add(timing.PHASE_SERVER_WAIT, res['wait_time'])
+                        timing.add(timing.PHASE_PAIR, res['measure_time'])
 
-        print(f'--- End profiling for {sc_id} : {name} : {flags} [{completed_iterations}/{total_iterations}] ---\n')
+                        print(f'\tRun {i+1}/{num_runs} (pair {res["slot"].index}): '
+                              f'waiting {res["wait_time"]:.3f}s, '
+                              f'measuring {res["measure_time"]:.3f}s {progress}')
+
+                        if not res['is_ready']:
+                            print_yellow(f'\t\t[!] Server not ready after {max_wait} seconds, started client anyway')
+                            num_server_wait_timeouts += 1
+
+                        srv_ret = res['srv_ret']
+                        cli_ret = res['cli_ret']
+
+                        srv_prof = metric_registry.add_derived_metrics(res['srv_prof'])
+                        cli_prof = metric_registry.add_derived_metrics(res['cli_prof'])
+
+                        if srv_ret != 0 or cli_ret != 0:
+                            print(f'\n\t[!!!] Non-zero return code from ciphersuite {sc_id} {name} {flags}')
+                            print(f'\t\tServer: {srv_ret} Client: {cli_ret}')
+                            print('\t\tSkipping to next ciphersuite...\n')
+                            num_skipped_ciphersuites += 1
+
+                            if -27 in (srv_ret, cli_ret):
+                                # This here is sort of for debugging. If you're getting
+                                # -27 return codes, make sure you're not compiling/linking
+                                # with the "-pg" option
+                                num_sigttou += 1
+
+                            if TIMEOUT_RETURN_CODE in (srv_ret, cli_ret):
+                                print_yellow(f'\t\t[!] Killed after {process_timeout} seconds')
+                                num_process_timeouts += 1
+
+                            continue
+
+                        with timing.phase(timing.PHASE_JOURNAL):
+                            journal.record_run(key, i, cli_prof, srv_prof, res.get('host'))
+
+                        if target_rel_ci:
+                            append_adaptive_samples(adaptive_samples,
+                                                    {'client': cli_prof, 'server': srv_prof},
+                                                    adaptive_funcname, adaptive_metric_name,
+                                                    sample_filter)
+
+                        with timing.phase(timing.PHASE_STORE):
+                            store.append_run(campaign, 'client', sc_id, cli_bytes_to_send,
+                                             srv_bytes_to_send, cli_prof)
+                            store.append_run(campaign, 'server', sc_id, srv_bytes_to_send,
+                                             cli_bytes_to_send, srv_prof)
+                            records_writer.append_run(campaign, 'client', sc_id,
+                                                      cli_bytes_to_send, srv_bytes_to_send, i,
+                                                      getattr(cli_prof, 'records', {}))
+                            records_writer.append_run(campaign, 'server', sc_id,
+                                                      srv_bytes_to_send, cli_bytes_to_send, i,
+                                                      getattr(srv_prof, 'records', {}))
+                        num_successful_runs += 1
+                        num_measured_runs += 1
+
+                    if (not target_rel_ci or
+                            not is_sampling_check_due(num_successful_runs, sample_filter)):
+                        continue
+
+                    rel_cis = get_sampling_relative_cis(adaptive_samples, confidence,
+                                                        sample_filter)
+                    # the warm-up runs don't count towards the minimum
+                    if is_sampling_target_reached(rel_cis,
+                                                  num_successful_runs - sample_filter.warmup,
+                                                  target_rel_ci, min_runs):
+                        is_target_reached = True
+                        break
+
+                if target_rel_ci and not is_in_store:
+                    rel_cis = get_sampling_relative_cis(adaptive_samples, confidence,
+                                                        sample_filter)
+                    stop_reason = STOP_TARGET_REACHED if is_target_reached else STOP_MAX_RUNS
+                    sampling = {
+                        'stop_reason': stop_reason,
+                        'num_runs': num_successful_runs,
+                        'metric': adaptive_metric,
+                        'target_rel_ci': target_rel_ci,
+                        # None if it couldn't be computed (less than 2 runs)
+                        'rel_ci': {entity: rel_ci if math.isfinite(rel_ci) else None
+                                   for entity, rel_ci in rel_cis.items()},
+                    }
+                    print(f'\tStopped sampling after {sampling["num_runs"]} runs ({stop_reason}), '
+                          f'relative CI of {adaptive_metric}: '
+                          + (', '.join(f'{entity} ±{rel_ci:.2%}'
+                                       for entity, rel_ci in rel_cis.items())
+                             or 'not measured'))
+
+                if is_target_reached:
+                    # drain the runs of this iteration that were already queued
+                    stopped_iterations.add(key)
+                    num_drained_runs = 0
+                    for j in range(i + 1, num_runs):
+                        if is_run_pending(sc_id, cli_bytes_to_send, srv_bytes_to_send, j):
+                            next(results)
+                            num_drained_runs += 1
+                    progress.skip_runs(num_drained_runs)
             
 
-    
+                total_wait_time += iteration_wait_time
+                total_measure_time += iteration_measure_time
+                print(f'\tIteration wall time: waiting {iteration_wait_time:.3f}s, '
+                      f'measuring {iteration_measure_time:.3f}s\n')
+
+                if not is_in_store:
+                    with timing.phase(timing.PHASE_JOURNAL):
+                        journal.record_flush(key, sampling)
+                    with timing.phase(timing.PHASE_STORE):
+                        store.flush()
+                        records_writer.flush()
+
+                with timing.phase(timing.PHASE_SUMMARIZE):
+                    if summary_mode == SUMMARY_BASIC:
+                        cli_prof_res_avg = running_profiling_results(
+                            store, campaign, 'client', sc_id, cli_bytes_to_send,
+                            srv_bytes_to_send, confidence)
+                        srv_prof_res_avg = running_profiling_results(
+                            store, campaign, 'server', sc_id, srv_bytes_to_send,
+                            cli_bytes_to_send, confidence)
+                    else:
+                        cli_prof_samples = iter_profiling_samples(
+                            store, campaign, 'client', sc_id, cli_bytes_to_send,
+                            srv_bytes_to_send)
+                        srv_prof_samples = iter_profiling_samples(
+                            store, campaign, 'server', sc_id, srv_bytes_to_send,
+                            cli_bytes_to_send)
+                        cli_prof_res_avg = avg_profiling_results(cli_prof_samples, sc_id,
+                                                                 **stats_options)
+                        srv_prof_res_avg = avg_profiling_results(srv_prof_samples, sc_id,
+                                                                 **stats_options)
+
+                if sampling:
+                    for prof_res_avg in (cli_prof_res_avg, srv_prof_res_avg):
+                        for cs_ids in prof_res_avg.values():
+                            cs_ids[sc_id][SAMPLING_KEY] = sampling
+
+                print_summary_for_entity(cli_prof_res_avg,
+                                         sc_id,
+                                         'client')
+
+                print_summary_for_entity(srv_prof_res_avg,
+                                         sc_id,
+                                         'server')
+
+                if save_json:
+                    with timing.phase(timing.PHASE_JSON):
+                        save_papi_metrics_to_file(cli_prof_res_avg, papi_out_cli,)
+                        save_papi_metrics_to_file(srv_prof_res_avg, papi_out_srv)
+
+                with timing.phase(timing.PHASE_JOURNAL):
+                    journal.record_done(key)
+
+                with timing.phase(timing.PHASE_ENVIRONMENT):
+                    env_changes = env_monitor.check(key)
+                if env_changes:
+                    print_environment_drift(env_changes)
+                    num_env_drifts += 1
+                    if strict_env:
+                        raise EnvironmentDriftError(env_changes)
+
+            print(f'--- End profiling for {sc_id} : {name} : {flags} {progress} ---\n')
+    except (KeyboardInterrupt, EnvironmentDriftError) as e:
+        if runner != RUNNER_THREADS:
+            pool.close()
+        else:
+            pool.terminate()
+            server_pool.terminate()
+        reason = ('The environment changed' if isinstance(e, EnvironmentDriftError)
+                  else 'Interrupted')
+        print_red(f'\n[!] {reason}. The finished runs are in {journal.path}, '
+                  'run again with --resume to carry on from there.')
+        return
+    finally:
+        journal.close()
+        stop_persistent_workers(workers)
+        env_monitor.finish()
+
+    pool.close()
+    if runner == RUNNER_THREADS:
+        server_pool.close()
+    timing_report = HARNESS_TIMERS.report(num_measured_runs, runner=runner,
+                                          num_pairs=num_pairs,
+                                          persistent=persistent)
+
+    if len(bytes_to_send) > 1:
+        fits = fit_campaign(store, campaign, fit_metric)
+        break_evens = find_break_even_sizes(fits)
+        print_scaling_report(fits, break_evens, fit_metric,
+                             {sc_id: name for sc_id, name, _ in ciphersuites})
+        scaling_path = Path(out_path) / SCALING_FILE
+        save_scaling_report(scaling_report(fits, break_evens, fit_metric),
+                            scaling_path)
+        print(f'\tSaved to {scaling_path}\n')
 
     print('--- STATISTICS ---')
     print(f'\tTotal CipherSuites:{num_cipheruites}'
     f'\nMeasured: {num_cipheruites - num_skipped_ciphersuites}\n'
     f'Skipped: {num_skipped_ciphersuites}')
     print(f'Number of SIGTTOU signals: {num_sigttou}')
+    print(f'Server wait timeouts: {num_server_wait_timeouts}')
+    print(f'Processes killed after the timeout: {num_process_timeouts}')
+    print(f'Wall time waiting for server: {total_wait_time:.3f}s')
+    print(f'Wall time measuring: {total_measure_time:.3f}s')
+    print(f'Environment drifts: {num_env_drifts} (see {env_monitor.path})')
+    if records_writer.num_records:
+        print(f'Records: {records_writer.num_records} (see python -m papiprof.timeseries '
+              f'{out_path})')
+    if runner == RUNNER_DISTRIBUTED:
+        print(f'Runs per host (see {pool.hosts_path}):')
+        pool.print_hosts()
+
+    timing_path = Path(out_path) / TIMING_FILE
+    save_timing_report(timing_report, timing_path)
+    print(f'\n--- HARNESS TIMING (see {timing_path}) ---')
+    print_timing_report(timing_report)
+    if runner == RUNNER_DISTRIBUTED:
+        print('\tThe spawn, communicate and parse phases run on the workers, '
+              'they are not timed with the distributed runner.')
 
     if (num_sigttou > 0):
         print('[!!!] SIGTTOU singals detected! Make sure you\'re not compiling'
@@ -314,6 +1064,152 @@ if __name__ == '__main__':
                                                'output path')
     parser.add_argument('-v', '--verbose', action='store_true', 
                         default=False, help='enable verbose output')
+    parser.add_argument('--ready-marker', type=str, default=None,
+                        help='start the client as soon as the server prints '
+                        'this string to its stdout')
+    parser.add_argument('--port', type=int, default=DEFAULT_SERVER_PORT,
+                        help='start the client as soon as the server is '
+                        'listening on this port. Use 0 to disable '
+                        f'(default: {DEFAULT_SERVER_PORT})')
+    parser.add_argument('--max-wait', type=float, default=1,
+                        help='maximum number of seconds to wait for the '
+                        'server to be ready. If neither the ready marker '
+                        'nor the port are used, this is how long the '
+                        'client start is delayed (default: 1)')
+    parser.add_argument('-j', '--pairs', type=int, default=1,
+                        help='number of client/server pairs to run at the '
+                        'same time. Pair i uses the port <port> + i '
+                        '(default: 1)')
+    parser.add_argument('--cpus-per-pair', type=int, default=2,
+                        help='number of CPUs each pair is pinned to. The '
+                        'server gets the first half, the client the second '
+                        '(default: 2)')
+    parser.add_argument('--no-pin', action='store_true', default=False,
+                        help='do not pin the pairs to CPUs')
+    parser.add_argument('--persistent', action='store_true', default=False,
+                        help='start the client and the server once per pair '
+                        'and send them a command for each run, instead of '
+                        'starting them for every run. The programs must '
+                        'support the protocol described in '
+                        'papiprof/persistent.py (default: False)')
+    parser.add_argument('--runner', type=str, default=RUNNER_THREADS,
+                        choices=(RUNNER_THREADS, RUNNER_ASYNCIO, RUNNER_DISTRIBUTED),
+                        help='how the client and server processes are run: '
+                        f'"{RUNNER_THREADS}" waits for each of them in a thread, '
+                        f'"{RUNNER_ASYNCIO}" drives all of the pairs from a '
+                        'single event loop and parses their output as it '
+                        f'arrives, "{RUNNER_DISTRIBUTED}" shards the runs across '
+                        'the workers that connect to --listen, see '
+                        f'papiprof/distributed.py (default: {RUNNER_THREADS})')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_PROCESS_TIMEOUT,
+                        help='seconds after which a client or server is killed, '
+                        f'with the {RUNNER_ASYNCIO} runner or --persistent '
+                        f'(default: {DEFAULT_PROCESS_TIMEOUT})')
+    parser.add_argument('--listen', type=parse_address,
+                        default=('127.0.0.1', DEFAULT_COORDINATOR_PORT),
+                        help='<host>:<port> the workers connect to, with the '
+                        f'{RUNNER_DISTRIBUTED} runner. Only listen on a trusted '
+                        'network, there is no authentication '
+                        f'(default: 127.0.0.1:{DEFAULT_COORDINATOR_PORT})')
+    parser.add_argument('--snapshot-every', type=int, default=None,
+                        help='have the binaries report a snapshot of their '
+                        'counters every N bytes of the data transfers (0: '
+                        'after every record), saved to <out>/papi.records, see '
+                        'papiprof/timeseries.py (default: None, no snapshots)')
+    parser.add_argument('--metrics-config', type=str, default=None,
+                        help='JSON file with the PAPI events to measure, their '
+                        'groups and the derived metrics to compute, see '
+                        'papiprof/metrics.py (default: PAPI timers and any '
+                        'PAPI_* event the binaries report)')
+    parser.add_argument('--cli-sizes', type=parse_size_grid, default=None,
+                        help='grid of client bytes to send, replacing '
+                        'cli_bytes_start/end/step: explicit sizes ("1024,4096"), '
+                        'log-spaced ("log:64:1048576:8", 8 sizes from 64 B to '
+                        '1 MiB) or a range ("range:0:10000:1000") (default: None)')
+    parser.add_argument('--srv-sizes', type=parse_size_grid, default=None,
+                        help='grid of server bytes to send, replacing '
+                        'srv_bytes_start/end/step, see --cli-sizes (default: None)')
+    parser.add_argument('--fit-metric', type=str, default=DEFAULT_FIT_METRIC,
+                        help='metric fitted against the payload size when '
+                        'there are several sizes (default: '
+                        f'{DEFAULT_FIT_METRIC})')
+    parser.add_argument('--strict-env', action='store_true', default=False,
+                        help='stop the campaign if the environment (CPU '
+                        'frequency scaling, kernel, binaries, ...) changes '
+                        'while it runs, and refuse to resume it in a '
+                        f'different one. It is saved to <out>/{ENVIRONMENT_FILE} '
+                        '(default: False)')
+    parser.add_argument('--warmup', type=int, default=0,
+                        help='number of first runs of each configuration '
+                        'left out of the summaries and of the adaptive '
+                        'sampling, where they don\'t count towards '
+                        '--min-runs either (default: 0)')
+    parser.add_argument('--outliers', type=str, default=OUTLIERS_NONE,
+                        choices=OUTLIER_METHODS,
+                        help='outlier rejection: "iqr" rejects the samples '
+                        'outside of Tukey\'s fences, "mad" the samples with a '
+                        'modified z-score above the threshold. The raw '
+                        f'samples are kept in the store (default: {OUTLIERS_NONE})')
+    parser.add_argument('--outlier-threshold', type=float, default=None,
+                        help='IQR factor or modified z-score of the outlier '
+                        'rejection (default: 1.5 for iqr, 3.5 for mad)')
+    parser.add_argument('--trim', type=float, default=0,
+                        help='also report the mean without this proportion '
+                        'of the samples at each end, e.g. 0.1 (default: 0)')
+    parser.add_argument('--campaign', type=str, default=None,
+                        help='campaign name the raw samples are saved under '
+                        f'in <out>/{STORE_DIR} (default: name of <out>)')
+    parser.add_argument('--store', type=str, default=None,
+                        help='results store to save the raw samples to, which '
+                        'can be shared by several campaigns, see '
+                        f'papiprof/matrix.py (default: <out>/{STORE_DIR})')
+    parser.add_argument('--no-json', action='store_true', default=False,
+                        help='only save the raw samples to the results '
+                        'store, not the per-configuration JSON summaries')
+    existing_group = parser.add_mutually_exclusive_group()
+    existing_group.add_argument('--resume', action='store_true', default=False,
+                                help='carry on with an interrupted campaign in '
+                                '<out>, skipping the runs recorded in '
+                                f'<out>/{JOURNAL_FILE}')
+    existing_group.add_argument('--append', action='store_true', default=False,
+                                help='if the campaign already has samples in the '
+                                'store, summarize the new runs together with them '
+                                '(default: refuse to start)')
+    existing_group.add_argument('--overwrite', action='store_true', default=False,
+                                help='if the campaign already has samples in the '
+                                'store, remove them first (default: refuse to start)')
+    parser.add_argument('--target-rel-ci', type=float, default=None,
+                        help='adaptive sampling: keep running each '
+                        'configuration until the confidence interval of the '
+                        'mean of --adaptive-metric is within this fraction of '
+                        'the mean (e.g. 0.01 for ±1%%) for both the client '
+                        'and the server')
+    parser.add_argument('--min-runs', type=int, default=10,
+                        help='adaptive sampling: minimum number of successful '
+                        'runs of a configuration (default: 10)')
+    parser.add_argument('--max-runs', type=int, default=None,
+                        help='adaptive sampling: maximum number of runs of a '
+                        'configuration (default: <runs>)')
+    parser.add_argument('--adaptive-metric', type=str,
+                        default=DEFAULT_ADAPTIVE_METRIC,
+                        help='adaptive sampling: <funcname>:<metric> whose '
+                        f'confidence interval is checked (default: '
+                        f'{DEFAULT_ADAPTIVE_METRIC})')
+    parser.add_argument('--confidence', type=parse_confidence,
+                        default=DEFAULT_CONFIDENCE,
+                        help='confidence level of the reported confidence '
+                        f'intervals of the means (default: {DEFAULT_CONFIDENCE})')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        help='number of bootstrap resamples for the confidence '
+                        'intervals. 0 uses the normal approximation (default: 0)')
+    parser.add_argument('--summary', type=str, default=SUMMARY_FULL,
+                        choices=SUMMARY_MODES,
+                        help='statistics of the summaries: "full" loads the '
+                        'samples of each iteration back for the median, '
+                        'percentiles and MAD, "basic" only has the count, '
+                        'mean, stdev, min, max and CI, from the running stats '
+                        'of the store, without loading the samples '
+                        f'(default: {SUMMARY_FULL})')
 
     args = parser.parse_args()
     run(args.client, 
@@ -327,4 +1223,35 @@ if __name__ == '__main__':
         args.srv_bytes_end, 
         args.srv_bytes_step,
         args.out, 
-        args.verbose)
+        args.verbose,
+        args.ready_marker,
+        args.port,
+        args.max_wait,
+        args.pairs,
+        args.cpus_per_pair,
+        not args.no_pin,
+        args.campaign,
+        not args.no_json,
+        args.confidence,
+        args.bootstrap,
+        args.resume,
+        args.target_rel_ci,
+        args.min_runs,
+        args.max_runs,
+        args.adaptive_metric,
+        args.persistent,
+        args.runner,
+        args.timeout,
+        MetricRegistry.from_file(args.metrics_config) if args.metrics_config else None,
+        args.cli_sizes,
+        args.srv_sizes,
+        args.fit_metric,
+        args.strict_env,
+        SampleFilter(args.warmup, args.outliers, args.outlier_threshold,
+                     args.trim),
+        args.listen,
+        args.snapshot_every,
+        args.store,
+        args.append,
+        args.overwrite,
+        args.summary)
@@ -0,0 +1,35 @@
+"""Tests of papiprof.aiorunner."""
+import time
+import asyncio
+import unittest
+
+from papiprof.aiorunner import wait_for_server_ready
+
+def run(coroutine_function, *args, **kwargs):
+    """Runs a coroutine in a new event loop (asyncio.run() is Python 3.7+)."""
+    async def main():
+        ready_event = asyncio.Event()
+        ready_event.set()
+        return await coroutine_function(ready_event, *args, **kwargs)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+class WaitForServerReadyTest(unittest.TestCase):
+
+    def test_fixed_delay_without_marker_or_port(self):
+        start = time.monotonic()
+        self.assertTrue(run(wait_for_server_ready, None, max_wait=0.2))
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_ready_marker_without_port(self):
+        start = time.monotonic()
+        self.assertTrue(run(wait_for_server_ready, None, max_wait=5,
+                            has_ready_marker=True))
+        self.assertLess(time.monotonic() - start, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Tests of the verdicts of papiprof.compare."""
+import unittest
+from array import array
+
+from papiprof.compare import (VERDICT_REGRESSION, VERDICT_IMPROVEMENT,
+                              VERDICT_UNCHANGED, SeriesKey, compare_series,
+                              compare_results)
+
+def series(avg, stdev=1.0, num_runs=30, samples=None):
+    return {'num_runs': num_runs, 'avg': avg, 'stdev': stdev,
+            'samples': array('d', samples) if samples is not None else None}
+
+def key(metric='virtcyc', ciphersuite='60'):
+    return SeriesKey('server', 'handshake', ciphersuite, 0, 0, metric)
+
+class VerdictTest(unittest.TestCase):
+
+    def verdicts(self, baseline, candidate, **kwargs):
+        comparisons = compare_results(baseline, candidate, **kwargs)
+        return {k: comparison['verdict'] for k, comparison in comparisons.items()}
+
+    def test_lower_is_better(self):
+        self.assertEqual(self.verdicts({key(): series(100)}, {key(): series(110)}),
+                         {key(): VERDICT_REGRESSION})
+        self.assertEqual(self.verdicts({key(): series(100)}, {key(): series(90)}),
+                         {key(): VERDICT_IMPROVEMENT})
+
+    def test_higher_is_better(self):
+        self.assertEqual(self.verdicts({key('ipc'): series(1.0, 0.01)},
+                                       {key('ipc'): series(0.9, 0.01)}),
+                         {key('ipc'): VERDICT_REGRESSION})
+        self.assertEqual(self.verdicts({key('ipc'): series(1.0, 0.01)},
+                                       {key('ipc'): series(1.1, 0.01)}),
+                         {key('ipc'): VERDICT_IMPROVEMENT})
+
+    def test_below_threshold(self):
+        # significant, but only 1%
+        self.assertEqual(self.verdicts({key(): series(100, 0.1)}, {key(): series(101, 0.1)}),
+                         {key(): VERDICT_UNCHANGED})
+        self.assertEqual(self.verdicts({key(): series(100, 0.1)}, {key(): series(101, 0.1)},
+                                       threshold=0.005),
+                         {key(): VERDICT_REGRESSION})
+
+    def test_not_significant(self):
+        self.assertEqual(self.verdicts({key(): series(100, 50, 5)},
+                                       {key(): series(120, 50, 5)}),
+                         {key(): VERDICT_UNCHANGED})
+
+    def test_only_common_series(self):
+        baseline = {key(): series(100), key(ciphersuite='174'): series(100)}
+        candidate = {key(): series(100), key(metric='ipc'): series(1)}
+        self.assertEqual(list(compare_results(baseline, candidate)), [key()])
+
+    def test_holm_adjustment(self):
+        # significant alone (p ~ 0.024), not once adjusted for 3 series
+        baseline = {key(ciphersuite=cs_id): series(100, 10, 10) for cs_id in 'abc'}
+        candidate = {key(ciphersuite='a'): series(111, 10, 10),
+                     key(ciphersuite='b'): series(100, 10, 10),
+                     key(ciphersuite='c'): series(100, 10, 10)}
+        comparisons = compare_results(baseline, candidate)
+        comparison = comparisons[key(ciphersuite='a')]
+        self.assertLess(comparison['p_value'], 0.05)
+        self.assertEqual(comparison['adjusted_p'], min(1, 3 * comparison['p_value']))
+        self.assertEqual(comparison['verdict'], VERDICT_UNCHANGED)
+        self.assertEqual(compare_results({key(): baseline[key(ciphersuite='a')]},
+                                         {key(): candidate[key(ciphersuite='a')]})
+                         [key()]['verdict'], VERDICT_REGRESSION)
+
+class CompareSeriesTest(unittest.TestCase):
+
+    def test_samples_use_mann_whitney(self):
+        result = compare_series(series(2, 1, 3, [1, 2, 3]), series(5, 1, 3, [4, 5, 6]))
+        self.assertAlmostEqual(result['mann_whitney_p'], 0.0808555983700523, places=12)
+        self.assertEqual(result['p_value'], result['mann_whitney_p'])
+        self.assertEqual(result['cliffs_delta'], 1)
+        self.assertAlmostEqual(result['rel_diff'], 1.5, places=12)
+
+    def test_summaries_use_welch(self):
+        result = compare_series(series(10, 2, 5), series(14, 4, 10))
+        self.assertIsNone(result['mann_whitney_p'])
+        self.assertEqual(result['p_value'], result['welch_p'])
+        self.assertTrue(0.02 < result['p_value'] < 0.05)
+
+    def test_single_runs(self):
+        result = compare_series(series(100, 0, 1), series(200, 0, 1))
+        self.assertEqual((result['welch_p'], result['hedges_g']), (1.0, None))
+        self.assertEqual(compare_results({key(): series(100, 0, 1)},
+                                         {key(): series(200, 0, 1)})[key()]['verdict'],
+                         VERDICT_UNCHANGED)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Tests of the expansion of papiprof.matrix specs into cells."""
+import unittest
+
+from papiprof.matrix import DEFAULT_RUNS, expand_matrix, cell_command
+
+BUILDS = {
+    'mbedtls': {'client': 'mbedtls/{key_size}/ssl_client2',
+                'server': 'mbedtls/ssl_server2',
+                'setup': ['make -C mbedtls']},
+    'fork': {'client': 'fork/ssl_client2', 'server': 'fork/ssl_server2'},
+}
+
+class ExpandMatrixTest(unittest.TestCase):
+
+    def test_axes_and_names(self):
+        cells = expand_matrix({
+            'builds': BUILDS,
+            'key_sizes': [1024, 2048],
+            'ciphers': ['lists/rsa.txt'],
+            'sizes': [{'name': 'hs'}, {'name': 'bulk', 'cli': 'log:64:1024:3'}],
+            'setup': ['./gen_certs.sh {key_size}'],
+            'env': {'SERVER_CRT_FILE': 'certs/rsa_{key_size}.crt'},
+            'runs': 50,
+        })
+        self.assertEqual(len(cells), 2 * 2 * 2)
+        names = [cell.name for cell in cells]
+        # the cells with the same setup and binaries next to each other
+        self.assertEqual(names, ['mbedtls_1024_hs', 'mbedtls_1024_bulk',
+                                 'mbedtls_2048_hs', 'mbedtls_2048_bulk',
+                                 'fork_1024_hs', 'fork_1024_bulk',
+                                 'fork_2048_hs', 'fork_2048_bulk'])
+        cell = cells[3]
+        self.assertEqual(cell.client, 'mbedtls/2048/ssl_client2')
+        self.assertEqual(cell.setup, ('make -C mbedtls', './gen_certs.sh 2048'))
+        self.assertEqual(cell.env, {'SERVER_CRT_FILE': 'certs/rsa_2048.crt'})
+        self.assertEqual((cell.cli_sizes, cell.srv_sizes, cell.runs),
+                         ('log:64:1024:3', None, 50))
+
+    def test_policies(self):
+        cells = expand_matrix({
+            'builds': {'mbedtls': BUILDS['mbedtls']},
+            'key_sizes': [1024],
+            'ciphers': ['a.txt', 'b.txt'],
+            'options': {'ready_marker': 'READY', 'pairs': 2},
+            'policies': {'quick': {'runs': 10}, 'ci': {'target_rel_ci': 0.01,
+                                                       'pairs': 1}},
+        })
+        by_name = {cell.name: cell for cell in cells}
+        self.assertEqual(sorted(by_name), ['mbedtls_1024_a_ci', 'mbedtls_1024_a_quick',
+                                           'mbedtls_1024_b_ci', 'mbedtls_1024_b_quick'])
+        quick, ci = by_name['mbedtls_1024_a_quick'], by_name['mbedtls_1024_a_ci']
+        self.assertEqual((quick.runs, quick.options), (10, {'ready_marker': 'READY',
+                                                            'pairs': 2}))
+        self.assertEqual((ci.runs, ci.options), (DEFAULT_RUNS, {
+            'ready_marker': 'READY', 'pairs': 1, 'target_rel_ci': 0.01}))
+
+    def test_dedupe(self):
+        # the key size isn't used by the binaries, the setup or the environment
+        cells = expand_matrix({'builds': {'fork': BUILDS['fork']},
+                               'key_sizes': [1024, 2048], 'ciphers': 'a.txt'})
+        self.assertEqual([cell.name for cell in cells], ['fork_1024'])
+
+    def test_invalid_specs(self):
+        for spec in ({'ciphers': ['a.txt']},
+                     {'builds': {'b': {'client': 'c'}}, 'ciphers': ['a.txt']},
+                     {'builds': BUILDS},
+                     {'builds': BUILDS, 'ciphers': ['a.txt'],
+                      'sizes': [{'cli': 'log:1:2'}]},
+                     {'builds': BUILDS, 'ciphers': ['a.txt'],
+                      'options': {'store': 'elsewhere'}},
+                     {'builds': BUILDS, 'ciphers': ['a.txt'],
+                      'policies': {'p': {'resume': True}}},
+                     # {key_size} without key sizes
+                     {'builds': {'mbedtls': BUILDS['mbedtls']}, 'ciphers': ['a.txt']},
+                     {'builds': BUILDS, 'ciphers': ['a.txt'],
+                      'sizes': [{'name': 'x'}, {'name': 'x', 'cli': '1,2'}]}):
+            with self.assertRaises(ValueError, msg=spec):
+                expand_matrix(spec)
+
+    def test_cell_command(self):
+        [cell] = expand_matrix({
+            'builds': {'fork': BUILDS['fork']}, 'ciphers': ['a.txt'], 'runs': 7,
+            'sizes': [{'srv': '0,1024'}],
+            'options': {'ready_marker': 'READY', 'no_environment': True,
+                        'strict_env': False},
+        })
+        command = cell_command(cell, 'out', 'out/papi.store')
+        self.assertEqual(command[2:], [
+            'fork/ssl_client2', 'fork/ssl_server2', '7', 'a.txt',
+            '0', '0', '0', '0', '0', '0', 'out/fork', '--campaign', 'fork',
+            '--store', 'out/papi.store', '--srv-sizes', '0,1024',
+            '--no-environment', '--ready-marker', 'READY'])
+
+if __name__ == '__main__':
+    unittest.main()
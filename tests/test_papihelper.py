@@ -0,0 +1,59 @@
+"""Tests of papiprof.papihelper."""
+import time
+import threading
+import unittest
+
+from papiprof import papihelper
+from papiprof.metrics import DEFAULT_METRIC_REGISTRY, MetricRegistry
+from papiprof.papihelper import parse_output_into_metrics, wait_for_server_ready
+
+class OutputGrammarTest(unittest.TestCase):
+
+    def tearDown(self):
+        papihelper.set_metric_registry(DEFAULT_METRIC_REGISTRY)
+
+    def parse(self, output):
+        return {funcname: dict(metrics)
+                for funcname, metrics in parse_output_into_metrics(output).items()}
+
+    def test_function_names_with_underscores(self):
+        self.assertEqual(self.parse('ssl_do_handshake_virtcyc 10\r\n'
+                                    'handshake_PAPI_L1_DCM 3\n'
+                                    'not a metric 5\n'),
+                         {'ssl_do_handshake': {'virtcyc': 10},
+                          'handshake': {'PAPI_L1_DCM': 3}})
+
+    def test_function_name_ending_in_a_metric(self):
+        self.assertEqual(self.parse('get_realtime_virttime 7\n'
+                                    'timer_virtcyc_realcyc 8\n'),
+                         {'get_realtime': {'virttime': 7},
+                          'timer_virtcyc': {'realcyc': 8}})
+
+        # the longest registered metric name wins
+        papihelper.set_metric_registry(MetricRegistry(events=['MISSES', 'L1_MISSES']))
+        self.assertEqual(self.parse('flush_L1_MISSES 12\nflush_MISSES 4\n'),
+                         {'flush': {'L1_MISSES': 12, 'MISSES': 4}})
+
+class WaitForServerReadyTest(unittest.TestCase):
+
+    def test_fixed_delay_without_marker_or_port(self):
+        server_started = threading.Event()
+        server_started.set()
+        start = time.monotonic()
+        self.assertTrue(wait_for_server_ready(server_started, None, max_wait=0.2))
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_ready_marker_without_port(self):
+        server_started = threading.Event()
+        server_started.set()
+        start = time.monotonic()
+        self.assertTrue(wait_for_server_ready(server_started, None, max_wait=5,
+                                              has_ready_marker=True))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_marker_never_printed(self):
+        self.assertFalse(wait_for_server_ready(threading.Event(), None, max_wait=0.05,
+                                               has_ready_marker=True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Tests of the data transfer records of papiprof.records."""
+import math
+import unittest
+
+from papiprof.records import (RecordSeries, RecordSeriesBuilder, records_to_dict,
+                              records_from_dict)
+
+def as_list(series):
+    return [None if math.isnan(value) else value for value in series]
+
+class RecordSeriesTest(unittest.TestCase):
+
+    def test_differences(self):
+        builder = RecordSeriesBuilder()
+        builder.feed('snapshot ssl_write 16384 virtcyc 1000 virttime 10\n'
+                     'ssl_write_virtcyc 5000\n'
+                     'snapshot ssl_write 32768 virtcyc 2500 virttime 25\n')
+        builder.feed('snapshot ssl_write 40000 virtcyc 3000 virttime 30\r\n'
+                     'snapshot ssl_read 100 virtcyc 7\n')
+        series = builder.series['ssl_write']
+        self.assertEqual(len(series), 3)
+        self.assertEqual(list(series.bytes), [16384, 16384, 7232])
+        self.assertEqual(list(series.values['virtcyc']), [1000, 1500, 500])
+        self.assertEqual(list(series.values['virttime']), [10, 15, 5])
+        self.assertEqual(list(builder.series['ssl_read'].values['virtcyc']), [7])
+
+    def test_missing_metrics(self):
+        series = RecordSeries()
+        series.add_snapshot(10, {'virtcyc': 100})
+        series.add_snapshot(20, {'virtcyc': 250, 'virttime': 5})
+        series.add_snapshot(30, {'virttime': 9})
+        series.add_snapshot(40, {'virtcyc': 400, 'virttime': 12})
+        series.add_snapshot(50, {'virtcyc': 450, 'virttime': 14})
+        self.assertEqual(list(series.bytes), [10] * 5)
+        # unknown before its first snapshot and after a gap, not counted from 0
+        self.assertEqual(as_list(series.values['virtcyc']), [100, 150, None, None, 50])
+        self.assertEqual(as_list(series.values['virttime']), [None, None, 4, 3, 2])
+
+    def test_round_trip(self):
+        builder = RecordSeriesBuilder()
+        builder.feed('snapshot ssl_write 100 virtcyc 10\n'
+                     'snapshot ssl_write 200 virtcyc 30\n')
+        content = records_to_dict(builder.series)
+        self.assertEqual(content, {'ssl_write': {'bytes': [100, 100],
+                                                 'virtcyc': [10, 20]}})
+        records = records_from_dict(content)
+        self.assertEqual(list(records['ssl_write'].bytes), [100, 100])
+        self.assertEqual(list(records['ssl_write'].values['virtcyc']), [10, 20])
+
+if __name__ == '__main__':
+    unittest.main()
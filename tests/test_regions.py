@@ -0,0 +1,54 @@
+"""Tests of the call trees of papiprof.regions."""
+import unittest
+from collections import defaultdict
+
+from papiprof.regions import RegionTreeBuilder
+
+class RegionTreeTest(unittest.TestCase):
+
+    def test_nested_regions(self):
+        builder = RegionTreeBuilder()
+        builder.feed('region_enter 1 0 handshake\n'
+                     'region_enter 2 1 ecdh\n'
+                     'region_exit 2 virtcyc 30 virttime 3\n'
+                     'handshake_virtcyc 999\n'
+                     'region_enter 2 1 ecdh\n'
+                     'region_enter 3 2 mpi_exp_mod\n'
+                     'region_exit 3 virtcyc 15\n'
+                     'region_exit 2 virtcyc 20 virttime 2\n'
+                     'region_exit 1 virtcyc 100 virttime 10\n')
+        self.assertEqual(builder.nodes, {
+            'handshake': {'calls': 1, 'virtcyc': 100, 'self_virtcyc': 50,
+                          'virttime': 10, 'self_virttime': 5},
+            'handshake;ecdh': {'calls': 2, 'virtcyc': 50, 'self_virtcyc': 35,
+                               'virttime': 5, 'self_virttime': 5},
+            'handshake;ecdh;mpi_exp_mod': {'calls': 1, 'virtcyc': 15,
+                                           'self_virtcyc': 15},
+        })
+
+    def test_lines_split_across_feeds(self):
+        builder = RegionTreeBuilder()
+        builder.feed('region_enter 1 0 handshake\n')
+        builder.feed('foo_virtcyc 1\n')
+        builder.feed('region_exit 1 virtcyc 7\r\n')
+        self.assertEqual(builder.nodes['handshake'],
+                         {'calls': 1, 'virtcyc': 7, 'self_virtcyc': 7})
+
+    def test_unknown_and_unclosed_regions(self):
+        builder = RegionTreeBuilder()
+        builder.feed('region_exit 5 virtcyc 7\n'
+                     'region_enter 1 0 handshake\n')
+        self.assertEqual(builder.nodes, {})
+
+    def test_add_to_metrics(self):
+        builder = RegionTreeBuilder()
+        builder.feed('region_enter 1 0 handshake\n'
+                     'region_exit 1 virtcyc 100\n')
+        metrics = defaultdict(dict, {'handshake': {'virtcyc': 90, 'virttime': 4}})
+        builder.add_to_metrics(metrics)
+        # the top-level region replaces the values of the flat function
+        self.assertEqual(metrics['handshake'], {'virtcyc': 100, 'virttime': 4,
+                                                'self_virtcyc': 100, 'calls': 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+"""Known-answer tests of papiprof.stats. The expected values are worked out
+by hand or come from closed forms and the usual t and normal tables."""
+import math
+import random
+import unittest
+from array import array
+
+from papiprof import stats
+from papiprof.stats import (RunningStats, SampleFilter, OUTLIERS_NONE, OUTLIERS_IQR,
+                            OUTLIERS_MAD, normal_quantile, z_critical_value,
+                            parse_confidence, percentile, student_t_two_sided_p,
+                            student_t_critical_value, welch_t_test,
+                            mann_whitney_u_test, hedges_g, relative_difference,
+                            holm_adjust, filter_samples, summarize_running_stats,
+                            summarize, bootstrap_mean_ci, normal_mean_ci)
+
+class NormalTest(unittest.TestCase):
+
+    def test_quantiles(self):
+        self.assertAlmostEqual(normal_quantile(0.5), 0.0, places=12)
+        self.assertAlmostEqual(normal_quantile(0.975), 1.959963984540054, places=12)
+        self.assertAlmostEqual(normal_quantile(0.001), -3.090232306167813, places=10)
+        self.assertAlmostEqual(z_critical_value(0.99), 2.575829303548901, places=12)
+
+    def test_invalid_confidence(self):
+        for confidence in (0, 1, 1.5, -0.1):
+            with self.assertRaises(ValueError):
+                z_critical_value(confidence)
+        with self.assertRaises(ValueError):
+            parse_confidence('95')
+        self.assertEqual(parse_confidence('0.97'), 0.97)
+
+    def test_percentile(self):
+        values = [10, 10, 11, 11, 12, 50]
+        self.assertEqual(percentile(values, 0), 10)
+        self.assertEqual(percentile(values, 25), 10.25)
+        self.assertEqual(percentile(values, 50), 11)
+        self.assertEqual(percentile(values, 75), 11.75)
+        self.assertEqual(percentile(values, 100), 50)
+
+class StudentTest(unittest.TestCase):
+
+    def test_two_sided_p(self):
+        # df=1 is the Cauchy distribution: p = 1 - 2 / pi * atan(t)
+        self.assertAlmostEqual(student_t_two_sided_p(1, 1), 0.5, places=12)
+        # df=2: p = 1 - t / sqrt(2 + t^2)
+        self.assertAlmostEqual(student_t_two_sided_p(2, 2), 1 - 2 / math.sqrt(6),
+                               places=12)
+        self.assertAlmostEqual(student_t_two_sided_p(1.96, math.inf),
+                               0.04999579029644087, places=12)
+
+    def test_critical_values(self):
+        self.assertAlmostEqual(student_t_critical_value(0.95, 10), 2.228139, places=5)
+        self.assertAlmostEqual(student_t_critical_value(0.95, 30), 2.042272, places=5)
+        self.assertAlmostEqual(student_t_critical_value(0.99, 1), 63.656741, places=4)
+
+class WelchTest(unittest.TestCase):
+
+    def test_known_answer(self):
+        # var_a / n_a = 0.8, var_b / n_b = 1.6, so t = 4 / sqrt(2.4) and
+        # df = 2.4^2 / (0.8^2 / 4 + 1.6^2 / 9) = 12.96
+        t, df, p = welch_t_test(10, 2, 5, 14, 4, 10)
+        self.assertAlmostEqual(t, 4 / math.sqrt(2.4), places=12)
+        self.assertAlmostEqual(df, 12.96, places=10)
+        # between the 0.05 (2.160) and 0.02 (2.650) critical values of df=13
+        self.assertTrue(0.02 < p < 0.05)
+
+    def test_equal_variances(self):
+        # t = 2 with df = 2 (n = 2 each)
+        t, df, p = welch_t_test(0, 1, 2, 2, 1, 2)
+        self.assertAlmostEqual(t, 2, places=12)
+        self.assertAlmostEqual(df, 2, places=12)
+        self.assertAlmostEqual(p, 1 - 2 / math.sqrt(6), places=12)
+
+    def test_no_variance(self):
+        self.assertEqual(welch_t_test(5, 0, 3, 5, 0, 3), (0.0, math.inf, 1.0))
+        t, _, p = welch_t_test(5, 0, 3, 6, 0, 3)
+        self.assertEqual((t, p), (math.inf, 0.0))
+
+class MannWhitneyTest(unittest.TestCase):
+
+    def test_separated_samples(self):
+        # U = 9 = 3 * 3, var(U) = 9 / 12 * 7, z = (9 - 4.5 - 0.5) / sqrt(5.25)
+        u, z, p, delta = mann_whitney_u_test([1, 2, 3], [4, 5, 6])
+        self.assertEqual(u, 9)
+        self.assertAlmostEqual(z, 4 / math.sqrt(5.25), places=12)
+        self.assertAlmostEqual(p, 0.0808555983700523, places=12)
+        self.assertEqual(delta, 1)
+        # the other way around
+        u, z, p_reversed, delta = mann_whitney_u_test([4, 5, 6], [1, 2, 3])
+        self.assertEqual((u, delta), (0, -1))
+        self.assertAlmostEqual(p_reversed, p, places=12)
+
+    def test_ties(self):
+        # ranks of b: 3 + 6 + 6 + 8 = 23, U = 23 - 10 = 13, tie term
+        # 2 * (3^3 - 3) = 48, var(U) = 16 / 12 * (9 - 48 / 56)
+        u, z, p, delta = mann_whitney_u_test([1, 2, 2, 3], [2, 3, 3, 4])
+        self.assertEqual(u, 13)
+        self.assertAlmostEqual(z, 4.5 / math.sqrt(16 / 12 * (9 - 48 / 56)), places=12)
+        self.assertAlmostEqual(p, math.erfc(z / math.sqrt(2)), places=12)
+        self.assertEqual(delta, 0.625)
+
+    def test_identical_samples(self):
+        u, z, p, delta = mann_whitney_u_test([1, 2, 3], [1, 2, 3])
+        self.assertEqual((u, z, p, delta), (4.5, 0.0, 1.0, 0.0))
+        self.assertEqual(mann_whitney_u_test([7, 7], [7, 7])[2], 1.0)
+
+class HolmTest(unittest.TestCase):
+
+    def test_known_answer(self):
+        # sorted: 0.005 * 4, 0.01 * 3, 0.03 * 2, 0.04 * 1 -> 0.06 by monotonicity
+        adjusted = holm_adjust([0.01, 0.04, 0.03, 0.005])
+        for value, expected in zip(adjusted, [0.03, 0.06, 0.06, 0.02]):
+            self.assertAlmostEqual(value, expected, places=12)
+
+    def test_capped_at_one(self):
+        self.assertEqual(holm_adjust([0.5, 0.9]), [1.0, 1.0])
+        self.assertEqual(holm_adjust([0.2]), [0.2])
+        self.assertEqual(holm_adjust([]), [])
+
+class EffectSizeTest(unittest.TestCase):
+
+    def test_hedges_g(self):
+        # pooled stdev 1, correction 1 - 3 / (4 * 18 - 1)
+        g, ci = hedges_g(0, 1, 10, 1, 1, 10)
+        self.assertAlmostEqual(g, 1 - 3 / 71, places=12)
+        half_width = 1.959963984540054 * math.sqrt(20 / 100 + g * g / 40)
+        self.assertAlmostEqual(ci[0], g - half_width, places=10)
+        self.assertAlmostEqual(ci[1], g + half_width, places=10)
+        # b - a
+        self.assertAlmostEqual(hedges_g(1, 1, 10, 0, 1, 10)[0], -g, places=12)
+
+    def test_hedges_g_undefined(self):
+        self.assertEqual(hedges_g(1, 0, 5, 2, 0, 5), (None, None))
+        self.assertEqual(hedges_g(1, 1, 1, 2, 1, 1), (None, None))
+
+    def test_relative_difference(self):
+        diff, ci = relative_difference(100, 10, 10, 110, 10, 10)
+        self.assertAlmostEqual(diff, 0.1, places=12)
+        self.assertTrue(ci[0] < 0.1 < ci[1])
+        self.assertAlmostEqual(ci[0] + ci[1], 0.2, places=12)
+        self.assertEqual(relative_difference(0, 1, 10, 1, 1, 10), (None, None))
+        # no spread, no interval
+        diff, (low, high) = relative_difference(100, 0, 1, 110, 0, 1)
+        self.assertEqual((low, high), (diff, diff))
+
+class FilterSamplesTest(unittest.TestCase):
+
+    def test_warmup_and_iqr(self):
+        # after the warm-up: q1 = 10.25, q3 = 11.75, so the fences are 8 and 14
+        values = [100, 90, 10, 11, 12, 10, 11, 50]
+        kept, rejected = filter_samples(values, SampleFilter(2, OUTLIERS_IQR, None, 0))
+        self.assertEqual(kept, [10, 11, 12, 10, 11])
+        self.assertEqual(rejected, {'warmup': 2, 'outliers': 1})
+
+    def test_threshold(self):
+        values = [10, 11, 12, 10, 11, 50]
+        kept, rejected = filter_samples(values, SampleFilter(0, OUTLIERS_IQR, 30, 0))
+        self.assertEqual(kept, values)
+        self.assertEqual(rejected, {'warmup': 0, 'outliers': 0})
+
+    def test_mad(self):
+        # median 10, MAD 1: the half width is 3.5 / 0.6745
+        values = [9, 10, 10, 11, 15, 10]
+        kept, rejected = filter_samples(values, SampleFilter(0, OUTLIERS_MAD, None, 0))
+        self.assertEqual(kept, [9, 10, 10, 11, 10])
+        self.assertEqual(rejected['outliers'], 1)
+        # a MAD of 0 rejects nothing
+        kept, _ = filter_samples([5, 5, 5, 9], SampleFilter(0, OUTLIERS_MAD, None, 0))
+        self.assertEqual(kept, [5, 5, 5, 9])
+
+    def test_keeps_a_sample(self):
+        kept, rejected = filter_samples([1, 2], SampleFilter(5, OUTLIERS_NONE, None, 0))
+        self.assertEqual(kept, [2])
+        self.assertEqual(rejected, {'warmup': 1, 'outliers': 0})
+        self.assertEqual(filter_samples([], SampleFilter(5, OUTLIERS_NONE, None, 0)),
+                         ([], {'warmup': 0, 'outliers': 0}))
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            filter_samples([1, 2, 3], SampleFilter(0, 'zscore', None, 0))
+
+class RunningStatsTest(unittest.TestCase):
+
+    def test_merge(self):
+        values = [3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0]
+        merged = RunningStats.from_values(values[:3])
+        merged.merge(RunningStats.from_values(values[3:]))
+        added = RunningStats()
+        for value in values:
+            added.add(value)
+        for stats in (merged, added):
+            self.assertEqual(stats.count, 8)
+            summary = summarize_running_stats(stats)
+            self.assertAlmostEqual(summary['avg'], 31 / 8, places=12)
+            self.assertAlmostEqual(summary['stdev'], math.sqrt(
+                sum((v - 31 / 8) ** 2 for v in values) / 7), places=12)
+            self.assertEqual((summary['min'], summary['max']), (1.0, 9.0))
+
+def _engines():
+    """The summary engines that can run here."""
+    engines = [('python', stats._summary_python)]
+    if stats.numpy is not None:
+        engines.append(('numpy', stats._summary_numpy))
+    return engines
+
+def _half_width(ci):
+    return (ci[1] - ci[0]) / 2
+
+class SummarizeTest(unittest.TestCase):
+
+    def test_known_answer(self):
+        # |x - 5.5| is 0.5, 0.5, 1.5, 1.5, ..., 4.5, 4.5: its median is 2.5
+        for name, engine in _engines():
+            summary = engine(array('d', range(1, 11)), (90,), 0.1)
+            self.assertAlmostEqual(summary.pop('stdev'), math.sqrt(55 / 6),
+                                   places=12, msg=name)
+            self.assertEqual(summary, {'avg': 5.5, 'min': 1, 'max': 10, 'median': 5.5,
+                                       'p90': 9.1, 'mad': 2.5, 'ci': None,
+                                       'trimmed_avg': 5.5}, msg=name)
+
+    @unittest.skipIf(stats.numpy is None, 'needs numpy')
+    def test_engines_agree(self):
+        rng = random.Random(1)
+        values = [float(round(rng.lognormvariate(10, 0.5))) for _ in range(10001)]
+        python = stats._summary_python(values, (50, 90, 99), 0.05)
+        vectorized = stats._summary_numpy(array('d', values), (50, 90, 99), 0.05)
+        self.assertEqual(python.keys(), vectorized.keys())
+        for key, value in python.items():
+            if value is not None:
+                self.assertAlmostEqual(vectorized[key] / value, 1, places=9, msg=key)
+
+    def test_summary(self):
+        summary = summarize([4.0, 4.0, 4.0])
+        self.assertEqual(list(summary), ['avg', 'stdev', 'min', 'max', 'median',
+                                         'p50', 'p90', 'p99', 'mad', 'ci'])
+        self.assertEqual(summary['ci'], [4.0, 4.0])
+        with self.assertRaises(ValueError):
+            summarize([])
+
+class BootstrapTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(2)
+        self.values = [rng.gauss(1000, 100) for _ in range(5000)]
+        mean = math.fsum(self.values) / len(self.values)
+        stdev = math.sqrt(math.fsum((v - mean) ** 2 for v in self.values)
+                          / (len(self.values) - 1))
+        self.normal_ci = normal_mean_ci(mean, stdev, len(self.values))
+
+    def assert_close_cis(self, ci, expected_ci, tolerance=0.1):
+        half_width = _half_width(expected_ci)
+        self.assertAlmostEqual(_half_width(ci) / half_width, 1, delta=tolerance)
+        self.assertAlmostEqual((ci[0] + ci[1]) / 2, (expected_ci[0] + expected_ci[1]) / 2,
+                               delta=tolerance * half_width)
+
+    def test_close_to_normal_approximation(self):
+        self.assert_close_cis(bootstrap_mean_ci(self.values, num_resamples=1000),
+                              self.normal_ci)
+
+    def test_batched_close_to_unbatched(self):
+        """The block bootstrap of the plain Python engine approximates the
+        bootstrap of the values."""
+        means = stats._bootstrap_means_python(self.values, 1000, random.Random(3),
+                                              math.inf)
+        batched_means = stats._bootstrap_means_python(self.values, 1000,
+                                                      random.Random(3), 500)
+        ci = [percentile(means, 2.5), percentile(means, 97.5)]
+        batched_ci = [percentile(batched_means, 2.5), percentile(batched_means, 97.5)]
+        # both have a Monte Carlo error of about 5%
+        self.assert_close_cis(batched_ci, ci, tolerance=0.15)
+        self.assert_close_cis(ci, self.normal_ci)
+
+    @unittest.skipIf(stats.numpy is None, 'needs numpy')
+    def test_numpy_resamples_the_values(self):
+        # more resamples than fit in a chunk
+        chunk = stats.NUMPY_BOOTSTRAP_CHUNK
+        stats.NUMPY_BOOTSTRAP_CHUNK = 3 * len(self.values)
+        try:
+            means = stats._bootstrap_means_numpy(self.values, 1000, random.Random(3))
+        finally:
+            stats.NUMPY_BOOTSTRAP_CHUNK = chunk
+        self.assertEqual(len(means), 1000)
+        self.assert_close_cis([percentile(means, 2.5), percentile(means, 97.5)],
+                              self.normal_ci)
+
+if __name__ == '__main__':
+    unittest.main()
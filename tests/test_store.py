@@ -0,0 +1,88 @@
+"""Tests of the results store of papiprof.store."""
+import tempfile
+import unittest
+from pathlib import Path
+
+from papiprof.store import INDEX_FILE, ResultsStore, StoreKey
+
+def client_key(ciphersuite, function='ssl_write', metric='virtcyc'):
+    return StoreKey('campaign', 'client', ciphersuite, '100', '200', function, metric)
+
+class ResultsStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / 'papi.store'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cut_short_index_line(self):
+        with ResultsStore(self.path) as store:
+            store.extend(client_key('60'), [1, 2, 3])
+        with ResultsStore(self.path) as store:
+            store.extend(client_key('61'), [4, 5])
+        index_path = self.path / INDEX_FILE
+        with open(index_path, 'r') as f:
+            lines = f.readlines()
+        with open(index_path, 'w') as f:
+            f.write(lines[0] + lines[1][:len(lines[1]) // 2])
+
+        store = ResultsStore(self.path)
+        self.assertEqual(store.keys(), [client_key('60')])
+        with open(index_path, 'r') as f:
+            self.assertEqual(f.readlines(), lines[:1])
+
+        # the next entry is on a line of its own
+        store.extend(client_key('62'), [6])
+        store.flush()
+        store = ResultsStore(self.path)
+        self.assertEqual(store.keys(), [client_key('60'), client_key('62')])
+        self.assertEqual(list(store.load(ciphersuite='62')[client_key('62')]), [6])
+
+    def test_missing_final_newline(self):
+        with ResultsStore(self.path) as store:
+            store.extend(client_key('60'), [1, 2, 3])
+        index_path = self.path / INDEX_FILE
+        with open(index_path, 'r') as f:
+            line = f.read()
+        with open(index_path, 'w') as f:
+            f.write(line.rstrip('\n'))
+
+        with ResultsStore(self.path) as store:
+            store.extend(client_key('61'), [4])
+        store = ResultsStore(self.path)
+        self.assertEqual(store.keys(), [client_key('60'), client_key('61')])
+
+    def test_series_index(self):
+        store = ResultsStore(self.path, block_size=2)
+        for value in range(5):
+            store.append(client_key('60'), value)
+            store.append(client_key('60', metric='virttime'), -value)
+            store.append(client_key('61'), 10 + value)
+        store.append_summaries({client_key('63'): {'num_runs': 3, 'avg': 1, 'stdev': 0}})
+
+        config = {'campaign': 'campaign', 'entity': 'client', 'ciphersuite': '60',
+                  'bytes_sent': 100, 'bytes_received': 200}
+        self.assertEqual(store.keys(**config),
+                         [client_key('60'), client_key('60', metric='virttime')])
+        self.assertEqual(dict(store.iter_series(**config, metric='virtcyc')),
+                         {client_key('60'): store.load(ciphersuite='60',
+                                                       metric='virtcyc')[client_key('60')]})
+        self.assertEqual(list(store.load(**config)[client_key('60')]), [0, 1, 2, 3, 4])
+        stats = store.running_stats(ciphersuite=['60', '61'], metric='virtcyc')
+        self.assertEqual({key: (s.count, s.mean) for key, s in stats.items()},
+                         {client_key('60'): (5, 2), client_key('61'): (5, 12)})
+        self.assertEqual(list(store.load_summaries()), [client_key('63')])
+
+        # appends and removals show up without reloading the index
+        store.append(client_key('62'), 7)
+        self.assertEqual(list(store.load(ciphersuite='62')[client_key('62')]), [7])
+        self.assertEqual(store.remove(ciphersuite='60'), 6)
+        self.assertEqual(store.keys(**config), [])
+        self.assertEqual(store.keys(), [client_key('61'), client_key('63'),
+                                        client_key('62')])
+        self.assertEqual(ResultsStore(self.path).keys(), store.keys())
+
+if __name__ == '__main__':
+    unittest.main()
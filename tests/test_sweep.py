@@ -0,0 +1,108 @@
+"""Tests of the size grids and scaling fits of papiprof.sweep."""
+import unittest
+
+from papiprof.sweep import (MODEL_LINEAR, MODEL_PIECEWISE, log_spaced_sizes,
+                            parse_size_grid, fit_scaling_curve, predict_cost,
+                            find_break_even_sizes)
+
+def exact_points(cost, sizes, count=3):
+    """(size, count, mean, within_ss) of `count` samples of exactly cost(size)
+    at each size."""
+    return [(size, count, cost(size), 0.0) for size in sizes]
+
+class SizeGridTest(unittest.TestCase):
+
+    def test_grids(self):
+        self.assertEqual(parse_size_grid('1024,4096, 16384'), [1024, 4096, 16384])
+        self.assertEqual(parse_size_grid('range:0:10000:2500'), [0, 2500, 5000, 7500])
+        self.assertEqual(parse_size_grid('log:64:1048576:5'),
+                         [64, 724, 8192, 92682, 1048576])
+        self.assertEqual(log_spaced_sizes(1, 4, 3), [1, 2, 4])
+        # duplicates after rounding are dropped
+        self.assertEqual(log_spaced_sizes(1, 2, 5), [1, 2])
+
+    def test_invalid_grids(self):
+        for spec in ('log:64:1024', 'log:0:1024:4', 'lin:1:2:3', '1,a'):
+            with self.assertRaises(ValueError, msg=spec):
+                parse_size_grid(spec)
+
+class FitTest(unittest.TestCase):
+
+    def test_linear(self):
+        fit = fit_scaling_curve(exact_points(lambda x: 1000 + 3 * x,
+                                             [0, 1000, 2000, 4000, 8000]))
+        self.assertEqual(fit['model'], MODEL_LINEAR)
+        self.assertAlmostEqual(fit['overhead'], 1000, places=6)
+        self.assertAlmostEqual(fit['cycles_per_byte'], 3, places=9)
+        self.assertAlmostEqual(fit['r2'], 1, places=9)
+        self.assertEqual((fit['num_sizes'], fit['num_samples']), (5, 15))
+        self.assertEqual((fit['min_size'], fit['max_size']), (0, 8000))
+
+    def test_piecewise(self):
+        # 10 cycles per byte up to 1000 bytes, 2 above
+        cost = lambda x: 100 + 10 * x - 8 * max(0, x - 1000)
+        fit = fit_scaling_curve(exact_points(cost, [0, 500, 1000, 2000, 4000, 8000]))
+        self.assertEqual(fit['model'], MODEL_PIECEWISE)
+        self.assertEqual(fit['knee'], 1000)
+        self.assertAlmostEqual(fit['overhead'], 100, places=6)
+        self.assertAlmostEqual(fit['slope_below_knee'], 10, places=9)
+        self.assertAlmostEqual(fit['cycles_per_byte'], 2, places=9)
+        for size in (0, 700, 1000, 3000, 10000):
+            self.assertAlmostEqual(predict_cost(fit, size), cost(size), places=4)
+        # the linear fit is kept for comparison
+        self.assertLess(fit['linear']['r2'], fit['r2'])
+
+    def test_noisy_linear(self):
+        # the spread within each size doesn't move the fit of the means
+        points = [(size, 4, 50 + 2 * size, 8.0) for size in (0, 100, 200, 400)]
+        fit = fit_scaling_curve(points)
+        self.assertAlmostEqual(fit['cycles_per_byte'], 2, places=9)
+        self.assertGreater(fit['linear']['cycles_per_byte_se'], 0)
+        self.assertLess(fit['r2'], 1)
+
+    def test_too_few_sizes(self):
+        self.assertIsNone(fit_scaling_curve([(100, 10, 5.0, 1.0)]))
+        self.assertIsNone(fit_scaling_curve([(100, 1, 5.0, 0.0), (200, 1, 6.0, 0.0)]))
+
+class BreakEvenTest(unittest.TestCase):
+
+    def test_crossing(self):
+        sizes = [0, 1000, 2000, 4000]
+        fits = {
+            ('client', 'transfer', '60'): fit_scaling_curve(
+                exact_points(lambda x: 1000 + x, sizes)),
+            ('client', 'transfer', '174'): fit_scaling_curve(
+                exact_points(lambda x: 3 * x, sizes)),
+        }
+        [break_even] = find_break_even_sizes(fits)
+        self.assertAlmostEqual(break_even['size'], 500, places=6)
+        self.assertEqual((break_even['cheaper_below'], break_even['cheaper_above']),
+                         ('174', '60'))
+        self.assertEqual((break_even['entity'], break_even['function']),
+                         ('client', 'transfer'))
+        self.assertFalse(break_even['extrapolated'])
+
+    def test_parallel_costs_dont_cross(self):
+        sizes = [0, 1000, 2000, 4000]
+        fits = {
+            ('client', 'transfer', '60'): fit_scaling_curve(
+                exact_points(lambda x: 1000 + 2 * x, sizes)),
+            ('client', 'transfer', '174'): fit_scaling_curve(
+                exact_points(lambda x: 2 * x, sizes)),
+        }
+        self.assertEqual(find_break_even_sizes(fits), [])
+
+    def test_extrapolated(self):
+        sizes = [0, 100, 200, 400]
+        fits = {
+            ('server', 'transfer', '60'): fit_scaling_curve(
+                exact_points(lambda x: 1000 + x, sizes)),
+            ('server', 'transfer', '174'): fit_scaling_curve(
+                exact_points(lambda x: 2 * x, sizes)),
+        }
+        [break_even] = find_break_even_sizes(fits)
+        self.assertAlmostEqual(break_even['size'], 1000, places=6)
+        self.assertTrue(break_even['extrapolated'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,11 @@
 #!/bin/bash
 
-# This is a helper script to fix the CPU speed to a cerntain frequency
-sudo cpufreq-set -c 0 -d 800MHz -u 2.40GHz -g powersave
-sudo cpufreq-set -c 1 -d 800MHz -u 2.40GHz -g powersave
-sudo cpufreq-set -c 2 -d 800MHz -u 2.40GHz -g powersave
-sudo cpufreq-set -c 3 -d 800MHz -u 2.40GHz -g powersave
-sudo cpufreq-set -c 4 -d 800MHz -u 2.40GHz -g powersave
-sudo cpufreq-set -c 5 -d 800MHz -u 2.40GHz -g powersave
-sudo cpufreq-set -c 6 -d 800MHz -u 2.40GHz -g powersave
-sudo cpufreq-set -c 7 -d 800MHz -u 2.40GHz -g powersave
+# This is a helper script to restore the CPU speed of all of the CPUs to the
+# full range of their frequencies
+for cpu in /sys/devices/system/cpu/cpu[0-9]*; do
+    min_freq=$(cat $cpu/cpufreq/cpuinfo_min_freq)
+    max_freq=$(cat $cpu/cpufreq/cpuinfo_max_freq)
+    sudo cpufreq-set -c "${cpu##*cpu}" -d ${min_freq}kHz -u ${max_freq}kHz -g powersave
+done
 
 echo -e "CPU frequency restored to original value You can check this with\n\tcpupower frequency-info"